@@ -3,14 +3,21 @@
 """
 图片格式转换工具打包脚本
 自动化PyInstaller打包过程
+
+用法：
+    python build_exe.py            # 单文件版（--onefile）
+    python build_exe.py --onedir   # 文件夹版：不压缩、不解压，启动更快
 """
 
+import argparse
 import os
 import sys
 import subprocess
 import shutil
 from pathlib import Path
 
+APP_NAME = '图片格式转换工具'
+
 def clean_build_dirs():
     """清理之前的构建目录"""
     dirs_to_clean = ['build', 'dist', '__pycache__']
@@ -36,19 +43,42 @@ def check_pyinstaller():
         print("PyInstaller未安装，请先运行：pip install -r requirements_build.txt")
         return False
 
-def build_executable():
-    """构建可执行文件"""
+def exe_path(onedir):
+    """打包生成的可执行文件路径"""
+    if onedir:
+        return os.path.join('dist', APP_NAME, f'{APP_NAME}.exe')
+    return os.path.join('dist', f'{APP_NAME}.exe')
+
+def folder_size_mb(folder):
+    """文件夹中所有文件的总大小（MB）"""
+    total = sum(path.stat().st_size for path in Path(folder).rglob('*') if path.is_file())
+    return total / (1024 * 1024)
+
+def build_executable(onedir=False):
+    """构建可执行文件
+    
+    单文件版每次启动都要把整个程序解压到临时文件夹，在杀毒软件扫描较严的电脑上需要数秒；
+    onedir 为 True 时打包为文件夹版，文件直接放在exe旁边，并且不用UPX压缩，
+    启动时不需要解压。
+    """
     if not check_pyinstaller():
         return False
     
     print("开始打包程序...")
     
     # PyInstaller命令参数
+    if onedir:
+        mode_args = [
+            '--onedir',                 # 打包成文件夹，启动时不需要解压
+            '--noupx',                  # 不用UPX压缩，启动时不需要解压缩各个DLL
+        ]
+    else:
+        mode_args = ['--onefile']       # 打包成单个文件
     cmd = [
         'pyinstaller',
-        '--onefile',                    # 打包成单个文件
+        *mode_args,
         '--windowed',                   # Windows下隐藏控制台窗口
-        '--name=图片格式转换工具',         # 设置可执行文件名称
+        f'--name={APP_NAME}',           # 设置可执行文件名称
         '--add-data=README.md;.',       # 包含README文件
         '--hidden-import=PIL._tkinter_finder',  # 确保PIL与tkinter兼容
         '--hidden-import=tkinter',      # 确保包含tkinter
@@ -63,13 +93,14 @@ def build_executable():
         
         if result.returncode == 0:
             print("\n✅ 打包成功！")
-            print(f"📁 可执行文件位置: {os.path.abspath('dist')}")
-            print("📋 可执行文件: 图片格式转换工具.exe")
+            print(f"📁 可执行文件位置: {os.path.abspath(os.path.dirname(exe_path(onedir)))}")
+            print(f"📋 可执行文件: {APP_NAME}.exe")
             
             # 检查文件大小
-            exe_path = os.path.join('dist', '图片格式转换工具.exe')
-            if os.path.exists(exe_path):
-                size_mb = os.path.getsize(exe_path) / (1024 * 1024)
+            if onedir and os.path.isdir(os.path.join('dist', APP_NAME)):
+                print(f"📏 文件夹大小: {folder_size_mb(os.path.join('dist', APP_NAME)):.1f} MB")
+            elif os.path.exists(exe_path(onedir)):
+                size_mb = os.path.getsize(exe_path(onedir)) / (1024 * 1024)
                 print(f"📏 文件大小: {size_mb:.1f} MB")
             
             return True
@@ -81,8 +112,8 @@ def build_executable():
         print(f"❌ 打包过程中出现错误: {e}")
         return False
 
-def create_portable_package():
-    """创建便携版打包"""
+def create_portable_package(onedir=False):
+    """创建便携版打包（文件夹版时复制整个程序文件夹）"""
     dist_dir = Path('dist')
     if not dist_dir.exists():
         print("❌ 未找到dist目录，请先执行打包")
@@ -93,12 +124,14 @@ def create_portable_package():
     if portable_dir.exists():
         shutil.rmtree(portable_dir)
     
-    portable_dir.mkdir()
-    
     # 复制可执行文件
-    exe_file = dist_dir / '图片格式转换工具.exe'
-    if exe_file.exists():
-        shutil.copy2(exe_file, portable_dir / '图片格式转换工具.exe')
+    if onedir:
+        shutil.copytree(dist_dir / APP_NAME, portable_dir)
+    else:
+        portable_dir.mkdir()
+        exe_file = Path(exe_path(onedir))
+        if exe_file.exists():
+            shutil.copy2(exe_file, portable_dir / f'{APP_NAME}.exe')
     
     # 复制说明文件
     if Path('README.md').exists():
@@ -139,6 +172,11 @@ def create_portable_package():
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="打包图片格式转换工具")
+    parser.add_argument('--onedir', action='store_true',
+                        help="打包为文件夹版（不压缩、不解压，启动更快），默认为单文件版")
+    args = parser.parse_args()
+    
     print("=" * 50)
     print("图片格式转换工具 - 打包脚本")
     print("=" * 50)
@@ -147,17 +185,20 @@ def main():
     clean_build_dirs()
     
     # 构建可执行文件
-    if build_executable():
+    if build_executable(args.onedir):
         print("\n" + "=" * 50)
         
         # 询问是否创建便携版
         choice = input("是否创建便携版打包？(y/n): ").lower()
         if choice in ['y', 'yes', '是']:
-            create_portable_package()
+            create_portable_package(args.onedir)
         
         print("\n🎉 打包完成！")
         print("\n📝 使用说明：")
-        print("1. 将dist目录中的exe文件分发给其他用户")
+        if args.onedir:
+            print(f"1. 将dist目录中的“{APP_NAME}”文件夹整个分发给其他用户")
+        else:
+            print("1. 将dist目录中的exe文件分发给其他用户")
         print("2. 用户双击exe文件即可直接使用")
         print("3. 无需安装Python环境或任何依赖")
         
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压缩包输入与输出
+直接转换 zip/tar 压缩包中的图片，不先解压到磁盘：zip 和未压缩的 tar 由工作进程
+按需读取各自的文件，压缩的 tar（.tar.gz 等）只能顺序读取，由主进程边解压边把
+文件内容随任务交给工作进程；输出到 .zip 时编码结果由写入线程直接写入压缩包。
+压缩包中的文件用“压缩包路径/包内路径”表示，与文件夹中的文件一样生成任务
+"""
+
+import io
+import os
+import tarfile
+import time
+import zipfile
+from datetime import datetime
+
+import converter_writer
+
+
+# 输出压缩包只支持 zip（tar 需要预先知道每个文件的大小，且不能随机读取）
+OUTPUT_SUFFIX = ".zip"
+# 去掉这些后缀得到压缩包的名字，用于默认输出文件夹
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# 顺序读取压缩的 tar 时，已读入内存、尚未转换完成的文件内容之和的上限（字节）
+STREAM_MEMORY_LIMIT = 256 * 2 ** 20
+# macOS 压缩时附带的资源文件夹，其中的 ._ 文件与图片同名但不是图片
+SKIPPED_FOLDERS = ("__MACOSX",)
+
+# 工作进程中打开的 zip 文件：压缩包路径 -> ((修改时间, 大小), ZipFile)，
+# 每个进程只解析一次中央目录
+_open_zips = {}
+
+
+def is_archive(path):
+    """输入路径是否为 zip 或 tar 压缩包"""
+    if not os.path.isfile(path):
+        return False
+    try:
+        return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+    except OSError:
+        return False
+
+
+def is_output_archive(path):
+    """输出路径是否为 zip 压缩包（按扩展名判断，文件可以还不存在；
+    以 .zip 结尾的已有文件夹仍当作文件夹）"""
+    return path.lower().endswith(OUTPUT_SUFFIX) and not os.path.isdir(path)
+
+
+def is_streamed(archive_path):
+    """是否为只能顺序读取一遍的压缩 tar（zip 和未压缩的 tar 可以按需读取其中的文件）"""
+    if zipfile.is_zipfile(archive_path):
+        return False
+    try:
+        with tarfile.open(archive_path, 'r:'):
+            return False
+    except tarfile.ReadError:
+        return True
+
+
+def archive_stem(path):
+    """去掉压缩包后缀的文件名，如 photos.tar.gz -> photos"""
+    name = os.path.basename(path)
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def default_output_folder(archive_path):
+    """压缩包所在文件夹中以压缩包名和当前日期命名的默认输出文件夹"""
+    current_date = datetime.now().strftime("%Y%m%d")
+    return os.path.join(os.path.dirname(os.path.abspath(archive_path)),
+                        f"{archive_stem(archive_path)}-imgTrans-{current_date}")
+
+
+def side_folder(output_folder):
+    """保存日志、耗时明细等附带文件的文件夹：输出到压缩包时为压缩包所在的文件夹"""
+    if is_output_archive(output_folder):
+        return os.path.dirname(os.path.abspath(output_folder))
+    return output_folder
+
+
+def safe_member_name(name):
+    """压缩包中的文件名转为安全的相对路径（去掉开头的 / 和 .），
+    包含 .. 或盘符、位于跳过的文件夹中时返回 None，避免输出到输出文件夹之外"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or ':' in parts[0] or parts[0] in SKIPPED_FOLDERS:
+        return None
+    return '/'.join(parts)
+
+
+def check_settings(settings, input_path, output_path):
+    """输入或输出为压缩包时检查设置是否支持，不支持时抛出 ValueError"""
+    input_archive = is_archive(input_path)
+    output_archive = is_output_archive(output_path)
+    if not (input_archive or output_archive):
+        return
+    if settings['incremental'] or settings['resume'] or settings['cluster']:
+        # 清单、转换日志和协同转换的标记按文件夹中的文件记录
+        raise ValueError("压缩包输入或输出时不支持增量转换、断点续转和多节点协同转换！")
+    if settings['dedupe'] != "off":
+        raise ValueError("压缩包输入或输出时不支持合并重复文件！")
+    if settings['memory_budget_mb']:
+        # 分块处理从文件中按条带读取，并直接写入输出文件
+        raise ValueError("压缩包输入或输出时不支持单个进程的内存预算（分块处理）！")
+    if input_archive and settings['memory_limit_mb']:
+        # 大图优先只是调度偏好，压缩包输入时按包内顺序转换，不报错
+        raise ValueError("压缩包输入时不支持预扫描文件头，不能限制总内存！")
+    if input_archive and settings['adjustment_type'] == "budget" and is_streamed(input_path):
+        # 按总大小预算调整需要读取两遍
+        raise ValueError("压缩的 tar 只能顺序读取一遍，不支持按总大小预算调整，"
+                         "请改用 zip 或未压缩的 tar！")
+    if output_archive and settings['frame_mode'] != "first":
+        # 逐帧输出和动画PNG在工作进程中直接写入文件
+        raise ValueError("输出到压缩包时只能转换多帧图片的第一帧！")
+
+
+def _iter_zip(archive_path, wanted):
+    with zipfile.ZipFile(archive_path) as zf:
+        for info in zf.infolist():
+            name = safe_member_name(info.filename)
+            if not info.is_dir() and wanted(name):
+                yield name, {'path': archive_path, 'member': info.filename,
+                             'size': info.file_size}
+
+
+def _iter_tar(archive_path, wanted):
+    try:
+        tar = tarfile.open(archive_path, 'r:')
+        streamed = False
+    except tarfile.ReadError:
+        # 压缩的 tar 只能从头到尾解压一遍，文件内容在读到时随任务传给工作进程
+        tar = tarfile.open(archive_path, 'r|*')
+        streamed = True
+    with tar:
+        for member in tar:
+            name = safe_member_name(member.name)
+            if not member.isfile() or not wanted(name):
+                continue
+            archive = {'path': archive_path, 'member': member.name, 'size': member.size}
+            if streamed or member.issparse():
+                # 必须在读取下一个文件头之前读出内容
+                archive['data'] = tar.extractfile(member).read()
+            else:
+                # 未压缩的 tar 记录文件内容的位置，工作进程直接读取这一段
+                archive['offset'] = member.offset_data
+            yield name, archive
+
+
+def iter_members(archive_path, extensions, recursive=False):
+    """按包内顺序逐个产出压缩包中扩展名属于 extensions 的文件 (包内路径, 读取信息)
+    
+    包内路径用 / 分隔；读取信息交给 open_member 打开该文件，顺序读取的压缩 tar
+    中的文件内容在产出前读入 data。recursive 为 False 时只包含最外层的文件。
+    """
+    def wanted(name):
+        return (name is not None and (recursive or '/' not in name)
+                and os.path.splitext(name)[1].lower() in extensions)
+    
+    if zipfile.is_zipfile(archive_path):
+        return _iter_zip(archive_path, wanted)
+    return _iter_tar(archive_path, wanted)
+
+
+def open_member(archive):
+    """打开压缩包中的一个文件，返回交给 Image.open 的文件对象
+    
+    zip 中的文件边解压边读取（Pillow需要往回定位时 zipfile 会重新解压），
+    未压缩 tar 中的文件只读取这一段，已经读入的内容直接包装为 BytesIO。
+    """
+    data = archive.get('data')
+    if data is not None:
+        return io.BytesIO(data)
+    if 'offset' in archive:
+        with open(archive['path'], 'rb') as f:
+            f.seek(archive['offset'])
+            return io.BytesIO(f.read(archive['size']))
+    
+    stat = os.stat(archive['path'])
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _open_zips.get(archive['path'])
+    if cached is None or cached[0] != key:
+        if cached is not None:
+            cached[1].close()  # 压缩包在两次转换之间被替换
+        cached = _open_zips[archive['path']] = (key, zipfile.ZipFile(archive['path']))
+    return cached[1].open(archive['member'])
+
+
+def close_archives():
+    """关闭当前进程中打开的 zip 文件（Windows上打开的文件不能被替换或删除）"""
+    for _, zf in _open_zips.values():
+        zf.close()
+    _open_zips.clear()
+
+
+class ArchiveWriter(converter_writer.OutputWriter):
+    """把编码结果写入 zip 压缩包的后台写入线程
+    
+    接口与 OutputWriter 相同。压缩包先写入同一文件夹中的临时文件，close 时
+    改名为目标文件；zip 只能顺序写入，因此只用一个写入线程，按提交顺序写入，
+    编码数据从缓冲区直接写入压缩包，不复制。图片已经压缩过，包内文件不再压缩。
+    输出路径为“压缩包路径/包内路径”，同名的文件不会覆盖，第二个记为写入失败。
+    """
+    
+    def __init__(self, archive_path, max_pending=8, fsync=False):
+        super().__init__(threads=1, max_pending=max_pending, ordered=True)
+        self.archive_path = archive_path
+        self.fsync = fsync
+        self.temp_path = converter_writer.temp_path_for(archive_path)
+        self.file = open(self.temp_path, 'wb')
+        self.zip = zipfile.ZipFile(self.file, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self.names = set()
+    
+    def member_name(self, output_path):
+        """输出路径在压缩包中的文件名"""
+        return os.path.relpath(output_path, self.archive_path).replace(os.sep, '/')
+    
+    def _write(self, result):
+        outputs, result['outputs'] = result['outputs'], []
+        start = time.perf_counter()
+        try:
+            for path, data in outputs:
+                name = self.member_name(path)
+                if name in self.names:
+                    raise ValueError(f"压缩包中已有同名文件 {name}")
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.external_attr = 0o644 << 16
+                with converter_writer.data_view(data) as view:
+                    self.zip.writestr(info, view)
+                    result['bytes_out'] += view.nbytes
+                self.names.add(name)
+        except (OSError, ValueError) as e:
+            result['success'] = False
+            result['error'] = f"写入失败: {e}"
+        finally:
+            elapsed = time.perf_counter() - start
+            timings = result['timings']
+            timings['write'] = round(timings.get('write', 0.0) + elapsed, 6)
+            result['elapsed'] = round(result['elapsed'] + elapsed, 6)
+        return []
+    
+    def close(self):
+        """写完所有结果后写入压缩包的目录并改名为目标文件，返回剩余的结果记录"""
+        try:
+            finished = super().close()
+            self.zip.close()
+            if self.fsync:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self.temp_path, self.archive_path)
+        except BaseException:
+            self.file.close()
+            converter_writer.remove_quietly(self.temp_path)
+            raise
+        return finished
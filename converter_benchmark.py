@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片转换性能基准测试
+离线生成固定的合成图片集，对每种输出格式和调整方式运行批量转换，
+统计吞吐量、单文件耗时分位数、峰值内存和编码次数，结果保存为JSON，
+并可与之前的结果比较，超过阈值时判定为性能退化
+
+用法示例：
+    python converter_benchmark.py -o baseline.json
+    python converter_benchmark.py --compare baseline.json --threshold 10
+    python converter_benchmark.py --startup -o startup.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import PIL
+from PIL import Image, ImageDraw, features
+
+import converter_engine
+
+try:
+    import resource
+except ImportError:  # Windows没有 resource 模块，不统计峰值内存
+    resource = None
+
+
+# 图片集版本，生成方式变化时递增，旧的图片集会被重新生成
+CORPUS_VERSION = 1
+CORPUS_SEED = 20240601
+CORPUS_INFO_FILENAME = "corpus.json"
+# 图片尺寸档位
+CORPUS_SIZES = {
+    'small': (640, 480),
+    'large': (2400, 1600),
+}
+CORPUS_MODES = ['RGB', 'RGBA', 'LA', 'P']
+# 输入格式：扩展名 -> (Pillow格式名, 可以保存的模式)
+CORPUS_FORMATS = {
+    'tif': ('TIFF', ('RGB', 'RGBA', 'LA', 'P')),
+    'png': ('PNG', ('RGB', 'RGBA', 'LA', 'P')),
+    'webp': ('WEBP', ('RGB', 'RGBA')),
+    'jpg': ('JPEG', ('RGB',)),
+    'gif': ('GIF', ('P',)),
+    'bmp': ('BMP', ('RGB', 'RGBA', 'P')),
+}
+# 各调整方式使用的参数
+BENCHMARK_ADJUSTMENTS = {
+    'none': {},
+    'scale': {'scale_percentage': 50},
+    'filesize': {'target_filesize': 100},
+    'quality': {'quality_level': 7},
+}
+# 回归检查的指标：指标名 -> 数值越大越好时为 True
+REGRESSION_METRICS = {
+    'files_per_sec': True,
+    'latency_p90_ms': False,
+    'peak_rss_mb': False,
+    'encodes': False,
+}
+# 启动时间的回归检查指标（都是越小越好）
+STARTUP_REGRESSION_METRICS = {
+    'wall_ms': False,
+    'import_ms': False,
+}
+DEFAULT_THRESHOLD = 10.0
+# 启动时间测试：每项运行的次数（取中位数）和报告中列出的导入最慢的模块数
+STARTUP_RUNS = 5
+STARTUP_TOP_MODULES = 8
+# 启动时间测试的各项：名称 -> 在新的Python进程中运行的代码
+STARTUP_SCRIPTS = {
+    # 图形界面模块（窗口显示前需要导入的部分）
+    'import_gui': "import image_converter",
+    'import_cli': "import converter_cli",
+    # 从进程启动到第一个文件转换完成（导入转换引擎、注册Pillow插件、解码和编码）
+    'first_file': (
+        "import sys, converter_engine\n"
+        "settings = converter_engine.make_settings(workers=1)\n"
+        "task = next(converter_engine.iter_tasks([sys.argv[1]], sys.argv[2], sys.argv[3],"
+        " settings, []))\n"
+        "assert converter_engine.convert_image_file(task)['success']\n"
+    ),
+}
+RESULTS_VERSION = 1
+
+
+def default_corpus_folder():
+    """默认的图片集文件夹（系统临时目录下，生成一次后复用）"""
+    return os.path.join(tempfile.gettempdir(), f"imgtrans-benchmark-corpus-v{CORPUS_VERSION}")
+
+
+def synthetic_image(size, mode, seed):
+    """生成一张确定的合成图片
+    
+    平滑渐变、随机几何图形和噪声叠加，压缩难度接近照片；
+    相同的尺寸、模式和种子总是生成相同的像素。
+    """
+    rng = random.Random(seed)
+    width, height = size
+    
+    gradient = Image.linear_gradient('L')
+    channels = (gradient.resize(size),
+                Image.radial_gradient('L').resize(size),
+                gradient.transpose(Image.Transpose.ROTATE_90).resize(size))
+    img = Image.merge('RGB', channels)
+    
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1 = x0 + rng.randrange(8, max(9, width // 4))
+        y1 = y0 + rng.randrange(8, max(9, height // 4))
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+    
+    # 平铺一块固定的随机噪声
+    noise_tile = Image.frombytes('RGB', (256, 256), rng.randbytes(256 * 256 * 3))
+    noise = Image.new('RGB', size)
+    for y in range(0, height, 256):
+        for x in range(0, width, 256):
+            noise.paste(noise_tile, (x, y))
+    img = Image.blend(img, noise, 0.15)
+    
+    if mode in ('RGBA', 'LA'):
+        alpha = Image.radial_gradient('L').resize(size)
+        base = img if mode == 'RGBA' else img.convert('L')
+        img = Image.merge(mode, base.split() + (alpha,))
+    elif mode == 'P':
+        img = img.quantize(256)
+    return img
+
+
+def ensure_corpus(folder, sizes):
+    """生成（或复用已有的）图片集，返回图片集信息
+    
+    每个尺寸档位一个子文件夹，包含所有格式与模式的可用组合。
+    """
+    info_path = os.path.join(folder, CORPUS_INFO_FILENAME)
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        info = {}
+    if (info.get('version') == CORPUS_VERSION and info.get('pillow') == PIL.__version__
+            and all(size in info.get('sizes', {}) for size in sizes)):
+        return info
+    
+    info = {'version': CORPUS_VERSION, 'seed': CORPUS_SEED, 'pillow': PIL.__version__,
+            'sizes': {}}
+    for size_name in sizes:
+        size_folder = os.path.join(folder, size_name)
+        os.makedirs(size_folder, exist_ok=True)
+        files = {}
+        for mode_index, mode in enumerate(CORPUS_MODES):
+            img = synthetic_image(CORPUS_SIZES[size_name], mode, CORPUS_SEED + mode_index)
+            for extension, (pil_format, modes) in CORPUS_FORMATS.items():
+                if mode not in modes or (pil_format == 'WEBP' and not features.check('webp')):
+                    continue
+                filename = f"{mode.lower()}.{extension}"
+                img.save(os.path.join(size_folder, filename), format=pil_format)
+                files[filename] = os.path.getsize(os.path.join(size_folder, filename))
+        info['sizes'][size_name] = files
+    
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return info
+
+
+def percentile(values, percent):
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(percent / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb(who):
+    """进程（或已结束的子进程）的峰值常驻内存（MB），无法统计时返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    divisor = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    return round(peak / divisor, 1)
+
+
+def run_scenario(input_folder, output_format, adjustment_type, workers, preset="balanced"):
+    """在当前进程中运行一个场景，返回统计结果"""
+    settings = converter_engine.make_settings(
+        output_format=output_format, adjustment_type=adjustment_type, workers=workers,
+        encoder_preset=preset, **BENCHMARK_ADJUSTMENTS[adjustment_type])
+    results = []
+    
+    with tempfile.TemporaryDirectory(prefix="imgtrans-benchmark-") as output_folder:
+        start_time = time.perf_counter()
+        summary = converter_engine.run_batch(
+            input_folder, output_folder, settings,
+            on_result=lambda result, completed, total: results.append(result))
+        elapsed = time.perf_counter() - start_time
+        bytes_out = sum(os.path.getsize(result['output_path'])
+                        for result in results if result['success'])
+    
+    bytes_in = sum(entry.stat().st_size for entry in os.scandir(input_folder)
+                   if entry.name != CORPUS_INFO_FILENAME)
+    latencies = [result['elapsed'] * 1000 for result in results]
+    main_rss = peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+    worker_rss = peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+    return {
+        'files': summary['total'],
+        'failed': summary['failed'],
+        'elapsed': round(elapsed, 3),
+        'files_per_sec': round(summary['total'] / elapsed, 2),
+        'mb_per_sec': round(bytes_in / 2 ** 20 / elapsed, 2),
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'latency_p50_ms': round(percentile(latencies, 50), 1),
+        'latency_p90_ms': round(percentile(latencies, 90), 1),
+        'latency_p99_ms': round(percentile(latencies, 99), 1),
+        'latency_max_ms': round(max(latencies, default=0.0), 1),
+        'peak_rss_mb': max(filter(None, (main_rss, worker_rss)), default=None),
+        'encodes': summary['encodes'],
+        'full_encodes': summary['full_encodes'],
+        'png_trials': summary['png_trials'],
+        'stages': {name: stage['seconds'] for name, stage in summary['metrics']['stages'].items()},
+        'errors': sorted({result['error'] for result in results if result['error']}),
+    }
+
+
+def measure_flatten(input_folder, repeat=3):
+    """测量透明背景合成的吞吐量（百万像素/秒），只统计带透明通道或透明色的图片"""
+    throughput = {}
+    for entry in sorted(os.scandir(input_folder), key=lambda entry: entry.name):
+        if os.path.splitext(entry.name)[1] not in ('.png', '.tif', '.gif'):
+            continue
+        with Image.open(entry.path) as img:
+            img.load()
+            if 'A' not in img.getbands() and 'transparency' not in img.info:
+                continue
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                converter_engine.flatten_alpha(img, 'jpg')
+            elapsed = (time.perf_counter() - start_time) / repeat
+            throughput[entry.name] = round(img.size[0] * img.size[1] / 1e6 / elapsed, 1)
+    return throughput
+
+
+def _isolated_process(connection, function, args):
+    connection.send(function(*args))
+    connection.close()
+
+
+def run_isolated(function, *args):
+    """在新的进程中运行函数并返回结果
+    
+    Linux上子进程的峰值内存会继承父进程创建它时的内存占用，因此生成图片集和
+    每个场景都在单独的进程中运行，主进程保持很小的内存，峰值内存只反映该场景。
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_isolated_process, args=(sender, function, args))
+    process.start()
+    sender.close()
+    try:
+        metrics = receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"基准测试进程异常退出（退出码 {process.exitcode}）")
+    finally:
+        process.join()
+    return metrics
+
+
+def best_of(runs):
+    """多次运行中取用时最短的一次，峰值内存取最大值"""
+    best = dict(min(runs, key=lambda metrics: metrics['elapsed']))
+    peaks = [metrics['peak_rss_mb'] for metrics in runs if metrics['peak_rss_mb'] is not None]
+    best['peak_rss_mb'] = max(peaks) if peaks else None
+    best['runs'] = len(runs)
+    return best
+
+
+def run_benchmark(corpus_folder, sizes, output_formats, adjustments, workers, repeat=1,
+                  presets=("balanced",), log=print):
+    """运行所有场景，返回可保存为JSON的结果
+    
+    场景名为 尺寸/输出格式/调整方式，非默认编码预设时再加上 /预设。
+    """
+    corpus = run_isolated(ensure_corpus, corpus_folder, sizes)
+    scenarios = {}
+    for size_name in sizes:
+        for output_format in output_formats:
+            for adjustment_type in adjustments:
+                for preset in presets:
+                    name = f"{size_name}/{output_format}/{adjustment_type}"
+                    if preset != "balanced":
+                        name += f"/{preset}"
+                    runs = [run_isolated(run_scenario, os.path.join(corpus_folder, size_name),
+                                         output_format, adjustment_type, workers, preset)
+                            for _ in range(repeat)]
+                    scenarios[name] = best_of(runs)
+                    log(format_metrics(name, scenarios[name]))
+    
+    flatten = {}
+    for size_name in sizes:
+        flatten[size_name] = run_isolated(measure_flatten, os.path.join(corpus_folder, size_name))
+        log(f"{size_name} 透明背景合成: " + ", ".join(f"{name} {value} 百万像素/秒"
+                                                  for name, value in flatten[size_name].items()))
+    
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'corpus': {'version': corpus['version'], 'seed': corpus['seed'],
+                   'files': {size: corpus['sizes'][size] for size in sizes}},
+        'config': {'workers': workers, 'repeat': repeat, 'presets': list(presets),
+                   'adjustments': {name: BENCHMARK_ADJUSTMENTS[name] for name in adjustments}},
+        'scenarios': scenarios,
+        'flatten': flatten,
+    }
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 (导入的总耗时毫秒, [(模块, 自身耗时毫秒), ...])
+    
+    总耗时为顶层导入（没有缩进的模块）的累计耗时之和，模块按自身耗时（不含它导入的
+    其他模块）从多到少排列。
+    """
+    total = 0.0
+    modules = []
+    for line in stderr.splitlines():
+        fields = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(fields) != 3:
+            continue
+        self_us, cumulative_us, name = fields
+        if not cumulative_us.strip().isdigit():
+            continue  # 表头
+        if name[1:2] != " ":
+            total += int(cumulative_us) / 1000
+        modules.append((name.strip(), int(self_us) / 1000))
+    return total, sorted(modules, key=lambda item: item[1], reverse=True)
+
+
+def measure_command(command, runs, importtime=True):
+    """多次运行命令，返回墙钟时间和（-X importtime 时）导入耗时的中位数
+    
+    导入最慢的模块取自墙钟时间为中位数的那一次运行。
+    """
+    samples = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        completed = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   encoding='utf-8', errors='replace')
+        wall_ms = (time.perf_counter() - start_time) * 1000
+        if completed.returncode != 0:
+            raise RuntimeError(f"命令运行失败（退出码 {completed.returncode}）: "
+                               f"{completed.stderr.strip().splitlines()[-1:]}")
+        import_ms, modules = parse_importtime(completed.stderr) if importtime else (None, [])
+        samples.append((wall_ms, import_ms, modules))
+    
+    samples.sort(key=lambda sample: sample[0])
+    median = samples[len(samples) // 2]
+    metrics = {'wall_ms': round(statistics.median(sample[0] for sample in samples), 1),
+               'runs': runs}
+    if importtime:
+        metrics['import_ms'] = round(statistics.median(sample[1] for sample in samples), 1)
+        metrics['top_modules'] = [[name, round(ms, 1)]
+                                  for name, ms in median[2][:STARTUP_TOP_MODULES]]
+    return metrics
+
+
+def run_startup_benchmark(corpus_folder, runs=STARTUP_RUNS, commands=(), log=print):
+    """测量冷启动时间，返回可保存为JSON的结果
+    
+    每项在新的Python进程中用 -X importtime 运行 STARTUP_SCRIPTS 中的代码，统计从启动到结束的
+    墙钟时间和导入各模块的耗时。commands 为要额外测量的启动命令（如打包后的可执行文件），
+    运行时加上 --startup-check 参数，窗口显示后立即退出，只统计墙钟时间。
+    """
+    corpus = run_isolated(ensure_corpus, corpus_folder, ['small'])
+    sample_path = os.path.join(corpus_folder, 'small', 'rgb.png')
+    startup = {}
+    with tempfile.TemporaryDirectory(prefix="imgtrans-benchmark-") as output_folder:
+        for name, script in STARTUP_SCRIPTS.items():
+            command = [sys.executable, "-X", "importtime", "-c", script,
+                       sample_path, os.path.dirname(sample_path), output_folder]
+            startup[name] = measure_command(command, runs)
+            log(format_startup(name, startup[name]))
+    for command in commands:
+        startup[command] = measure_command(shlex.split(command) + ["--startup-check"], runs,
+                                           importtime=False)
+        log(format_startup(command, startup[command]))
+    
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'corpus': {'version': corpus['version'], 'seed': corpus['seed']},
+        'config': {'runs': runs},
+        'startup': startup,
+    }
+
+
+def format_startup(name, metrics):
+    """一项启动时间的摘要"""
+    line = f"{name:<31} 启动 {metrics['wall_ms']:>7.1f}ms"
+    if 'import_ms' in metrics:
+        line += f"  导入 {metrics['import_ms']:>7.1f}ms  最慢: " + ", ".join(
+            f"{module} {ms:.1f}ms" for module, ms in metrics['top_modules'][:4])
+    return line
+
+
+def format_metrics(name, metrics):
+    """一个场景的单行摘要"""
+    rss = f"{metrics['peak_rss_mb']}MB" if metrics['peak_rss_mb'] is not None else "-"
+    line = (f"{name:<31} {metrics['files_per_sec']:>8.2f} 文件/秒 {metrics['mb_per_sec']:>8.2f} MB/秒  "
+            f"p50 {metrics['latency_p50_ms']:>7.1f}ms  p90 {metrics['latency_p90_ms']:>7.1f}ms  "
+            f"p99 {metrics['latency_p99_ms']:>7.1f}ms  峰值内存 {rss:>8}  编码 {metrics['encodes']}次 "
+            f"{metrics['stages']['encode']:.2f}秒  输出 {metrics['bytes_out'] / 2 ** 20:.2f}MB")
+    if metrics['failed']:
+        line += f"  失败 {metrics['failed']}"
+    return line
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """与基准结果比较，返回性能退化列表 [(场景, 指标, 基准值, 当前值, 变化百分比), ...]
+    
+    转换场景和启动时间分别与基准结果中的同名项比较。
+    """
+    regressions = []
+    for section, regression_metrics in (('scenarios', REGRESSION_METRICS),
+                                        ('startup', STARTUP_REGRESSION_METRICS)):
+        for name, metrics in current.get(section, {}).items():
+            base_metrics = baseline.get(section, {}).get(name)
+            if base_metrics is None:
+                continue
+            for metric, higher_is_better in regression_metrics.items():
+                base_value, value = base_metrics.get(metric), metrics.get(metric)
+                if not base_value or value is None:
+                    continue
+                change = (value - base_value) / base_value * 100
+                if (-change if higher_is_better else change) > threshold:
+                    regressions.append((name, metric, base_value, value, round(change, 1)))
+    return regressions
+
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(
+        prog="converter_benchmark",
+        description="用合成图片集测试批量转换的性能，并检查性能退化")
+    parser.add_argument("--corpus", dest="corpus_folder", default=default_corpus_folder(),
+                        help="图片集文件夹（不存在时自动生成，默认在系统临时目录下）")
+    parser.add_argument("--sizes", default=",".join(CORPUS_SIZES),
+                        help="尺寸档位，逗号分隔（默认 small,large）")
+    parser.add_argument("--formats", default=",".join(converter_engine.OUTPUT_FORMATS),
+                        help="输出格式，逗号分隔（默认全部）")
+    parser.add_argument("--modes", default=",".join(BENCHMARK_ADJUSTMENTS),
+                        help="调整方式，逗号分隔（默认 none,scale,filesize,quality）")
+    parser.add_argument("--presets", default="balanced",
+                        help="编码预设，逗号分隔（默认 balanced，可选 fastest,balanced,smallest）")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="并行进程数（默认1，结果更稳定）")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="每个场景运行次数，取最快的一次（默认1）")
+    parser.add_argument("--startup", action="store_true",
+                        help="测量冷启动时间（导入图形界面和命令行模块、转换第一个文件），不运行转换场景")
+    parser.add_argument("--startup-runs", type=int, default=STARTUP_RUNS, metavar="N",
+                        help=f"启动时间每项的运行次数，取中位数（默认{STARTUP_RUNS}）")
+    parser.add_argument("--startup-command", action="append", default=[], metavar="COMMAND",
+                        help="同时测量该命令的启动时间（如打包后的可执行文件），"
+                             "运行时加上 --startup-check，窗口显示后立即退出（可多次指定）")
+    parser.add_argument("-o", "--output", help="保存结果的JSON文件")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="与之前保存的结果比较，有性能退化时退出码为1")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, metavar="PERCENT",
+                        help=f"判定为性能退化的变化百分比（默认{DEFAULT_THRESHOLD:g}）")
+    return parser
+
+
+def parse_list(parser, value, choices, name):
+    """解析逗号分隔的参数，包含未知项时报错"""
+    items = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = [item for item in items if item not in choices]
+    if unknown or not items:
+        parser.error(f"{name} 只能是 {', '.join(choices)}")
+    return items
+
+
+def main(argv=None):
+    """命令行入口，返回退出码：0 正常，1 有性能退化或转换失败，2 参数错误"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    sizes = parse_list(parser, args.sizes, list(CORPUS_SIZES), "--sizes")
+    output_formats = parse_list(parser, args.formats, converter_engine.OUTPUT_FORMATS, "--formats")
+    adjustments = parse_list(parser, args.modes, list(BENCHMARK_ADJUSTMENTS), "--modes")
+    presets = parse_list(parser, args.presets, converter_engine.ENCODER_PRESETS, "--presets")
+    if args.workers < 1 or args.repeat < 1 or args.startup_runs < 1:
+        parser.error("--workers、--repeat 和 --startup-runs 必须大于0")
+    
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"无法读取基准结果: {e}")
+    
+    print(f"图片集: {args.corpus_folder}", file=sys.stderr)
+    if args.startup:
+        results = run_startup_benchmark(args.corpus_folder, args.startup_runs,
+                                        args.startup_command)
+    else:
+        results = run_benchmark(args.corpus_folder, sizes, output_formats, adjustments,
+                                args.workers, args.repeat, presets)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+    
+    exit_code = 0
+    if any(metrics['failed'] for metrics in results.get('scenarios', {}).values()):
+        print("有文件转换失败，请检查结果中的 errors")
+        exit_code = 1
+    
+    if baseline is not None:
+        if baseline.get('corpus', {}).get('version') != results['corpus']['version']:
+            print("警告: 基准结果使用的图片集版本不同，比较结果仅供参考")
+        regressions = compare_results(baseline, results, args.threshold)
+        for name, metric, base_value, value, change in regressions:
+            print(f"性能退化: {name} {metric} {base_value} -> {value} ({change:+g}%)")
+        if regressions:
+            exit_code = 1
+        else:
+            print(f"与基准结果相比没有超过 {args.threshold:g}% 的性能退化")
+    
+    return exit_code
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
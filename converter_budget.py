@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+总大小预算分配
+按整个文件夹的总大小预算转换时，先用代理图估算每个文件在各质量下的编码大小，
+求出使总大小恰好用满预算的统一质量，再把每个文件在该质量下的预测大小作为目标，
+交给文件大小模式转换；已完成文件的实际大小会修正后续文件的目标，使总大小落在误差范围内
+"""
+
+
+# 估算时在代理图上编码的质量（其余质量按相邻两点线性插值）
+SAMPLE_QUALITIES = [10, 20, 35, 50, 65, 75, 85, 95]
+# 根据已完成文件修正后续目标时的最大调整倍数，避免个别文件的偏差导致目标剧烈波动
+MAX_CORRECTION = 2.0
+MIN_CORRECTION = 0.5
+# 搜索统一质量的二分次数（质量取连续值）
+QUALITY_SEARCH_STEPS = 30
+
+
+def interpolate_size(sizes, quality):
+    """按采样点线性插值某个质量下的编码大小，超出采样范围时取端点"""
+    points = sorted(sizes)
+    if quality <= points[0]:
+        return sizes[points[0]]
+    if quality >= points[-1]:
+        return sizes[points[-1]]
+    for low, high in zip(points, points[1:]):
+        if low <= quality <= high:
+            t = (quality - low) / (high - low)
+            return sizes[low] + t * (sizes[high] - sizes[low])
+
+
+class BudgetAllocator:
+    """把总大小预算分配给各个文件
+    
+    estimates 为 {任务序号: (相对路径, {质量: 预测的编码大小})}。
+    所有文件使用同一质量时画质最均衡，因此先求统一质量下总大小等于预算的质量，
+    每个文件的计划大小即该质量下的预测大小。转换时 target_for 按计划大小分配目标，
+    并根据已完成文件的实际大小和在途文件的目标，按比例放大或缩小剩余文件的目标。
+    """
+    
+    def __init__(self, budget_bytes, estimates, min_quality, max_quality):
+        self.budget = budget_bytes
+        self.paths = {index: path for index, (path, _) in estimates.items()}
+        self.quality, self.fits = self._common_quality(
+            [sizes for _, sizes in estimates.values()], min_quality, max_quality)
+        self.planned = {index: interpolate_size(sizes, self.quality)
+                        for index, (_, sizes) in estimates.items()}
+        self.remaining_planned = sum(self.planned.values())
+        self.committed = 0.0  # 已完成文件的实际大小 + 在途文件的目标大小
+        self.targets = {}
+        self.actual = {}
+    
+    def _common_quality(self, curves, min_quality, max_quality):
+        """总预测大小不超过预算的最高统一质量，返回 (质量, 预算是否足够)"""
+        def total(quality):
+            return sum(interpolate_size(sizes, quality) for sizes in curves)
+        
+        if not curves or total(max_quality) <= self.budget:
+            return float(max_quality), True
+        if total(min_quality) > self.budget:
+            return float(min_quality), False
+        low, high = float(min_quality), float(max_quality)
+        for _ in range(QUALITY_SEARCH_STEPS):
+            mid = (low + high) / 2
+            if total(mid) <= self.budget:
+                low = mid
+            else:
+                high = mid
+        return low, True
+    
+    def target_for(self, index):
+        """分配一个文件的目标大小（KB），按任务提交顺序调用"""
+        planned = self.planned[index]
+        correction = 1.0
+        if self.remaining_planned > 0:
+            correction = (self.budget - self.committed) / self.remaining_planned
+            correction = min(MAX_CORRECTION, max(MIN_CORRECTION, correction))
+        target = planned * correction
+        self.remaining_planned -= planned
+        self.committed += target
+        self.targets[index] = target
+        return max(1, int(round(target / 1024)))
+    
+    def record(self, index, success, bytes_out):
+        """记录一个文件的实际输出大小（失败的文件释放其目标大小）"""
+        if index not in self.targets:
+            return
+        actual = bytes_out if success else 0
+        self.committed += actual - self.targets[index]
+        self.actual[index] = actual
+    
+    def report(self):
+        """分配结果：预算、统一质量、计划和实际的总大小以及逐文件的分配"""
+        actual_total = sum(self.actual.values())
+        return {
+            'budget_kb': round(self.budget / 1024),
+            'quality': round(self.quality, 1),
+            'fits': self.fits,
+            'planned_kb': round(sum(self.planned.values()) / 1024),
+            'actual_kb': round(actual_total / 1024),
+            'usage': round(actual_total / self.budget * 100, 1) if self.budget else 0.0,
+            'files': {self.paths[index]: {'planned_kb': round(self.planned[index] / 1024, 1),
+                                          'target_kb': round(self.targets[index] / 1024, 1),
+                                          'actual_kb': round(self.actual.get(index, 0) / 1024, 1)}
+                      for index in self.targets},
+        }
+
+
+def report_lines(report):
+    """日志中显示的预算分配摘要"""
+    lines = [f"总大小预算 {report['budget_kb'] / 1024:.1f}MB: 实际 {report['actual_kb'] / 1024:.1f}MB "
+             f"({report['usage']:g}%), {len(report['files'])} 个文件, 统一质量约 {report['quality']:g}"]
+    if not report['fits']:
+        lines.append(f"  最低质量下预计仍需 {report['planned_kb'] / 1024:.1f}MB，超出预算，"
+                     f"请增大预算或先缩小图片")
+    return lines
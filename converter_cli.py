@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片格式转换工具 - 命令行版本
+无需图形界面，可在服务器、定时任务和CI中批量转换
+
+用法示例：
+    python -m converter_cli 输入文件夹 -f jpg --filesize 500 -j 8
+    python converter_cli.py 输入文件夹 -o 输出文件夹 --scale 50 --json
+    python converter_cli.py 扫描文件夹 -o 输出文件夹 --watch
+    python converter_cli.py 共享文件夹 -o 共享输出文件夹 --cluster   （在每台机器上运行）
+    python converter_cli.py 图片.tar.gz -r -o 结果.zip   （不解压，直接输出到压缩包）
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import converter_archive
+import converter_budget
+import converter_cluster
+import converter_engine
+import converter_metrics
+import converter_schedule
+import converter_watch
+
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(
+        prog="converter_cli",
+        description="批量转换图片格式，支持缩放比例、文件大小、图片质量调整")
+    parser.add_argument("input_folder",
+                        help="包含图片的输入文件夹，或 zip/tar 压缩包（包括 .tar.gz 等）")
+    parser.add_argument("-o", "--output", dest="output_folder",
+                        help="输出文件夹，以 .zip 结尾时输出到压缩包（默认为输入文件夹下的 "
+                             "imgTrans-YYYYMMDD，输入为压缩包时为其旁边的 名称-imgTrans-YYYYMMDD）")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="包含子文件夹，并在输出文件夹中保持相同的目录结构")
+    parser.add_argument("-f", "--format", dest="output_format", default="jpg",
+                        choices=converter_engine.OUTPUT_FORMATS, help="输出格式（默认jpg）")
+    
+    adjustment = parser.add_mutually_exclusive_group()
+    adjustment.add_argument("--scale", type=float, metavar="PERCENT",
+                            help="缩放比例，如90表示缩小到原图的90%%")
+    adjustment.add_argument("--filesize", type=int, metavar="KB",
+                            help="目标文件大小（KB），如1024表示约1MB")
+    adjustment.add_argument("--quality", type=int, metavar="LEVEL",
+                            help="图片质量等级 1-10（10为最佳质量）")
+    adjustment.add_argument("--total-budget", type=float, metavar="MB",
+                            help="所有输出文件的总大小预算（MB），按各图片的复杂度分配质量（仅jpg/webp）")
+    
+    parser.add_argument("--rendition", action="append", metavar="SPEC",
+                        help="一次解码输出多种文件（可多次指定），格式为 后缀:格式[:调整]，"
+                             "如 _full:jpg、_preview:jpg:scale=50、_thumb:png:scale=10；"
+                             "指定后不再使用 -f 和调整参数")
+    parser.add_argument("--png-allow-downscale", action="store_true",
+                        help="文件大小模式下PNG无法达到目标时允许缩小尺寸")
+    parser.add_argument("--preset", dest="encoder_preset", default="balanced",
+                        choices=converter_engine.ENCODER_PRESETS,
+                        help="编码预设：fastest 编码最快，balanced 均衡（默认），smallest 文件最小")
+    parser.add_argument("--background", dest="background_color", default="#ffffff",
+                        metavar="COLOR", help="转换为jpg时透明区域的背景色，如 #ffffff 或 white（默认白色）")
+    parser.add_argument("--frames", dest="frame_mode", default="first",
+                        choices=converter_engine.FRAME_MODES,
+                        help="多帧图片的处理方式：first 只转换第一帧（默认），split 每帧输出一个文件，"
+                             "multi 合并为一个动画PNG")
+    parser.add_argument("--dedupe", default="off", choices=converter_engine.DEDUPE_MODES,
+                        help="内容相同的输入文件只转换一次，其余文件复制（copy）、硬链接（hardlink）"
+                             "或写时复制（reflink）转换结果（默认off不合并）")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量转换：根据输出文件夹中的清单跳过输入和设置都未变化的文件")
+    parser.add_argument("--hash", dest="incremental_hash", action="store_true",
+                        help="增量转换时记录并校验文件内容哈希（修改时间变化但内容未变时也跳过）")
+    parser.add_argument("--resume", action="store_true",
+                        help="断点续转：跳过上次中断前已完成的文件，只重试失败和未完成的文件")
+    parser.add_argument("--memory-budget", type=int, default=0, metavar="MB",
+                        help="每个进程的内存预算（MB），超出时未压缩的大尺寸TIFF分块处理：png输出"
+                             "逐条带写入，jpg/webp输出需要完整的输出图像不超过预算的一半；"
+                             "其他图片完整解码并在日志中警告（默认0不限制）")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="并行进程数（默认为CPU核心数）")
+    parser.add_argument("--ordered", action="store_true",
+                        help="按文件顺序输出结果")
+    parser.add_argument("--largest-first", action="store_true",
+                        help="预扫描文件头后按像素数从大到小转换，避免最后剩下大图单独转换")
+    parser.add_argument("--memory-limit", type=int, default=0, metavar="MB",
+                        help="同时转换的图片解码后估算占用的总内存上限（MB），需要预扫描（默认0不限制）")
+    parser.add_argument("--writer-threads", type=int, default=2, metavar="N",
+                        help="后台写入线程数，写文件与后续文件的转换同时进行（默认2，0为在工作进程中直接写入）")
+    parser.add_argument("--fsync-batch", type=int, default=0, metavar="N",
+                        help="写入线程同步每个输出文件，每N个文件统一改名并同步文件夹，防止断电丢失"
+                             "已完成的文件（默认0不同步；需要后台写入线程，监视模式下逐个文件同步）")
+    parser.add_argument("--mmap", dest="mmap_input", action="store_true",
+                        help="通过内存映射读取较大的输入文件（4MB以上），减少读取时的数据复制")
+    parser.add_argument("--cluster", action="store_true",
+                        help="多节点协同转换：多个进程（可在挂载同一共享存储的多台机器上）同时转换"
+                             "同一个文件夹，每个文件只由一个节点转换，重新运行时跳过已完成的文件")
+    parser.add_argument("--node-id", default="", metavar="NAME",
+                        help="协同转换时本节点的名称（默认为 主机名-进程号）")
+    parser.add_argument("--lease-timeout", type=float,
+                        default=converter_cluster.DEFAULT_LEASE_TIMEOUT, metavar="SECONDS",
+                        help="协同转换时节点超过这么多秒没有续期视为已退出，其他节点接手它正在转换的文件"
+                             f"（默认{converter_cluster.DEFAULT_LEASE_TIMEOUT:g}秒）")
+    parser.add_argument("--watch", action="store_true",
+                        help="持续监视输入文件夹，新文件写完后立即转换，按 Ctrl+C 停止")
+    parser.add_argument("--poll", action="store_true",
+                        help="监视时使用定时轮询而不是inotify（用于网络共享等收不到文件事件的文件夹）")
+    parser.add_argument("--stable-seconds", type=float, default=converter_watch.STABLE_SECONDS,
+                        metavar="SECONDS",
+                        help="监视时文件大小和修改时间保持不变多久后认为已经写完"
+                             f"（默认{converter_watch.STABLE_SECONDS:g}秒）")
+    parser.add_argument("--json", action="store_true",
+                        help="在标准输出打印JSON格式的转换报告")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="不输出逐个文件的日志")
+    parser.add_argument("--metrics-json", metavar="PATH",
+                        help="把各阶段耗时的汇总和逐文件记录导出为JSON")
+    parser.add_argument("--metrics-csv", metavar="PATH",
+                        help="把逐文件的各阶段耗时导出为CSV")
+    parser.add_argument("--profile", action="append", metavar="PATTERN",
+                        help="用cProfile分析相对路径匹配该通配符的文件（可多次指定），"
+                             "结果保存在输出文件夹的 profiles 子文件夹中")
+    return parser
+
+
+def settings_from_args(args):
+    """根据命令行参数生成转换设置"""
+    adjustment_type = "none"
+    if args.scale is not None:
+        adjustment_type = "scale"
+    elif args.filesize is not None:
+        adjustment_type = "filesize"
+    elif args.quality is not None:
+        adjustment_type = "quality"
+    elif args.total_budget is not None:
+        adjustment_type = "budget"
+    
+    return converter_engine.make_settings(
+        output_format=args.output_format,
+        adjustment_type=adjustment_type,
+        scale_percentage=args.scale if args.scale is not None else 100,
+        target_filesize=args.filesize if args.filesize is not None else 1024,
+        quality_level=args.quality if args.quality is not None else 10,
+        total_budget_mb=args.total_budget if args.total_budget is not None else 100,
+        png_allow_downscale=args.png_allow_downscale,
+        workers=args.workers,
+        ordered=args.ordered,
+        recursive=args.recursive,
+        incremental=args.incremental,
+        incremental_hash=args.incremental_hash,
+        memory_budget_mb=args.memory_budget,
+        frame_mode=args.frame_mode,
+        background_color=args.background_color,
+        encoder_preset=args.encoder_preset,
+        writer_threads=args.writer_threads,
+        fsync_batch=args.fsync_batch,
+        dedupe=args.dedupe,
+        renditions=args.rendition,
+        mmap_input=args.mmap_input,
+        resume=args.resume,
+        largest_first=args.largest_first,
+        memory_limit_mb=args.memory_limit,
+        cluster=args.cluster,
+        node_id=args.node_id,
+        lease_timeout=args.lease_timeout,
+    )
+
+
+def main(argv=None):
+    """命令行入口，返回退出码：0 全部成功，1 有文件失败或未找到文件，2 参数错误"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    
+    if not (os.path.isdir(args.input_folder) or converter_archive.is_archive(args.input_folder)):
+        parser.error(f"输入文件夹或压缩包不存在: {args.input_folder}")
+    
+    output_folder = args.output_folder or converter_engine.default_output_folder(args.input_folder)
+    try:
+        settings = settings_from_args(args)
+        converter_archive.check_settings(settings, args.input_folder, output_folder)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.watch and args.cluster:
+        parser.error("监视模式不支持多节点协同转换！")
+    
+    results = []
+    metrics = converter_metrics.BatchMetrics(keep_files=bool(args.metrics_json or args.metrics_csv))
+    hooks = []
+    if args.profile:
+        hooks.append(converter_metrics.ProfileHook(
+            os.path.join(converter_archive.side_folder(output_folder), "profiles"), args.profile))
+    
+    def log(message):
+        if not args.quiet:
+            print(message, file=sys.stderr, flush=True)
+    
+    def on_discovered(total_files):
+        log(f"找到 {total_files} 个图片文件")
+    
+    def on_prescan(prescan):
+        log(converter_schedule.prescan_log_line(prescan))
+    
+    def on_result(result, completed, total_files):
+        if args.json:
+            results.append(result)
+        for message in converter_engine.result_log_lines(result):
+            log(message)
+    
+    description = converter_engine.describe_settings(settings)
+    if description:
+        log(description)
+    log(f"输出文件夹: {output_folder}")
+    
+    if args.watch:
+        return watch(args, settings, output_folder, hooks, metrics, log)
+    
+    summary = converter_engine.run_batch(args.input_folder, output_folder, settings,
+                                         on_discovered=on_discovered, on_result=on_result,
+                                         hooks=hooks, metrics=metrics, on_prescan=on_prescan)
+    
+    if summary['total'] == 0:
+        log("在输入文件夹中未找到支持的图片文件 (tif, png, webp, jpg, gif, bmp)")
+    else:
+        log(f"转换完成！成功: {summary['converted']}, 跳过未变化: {summary['skipped']}, "
+            f"失败: {summary['failed']}, 用时: {summary['elapsed']}秒")
+        if summary['deduplicated']:
+            log(f"重复文件: {summary['deduplicated']} 个，复制已有结果，节省 {summary['deduplicated']} 次转换")
+        if 'journal' in summary:
+            log(converter_engine.resume_log_line(summary))
+        if 'cluster' in summary:
+            log(converter_cluster.cluster_log_line(summary['cluster']))
+        if 'budget' in summary:
+            for line in converter_budget.report_lines(summary['budget']):
+                log(line)
+        for line in metrics.summary_lines():
+            log(line)
+    
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_csv:
+        metrics.write_csv(args.metrics_csv)
+    
+    if args.json:
+        report = {'settings': settings, 'summary': summary, 'files': results}
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    
+    return 0 if summary['total'] and not summary['failed'] else 1
+
+
+def watch(args, settings, output_folder, hooks, metrics, log):
+    """监视模式：持续转换新文件直到按 Ctrl+C，返回退出码"""
+    def on_result(result):
+        metrics.add(result)
+        for message in converter_engine.result_log_lines(result):
+            log(message)
+    
+    try:
+        watcher = converter_watch.FolderWatcher(args.input_folder, output_folder, settings,
+                                                on_result=on_result, hooks=hooks,
+                                                stable_seconds=args.stable_seconds,
+                                                use_polling=args.poll)
+    except ValueError as e:
+        log(f"错误: {e}")
+        return 2
+    log(f"正在监视: {args.input_folder}（{watcher.mode}），按 Ctrl+C 停止")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    
+    log(f"监视已停止。成功: {watcher.converted}, 失败: {watcher.failed}")
+    for line in metrics.summary_lines():
+        log(line)
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_csv:
+        metrics.write_csv(args.metrics_csv)
+    return 0 if not watcher.failed else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多节点协同转换
+同一台或多台机器上的多个转换进程共用一个（共享存储上的）输出文件夹，
+每个文件通过租约文件认领，只由一个节点转换；节点崩溃后其租约过期，
+由其他节点接手。协调信息保存在输出文件夹的 .imgtrans-cluster 中
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+
+import converter_writer
+
+
+# 协调文件夹名，保存在输出文件夹中
+CLUSTER_FOLDER = ".imgtrans-cluster"
+# 租约超过这么多秒没有续期视为持有的节点已经退出，可以被其他节点接手
+DEFAULT_LEASE_TIMEOUT = 60.0
+# 每个租约周期内续期的次数
+HEARTBEATS_PER_TIMEOUT = 4
+# 其他节点正在转换的文件，每隔这么多秒检查一次是否完成或租约过期
+BUSY_POLL_SECONDS = 1.0
+
+# 认领结果
+CLAIMED = "claimed"  # 由本节点转换
+DONE = "done"  # 已由某个节点转换完成
+FAILED = "failed"  # 本次转换中已由其他节点尝试并失败
+BUSY = "busy"  # 其他节点正在转换
+
+_reclaim_counter = itertools.count()
+_lease_counter = itertools.count()
+
+
+def default_node_id():
+    """默认的节点名：主机名-进程号"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def read_marker(path):
+    """读取完成或失败标记的内容，文件不存在或不完整时返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ClusterCoordinator:
+    """通过共享文件夹中的租约文件协调多个节点
+    
+    每个输入文件对应协调文件夹中的三个文件（按相对路径的哈希命名）：
+    - .lease：租约，用 O_EXCL 创建，同一时间只有一个节点能创建成功；内容为
+      “节点名:序号”，每次认领都不同，持有的节点定期更新其修改时间续期，
+      提交转换前和记录完成前都确认租约内容仍是自己写入的
+    - .done：输出文件写入完成后创建，记录输入文件的大小和修改时间，
+      再次运行时输入未变化且输出文件仍存在的文件直接跳过
+    - .failed：转换失败时创建，本次运行中其他节点不再重试
+    
+    租约是否过期按共享文件系统的时钟判断（与本节点定期更新的存活文件的修改时间比较），
+    不受各台机器时钟误差的影响。持有租约的节点被挂起超过租约时间时，
+    文件可能被另一个节点再转换一次（输出文件都是原子替换，结果相同）。
+    """
+    
+    def __init__(self, output_folder, signature, node_id=None,
+                 lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.output_folder = output_folder
+        self.folder = os.path.join(output_folder, CLUSTER_FOLDER, signature)
+        self.node_id = node_id or default_node_id()
+        self.lease_timeout = lease_timeout
+        self.alive_path = os.path.join(self.folder, "nodes", f"{self.node_id}.alive")
+        self.leases = {}  # 任务序号 -> (租约文件, 租约内容, 相对路径, 输入文件状态)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat = None
+        self.clock = None  # (共享文件系统时间, 对应的本地 monotonic 时间)
+        self.start_time = None
+        self.stats = {'claimed': 0, 'other_nodes': 0, 'reclaimed': 0, 'lost': 0}
+    
+    def _paths(self, relative_path):
+        key = hashlib.blake2b(relative_path.encode('utf-8'), digest_size=16).hexdigest()
+        base = os.path.join(self.folder, key[:2], key)
+        return base + ".lease", base + ".done", base + ".failed"
+    
+    def _touch_alive(self):
+        """更新存活文件，用它的修改时间校准共享文件系统的当前时间"""
+        with open(self.alive_path, 'w', encoding='utf-8') as f:
+            f.write(self.node_id)
+        self.clock = (os.stat(self.alive_path).st_mtime, time.monotonic())
+    
+    def now(self):
+        """共享文件系统的当前时间"""
+        server_time, local_time = self.clock
+        return server_time + (time.monotonic() - local_time)
+    
+    def start(self):
+        """创建协调文件夹并开始定期续期"""
+        os.makedirs(os.path.dirname(self.alive_path), exist_ok=True)
+        self._touch_alive()
+        self.start_time = self.now()
+        self.heartbeat = threading.Thread(target=self._heartbeat, daemon=True,
+                                          name="imgtrans-lease-heartbeat")
+        self.heartbeat.start()
+        return self
+    
+    def _heartbeat(self):
+        interval = self.lease_timeout / HEARTBEATS_PER_TIMEOUT
+        while not self.stop_event.wait(interval):
+            try:
+                self._touch_alive()
+            except OSError:
+                pass
+            with self.lock:
+                leases = list(self.leases.values())
+            for lease_path, token, _, _ in leases:
+                # 续期不及时、租约已被其他节点接手时不再续期，完成时由 complete 发现
+                if self._owns(lease_path, token):
+                    try:
+                        os.utime(lease_path)
+                    except OSError:
+                        pass
+    
+    def _finished_state(self, relative_path, input_stat):
+        """已有完成标记且仍然有效时返回 DONE，本次运行中已失败时返回 FAILED，否则返回 None"""
+        _, done_path, failed_path = self._paths(relative_path)
+        marker = read_marker(done_path)
+        if (marker is not None and marker['size'] == input_stat.st_size
+                and marker['mtime_ns'] == input_stat.st_mtime_ns
+                and os.path.exists(os.path.join(self.output_folder, marker['out']))):
+            return DONE
+        try:
+            # 之前运行中失败的文件在本次运行中重试
+            if os.stat(failed_path).st_mtime >= self.start_time:
+                return FAILED
+        except OSError:
+            pass
+        return None
+    
+    def _create_lease(self, lease_path):
+        """独占创建租约，返回写入的租约内容，已有租约时返回 None"""
+        try:
+            fd = os.open(lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return None
+        token = f"{self.node_id}:{next(_lease_counter)}"
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(token)
+        return token
+    
+    @staticmethod
+    def _read_lease(lease_path):
+        """租约内容，文件不存在或无法读取时返回 None"""
+        try:
+            with open(lease_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def _owns(self, lease_path, token):
+        """租约仍是本节点这次认领时创建的（没有过期后被其他节点接手并重新创建）"""
+        return self._read_lease(lease_path) == token
+    
+    def _restore_lease(self, stale_path, lease_path):
+        """把误改名的有效租约放回原处；其他节点已经创建了新租约时放弃，
+        原持有者在提交转换或记录完成前会发现租约已不属于自己"""
+        try:
+            os.link(stale_path, lease_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # 不支持硬链接的文件系统（如部分SMB共享）
+            if not os.path.exists(lease_path):
+                os.replace(stale_path, lease_path)
+                return
+        converter_writer.remove_quietly(stale_path)
+    
+    def _reclaim_stale(self, lease_path):
+        """租约过期时删除它，返回是否删除（多个节点同时接手时只有一个能改名成功）
+        
+        查看租约和改名之间，其他节点可能已经接手这个过期租约并创建了新租约，
+        或持有者刚好续期：改名后再检查改名的文件与判断过期时的内容和修改时间是否相同，
+        不同时说明拿到的是有效的租约，放回原处并返回 False。
+        """
+        try:
+            observed = os.stat(lease_path)
+        except FileNotFoundError:
+            return True
+        token = self._read_lease(lease_path)
+        if self.now() - observed.st_mtime <= self.lease_timeout:
+            return False
+        stale_path = f"{lease_path}.{self.node_id}-{next(_reclaim_counter)}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+        try:
+            renamed = os.stat(stale_path)
+        except FileNotFoundError:
+            return False
+        if (renamed.st_mtime_ns != observed.st_mtime_ns
+                or self._read_lease(stale_path) != token):
+            self._restore_lease(stale_path, lease_path)
+            return False
+        converter_writer.remove_quietly(stale_path)
+        self.stats['reclaimed'] += 1
+        return True
+    
+    def claim(self, task):
+        """尝试认领一个任务，返回 CLAIMED、DONE、FAILED 或 BUSY
+        
+        输入文件无法访问（如查找后被删除）时不创建租约，直接返回 CLAIMED，
+        由转换过程报告错误。
+        """
+        relative_path = task['relative_path']
+        try:
+            input_stat = os.stat(task['input_path'])
+        except OSError:
+            return CLAIMED
+        state = self._finished_state(relative_path, input_stat)
+        if state is not None:
+            return state
+        
+        lease_path = self._paths(relative_path)[0]
+        os.makedirs(os.path.dirname(lease_path), exist_ok=True)
+        token = self._create_lease(lease_path)
+        if token is None:
+            if not self._reclaim_stale(lease_path):
+                return BUSY
+            token = self._create_lease(lease_path)
+            if token is None:
+                return BUSY
+        
+        # 拿到租约后再检查一次：查看标记和创建租约之间其他节点可能刚好完成
+        state = self._finished_state(relative_path, input_stat)
+        if state is not None:
+            if self._owns(lease_path, token):
+                converter_writer.remove_quietly(lease_path)
+            return state
+        if not self._owns(lease_path, token):
+            # 创建后被其他节点当作过期租约改名（见 _reclaim_stale），不提交转换
+            return BUSY
+        with self.lock:
+            self.leases[task['index']] = (lease_path, token, relative_path, input_stat)
+        self.stats['claimed'] += 1
+        return CLAIMED
+    
+    def complete(self, result):
+        """输出文件写入后记录完成（或失败）并释放租约"""
+        with self.lock:
+            entry = self.leases.pop(result['index'], None)
+        if entry is None:
+            return
+        lease_path, token, relative_path, input_stat = entry
+        if not self._owns(lease_path, token):
+            # 租约已被其他节点接手，由接手的节点记录结果
+            self.stats['lost'] += 1
+            return
+        _, done_path, failed_path = self._paths(relative_path)
+        if result['success']:
+            marker = {'size': input_stat.st_size, 'mtime_ns': input_stat.st_mtime_ns,
+                      'out': os.path.relpath(result['output_path'],
+                                             self.output_folder).replace(os.sep, '/'),
+                      'node': self.node_id}
+            path = done_path
+        else:
+            marker = {'error': result['error'], 'node': self.node_id}
+            path = failed_path
+        try:
+            converter_writer.atomic_write(path, json.dumps(marker, ensure_ascii=False).encode('utf-8'))
+        finally:
+            converter_writer.remove_quietly(lease_path)
+    
+    def close(self):
+        """停止续期，释放尚未完成的任务的租约，使其他节点可以立即接手"""
+        self.stop_event.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+        with self.lock:
+            leases, self.leases = self.leases, {}
+        for lease_path, token, _, _ in leases.values():
+            if self._owns(lease_path, token):
+                converter_writer.remove_quietly(lease_path)
+        converter_writer.remove_quietly(self.alive_path)
+
+
+def cluster_log_line(cluster):
+    """日志中显示的多节点转换摘要"""
+    line = (f"节点 {cluster['node']}: 转换 {cluster['claimed']} 个文件，"
+            f"{cluster['other_nodes']} 个已由其他节点或之前的运行处理")
+    if cluster['reclaimed']:
+        line += f"，接手已退出节点的 {cluster['reclaimed']} 个文件"
+    if cluster['lost']:
+        line += f"，{cluster['lost']} 个文件续期不及时被其他节点接手"
+    return line
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重复文件合并
+找出内容完全相同的输入文件（如导出的副本、“(1)”重复文件），每份内容只转换一次，
+其余文件直接复制、硬链接或写时复制第一份的转换结果
+"""
+
+import os
+
+from converter_manifest import hash_file
+
+
+class DuplicateFinder:
+    """按内容找出与之前的输入文件重复的文件
+    
+    大小不同的文件内容一定不同，因此只有遇到与之前某个文件大小相同的文件时才计算哈希，
+    之前那个同样大小的文件也在这时才计算，每个文件最多读取一次；
+    大小都不相同的文件夹不会产生任何额外读取。
+    """
+    
+    def __init__(self):
+        self.first_by_size = {}  # 大小 -> 该大小第一个文件的 (任务序号, 路径)，计算哈希后改为 None
+        self.by_hash = {}  # (大小, 哈希) -> 任务序号
+        self.hashed = 0
+    
+    def _hash(self, path):
+        self.hashed += 1
+        return hash_file(path)
+    
+    def leader_of(self, task):
+        """返回与该任务内容相同的之前任务的序号，没有重复（或无法读取）时返回 None"""
+        try:
+            size = os.path.getsize(task['input_path'])
+            if size not in self.first_by_size:
+                self.first_by_size[size] = (task['index'], task['input_path'])
+                return None
+            
+            first = self.first_by_size[size]
+            if first is not None:
+                index, path = first
+                self.by_hash.setdefault((size, self._hash(path)), index)
+                self.first_by_size[size] = None
+            
+            key = (size, self._hash(task['input_path']))
+        except OSError:
+            return None  # 交给转换流程报告读取错误
+        if key in self.by_hash:
+            return self.by_hash[key]
+        self.by_hash[key] = task['index']
+        return None
@@ -0,0 +1,1948 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片转换引擎
+不依赖图形界面的批量转换流程，供GUI、命令行和其他脚本调用
+"""
+
+import os
+from PIL import Image, ImageColor, ImageSequence
+from datetime import datetime
+import hashlib
+import importlib
+import io
+import json
+import math
+import mmap
+import re
+import signal
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import converter_archive
+import converter_budget
+import converter_cluster
+import converter_dedupe
+import converter_journal
+import converter_metrics
+import converter_schedule
+import converter_tiles
+import converter_writer
+from converter_manifest import MANIFEST_FILENAME, ConversionManifest, hash_file
+
+
+# 支持的输入文件扩展名（不区分大小写）
+SUPPORTED_EXTENSIONS = (
+    # 原有格式
+    '.tif', '.tiff', '.png', '.webp',
+    # 扩展格式
+    '.jpg', '.jpeg', '.gif', '.bmp',
+)
+# 支持的输出格式
+OUTPUT_FORMATS = ["jpg", "png", "webp"]
+# 支持的输入和输出格式对应的Pillow插件。打开或保存尚未注册的格式时Pillow会导入全部
+# 四十多个插件（Image.init），只导入这几个可以省去每个进程第一个文件的这部分时间
+PIL_PLUGINS = ("BmpImagePlugin", "GifImagePlugin", "JpegImagePlugin", "PngImagePlugin",
+               "TiffImagePlugin", "WebPImagePlugin")
+# 调整方式
+ADJUSTMENT_TYPES = ["none", "scale", "filesize", "quality", "budget"]
+# 编码预设：在编码速度和文件大小之间取舍
+ENCODER_PRESETS = ["fastest", "balanced", "smallest"]
+# 各输出格式在每个预设下的Pillow保存参数
+ENCODER_PRESET_OPTIONS = {
+    'jpg': {
+        'fastest': {'optimize': False},
+        'balanced': {'optimize': True},
+        'smallest': {'optimize': True, 'progressive': True},
+    },
+    'png': {
+        'fastest': {'compress_level': 1},
+        'balanced': {'compress_level': 6},
+        'smallest': {'compress_level': 9, 'optimize': True},
+    },
+    'webp': {
+        'fastest': {'method': 0},
+        'balanced': {'method': 4},
+        'smallest': {'method': 6},
+    },
+}
+# 多帧图片（多页TIFF、动画GIF/WebP）的处理方式：
+# 只转换第一帧、每帧输出一个文件、合并为一个多帧文件（动画PNG）
+FRAME_MODES = ["first", "split", "multi"]
+# 重复文件的处理方式：不合并，或只转换一次后复制、硬链接、写时复制转换结果
+DEDUPE_MODES = ["off", "copy", "hardlink", "reflink"]
+DEDUPE_METHOD_LABELS = {'copy': "复制", 'hardlink': "硬链接", 'reflink': "写时复制"}
+# 多种输出（一次解码生成多个文件）中每种输出可以设置的调整方式及对应的设置项
+RENDITION_ADJUSTMENTS = {
+    "scale": 'scale_percentage',
+    "filesize": 'target_filesize',
+    "quality": 'quality_level',
+}
+# 影响输出结果的设置项，增量转换时据此判断设置是否变化
+OUTPUT_SETTING_KEYS = ['output_format', 'adjustment_type', 'frame_mode', 'background_color',
+                       'encoder_preset']
+# 各调整方式额外使用的设置项
+ADJUSTMENT_SETTING_KEYS = {
+    "none": [],
+    "scale": ['scale_percentage'],
+    "filesize": ['target_filesize', 'png_allow_downscale'],
+    "quality": ['quality_level'],
+    "budget": ['total_budget_mb'],
+}
+# 默认输出文件夹的名字（imgTrans-YYYYMMDD，压缩包输入时为 名称-imgTrans-YYYYMMDD），
+# 递归查找时跳过以前转换时输出到输入文件夹内的这些文件夹
+OUTPUT_FOLDER_PATTERN = re.compile(r"(.*-)?imgTrans-\d{8}")
+# 包含这些文件或文件夹的子文件夹是（自定义名字的）输出文件夹，递归查找时同样跳过
+OUTPUT_FOLDER_MARKERS = (MANIFEST_FILENAME, converter_journal.JOURNAL_FILENAME,
+                         converter_cluster.CLUSTER_FOLDER)
+# Pillow默认的解压炸弹像素上限，未设置内存预算时使用
+DEFAULT_MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS
+# 文件大小模式的允许误差（相对目标大小）
+FILESIZE_TOLERANCE = 0.1
+# JPEG/WebP质量搜索范围
+MIN_JPEG_QUALITY = 10
+MAX_JPEG_QUALITY = 95
+# 不调整时的默认质量
+DEFAULT_JPEG_QUALITY = 95
+DEFAULT_WEBP_QUALITY = 90
+# 代理图最大像素数，超过时用拼接小块估算质量-大小曲线
+PROXY_MAX_PIXELS = 1000000
+PROXY_TILE_SIZE = 128
+# 每个文件最多进行的完整分辨率编码次数
+MAX_FULL_ENCODES = 3
+# 缩小时先整数倍快速缩小到不小于目标尺寸的该倍数，再用LANCZOS精确缩放
+DOWNSCALE_REDUCING_GAP = 2.0
+# PNG无损大小超出目标不多时才尝试最高压缩级别
+PNG_LOSSLESS_MARGIN = 1.3
+# PNG调色板量化的候选颜色数（从多到少）
+PNG_COLOR_STEPS = [256, 128, 64, 32, 16, 8, 4, 2]
+# PNG缩小尺寸的最多尝试次数和最小比例
+PNG_MAX_SCALE_STEPS = 3
+PNG_MIN_SCALE = 0.1
+# 转换为jpg时透明区域的默认背景色
+DEFAULT_BACKGROUND = (255, 255, 255)
+# 源文件没有帧时长时，动画PNG每帧的显示时长（毫秒）
+DEFAULT_FRAME_DURATION_MS = 100
+# 启用内存映射读取时，不小于这个大小的输入文件才通过 mmap 打开（小文件直接读取更快）
+MMAP_MIN_BYTES = 4 * 2 ** 20
+
+
+def encoder_options(output_format, preset):
+    """编码预设对应的Pillow保存参数"""
+    return dict(ENCODER_PRESET_OPTIONS[output_format.lower()][preset])
+
+
+def pil_format_name(output_format):
+    """输出格式扩展名转换为Pillow格式名"""
+    output_format = output_format.lower()
+    if output_format in ('jpg', 'jpeg'):
+        return 'JPEG'
+    return output_format.upper()
+
+
+def encode_image(img, output_format, buffer=None, **save_kwargs):
+    """将图片编码到内存缓冲区，返回缓冲区（编码大小为 buffer.tell()）
+    
+    传入 buffer 时复用这个缓冲区：从头覆盖写入后截断到新的长度，
+    已分配的内存留给下一次编码，反复试编码时不必每次重新分配和扩容。
+    """
+    converter_metrics.count_encode()
+    if buffer is None:
+        buffer = io.BytesIO()
+    buffer.seek(0)
+    with converter_metrics.stage('encode'):
+        img.save(buffer, format=pil_format_name(output_format), **save_kwargs)
+    buffer.truncate()
+    return buffer
+
+
+def write_output(output_path, buffer, fsync=False):
+    """把编码缓冲区原子写入输出文件（先写临时文件再改名），直接写入缓冲区的内存不复制"""
+    with converter_metrics.stage('write'):
+        size = converter_writer.atomic_write(output_path, buffer, fsync)
+    converter_metrics.count_bytes_out(size)
+
+
+def request_draft(img, new_size):
+    """缩小时让解码器直接输出较小的图像（如JPEG按1/2、1/4、1/8解码）
+    
+    必须在加载像素数据之前调用，不支持的格式不做任何处理。
+    """
+    if new_size[0] < img.size[0] and new_size[1] < img.size[1]:
+        img.draft(None, (int(new_size[0] * DOWNSCALE_REDUCING_GAP),
+                         int(new_size[1] * DOWNSCALE_REDUCING_GAP)))
+
+
+def resize_image(img, new_size):
+    """缩放图片，缩小时先用 reduce 整数倍缩小，最后只做一次小范围的LANCZOS重采样"""
+    with converter_metrics.stage('resize'):
+        return img.resize(new_size, Image.Resampling.LANCZOS,
+                          reducing_gap=DOWNSCALE_REDUCING_GAP)
+
+
+def make_proxy_image(img):
+    """生成用于估算编码大小的代理图，返回代理图和像素比例
+    
+    代理图由均匀分布在原图各处的原分辨率小块拼接而成，保留了原图的细节和噪声，
+    因此每像素的编码大小与原图接近。
+    """
+    width, height = img.size
+    if width * height <= PROXY_MAX_PIXELS:
+        return img, 1.0
+    
+    tile = PROXY_TILE_SIZE
+    grid = max(1, int(math.sqrt(PROXY_MAX_PIXELS) // tile))
+    grid_x = max(1, min(grid, width // tile))
+    grid_y = max(1, min(grid, height // tile))
+    tile_w = min(tile, width)
+    tile_h = min(tile, height)
+    
+    proxy = Image.new(img.mode, (grid_x * tile_w, grid_y * tile_h))
+    if img.mode == 'P':
+        proxy.putpalette(img.getpalette())
+    for j in range(grid_y):
+        y = (height - tile_h) * j // max(1, grid_y - 1)
+        y -= y % 16  # 对齐JPEG编码块
+        for i in range(grid_x):
+            x = (width - tile_w) * i // max(1, grid_x - 1)
+            x -= x % 16
+            proxy.paste(img.crop((x, y, x + tile_w, y + tile_h)), (i * tile_w, j * tile_h))
+    
+    return proxy, (width * height) / (proxy.size[0] * proxy.size[1])
+
+
+def quantize_image(img, colors):
+    """将图片量化为指定颜色数的调色板图片，保留透明通道"""
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+    target_mode = 'RGBA' if has_alpha else 'RGB'
+    if img.mode != target_mode:
+        img = img.convert(target_mode)
+    return img.quantize(colors, method=Image.Quantize.FASTOCTREE)
+
+
+def adjust_png_by_filesize(img, target_size, allow_downscale=False):
+    """根据目标文件大小调整PNG图片
+    
+    PNG没有质量参数，依次尝试真正影响大小的手段：无损压缩级别和策略、
+    调色板量化（搜索颜色数）、可选的缩小尺寸。有损的手段在不超过上限的结果中
+    取最大的一份，并继续向目标逼近，直到进入误差范围或无法再细分。
+    相同参数的编码结果会被缓存，同一张图片不会重复编码。
+    返回 (编码缓冲区, 使用的设置说明, 试编码次数)。
+    """
+    lower_size = target_size * (1 - FILESIZE_TOLERANCE)
+    upper_size = target_size * (1 + FILESIZE_TOLERANCE)
+    trials = {}  # 参数 -> 编码缓冲区
+    scaled_images = {1.0: img}
+    
+    def trial(colors=None, scale=1.0, compress_level=6, compress_type=-1):
+        """按参数编码（结果缓存），返回编码大小"""
+        key = (colors, scale, compress_level, compress_type)
+        if key not in trials:
+            if scale not in scaled_images:
+                new_size = (max(1, int(img.size[0] * scale)), max(1, int(img.size[1] * scale)))
+                scaled_images[scale] = resize_image(img, new_size)
+            image = scaled_images[scale]
+            if colors:
+                image = quantize_image(image, colors)
+            trials[key] = encode_image(image, 'png', compress_level=compress_level,
+                                       compress_type=compress_type)
+        return trials[key].tell()
+    
+    def describe(key):
+        colors, scale, compress_level, compress_type = key
+        label = f"{colors}色" if colors else f"无损(压缩{compress_level})"
+        if scale < 1.0:
+            label += f" 缩放{scale * 100:.0f}%"
+        return label
+    
+    def finish(key):
+        return trials[key], describe(key), len(trials)
+    
+    def largest_fit():
+        """已编码结果中不超过上限的最大一份的参数，没有时为 None"""
+        fits = [key for key in trials if trials[key].tell() <= upper_size]
+        return max(fits, key=lambda k: trials[k].tell()) if fits else None
+    
+    # 1. 无损压缩，默认级别已满足时直接使用（无损结果低于下限也无法再提高质量）
+    if trial() <= upper_size:
+        return finish((None, 1.0, 6, -1))
+    
+    # 2. 差距不大时尝试最高压缩级别和不同的zlib策略，无损结果的画质相同，满足即可
+    if trial() <= upper_size * PNG_LOSSLESS_MARGIN:
+        for compress_type in (-1, zlib.Z_FILTERED):
+            if trial(compress_level=9, compress_type=compress_type) <= upper_size:
+                return finish((None, 1.0, 9, compress_type))
+    
+    # 3. 调色板量化，颜色数越少文件越小，查找满足大小的最多颜色数
+    def palette_size(colors):
+        return trial(colors=colors, compress_level=9)
+    
+    if palette_size(PNG_COLOR_STEPS[0]) <= upper_size:
+        # 调色板最多256色，低于下限时也不能再增加颜色
+        return finish((PNG_COLOR_STEPS[0], 1.0, 9, -1))
+    last = len(PNG_COLOR_STEPS) - 1
+    if palette_size(PNG_COLOR_STEPS[last]) <= upper_size:
+        # 先在颜色数档位中找满足上限的最多颜色数
+        low, high = 1, last  # palette_size(PNG_COLOR_STEPS[high]) 满足要求
+        while low < high:
+            mid = (low + high) // 2
+            if palette_size(PNG_COLOR_STEPS[mid]) <= upper_size:
+                high = mid
+            else:
+                low = mid + 1
+        # 相邻档位之间大小相差较大，低于下限时在两档之间继续二分颜色数
+        fit_colors, over_colors = PNG_COLOR_STEPS[high], PNG_COLOR_STEPS[high - 1]
+        while (over_colors - fit_colors > 1
+               and trials[largest_fit()].tell() < lower_size):
+            mid = (fit_colors + over_colors) // 2
+            if palette_size(mid) <= upper_size:
+                fit_colors = mid
+            else:
+                over_colors = mid
+        return finish(largest_fit())
+    
+    # 4. 可选：按大小比例估算缩小尺寸，结果过小时再放大，直到进入误差范围
+    if allow_downscale:
+        colors = PNG_COLOR_STEPS[0]
+        scale = 1.0
+        too_large = 1.0  # 已知超过上限的最小比例
+        current_size = palette_size(colors)
+        for _ in range(PNG_MAX_SCALE_STEPS):
+            estimate = scale * math.sqrt(target_size / current_size)
+            scale = round(min(max(PNG_MIN_SCALE, estimate), too_large - 0.001), 3)
+            if (colors, scale, 9, -1) in trials:
+                break
+            current_size = trial(colors=colors, scale=scale, compress_level=9)
+            if lower_size <= current_size <= upper_size:
+                break
+            if current_size > upper_size:
+                if scale <= PNG_MIN_SCALE:
+                    break
+                too_large = scale
+    
+    # 取不超过上限的最大一份，都超过时使用已编码结果中最小的一份
+    best = largest_fit()
+    if best is None:
+        best = min(trials, key=lambda k: trials[k].tell())
+    return finish(best)
+
+
+def adjust_image_by_filesize(img, target_size_kb, output_format, allow_downscale=False,
+                             options=None):
+    """根据目标文件大小调整图片
+    
+    JPEG和WebP先在代理图上建立 质量→大小 曲线，再用少量完整分辨率编码校准预测，
+    最后直接复用已编码结果中最接近目标的一份；PNG见 adjust_png_by_filesize。
+    options 为编码预设的保存参数（质量由搜索决定）。
+    代理图的试编码共用一个缓冲区；完整分辨率编码只保留最接近目标的一份，
+    其余的缓冲区留给下一次完整编码复用，同时最多占用两份完整编码的内存。
+    返回 (编码缓冲区, 使用的质量或设置, 完整编码次数)，PNG时第三项为试编码次数。
+    """
+    target_size = target_size_kb * 1024  # 转换为字节
+    options = options or {}
+    
+    if output_format.lower() == 'png':
+        return adjust_png_by_filesize(img, target_size, allow_downscale)
+    
+    if output_format.lower() not in ('jpg', 'webp'):
+        # 没有质量参数可调，编码一次即可
+        return encode_image(img, output_format, **options), None, 1
+    
+    proxy, pixel_ratio = make_proxy_image(img)
+    full_sizes = {}  # 质量 -> 完整分辨率编码大小
+    best = {}  # 最接近目标的完整编码：quality、buffer
+    spare_buffers = []  # 可复用的完整编码缓冲区
+    proxy_buffer = io.BytesIO()
+    proxy_sizes = {}  # 质量 -> 代理图编码大小
+    
+    def full_encode(quality):
+        """完整分辨率编码，返回编码大小"""
+        if quality not in full_sizes:
+            buffer = encode_image(img, output_format,
+                                  spare_buffers.pop() if spare_buffers else None,
+                                  quality=quality, **options)
+            full_sizes[quality] = buffer.tell()
+            if not best or (abs(full_sizes[quality] - target_size)
+                            < abs(full_sizes[best['quality']] - target_size)):
+                if best:
+                    spare_buffers.append(best['buffer'])
+                best.update(quality=quality, buffer=buffer)
+            else:
+                spare_buffers.append(buffer)
+        return full_sizes[quality]
+    
+    def proxy_size(quality):
+        if quality not in proxy_sizes:
+            if proxy is img:
+                # 小图直接用原图编码，结果同时可作为候选
+                proxy_sizes[quality] = full_encode(quality)
+            else:
+                proxy_sizes[quality] = encode_image(proxy, output_format, proxy_buffer,
+                                                    quality=quality, **options).tell()
+        return proxy_sizes[quality]
+    
+    # 已校准的 质量 -> 原图与代理图大小比例，未校准时按像素比例估算
+    calibration = {}
+    
+    def size_ratio(quality):
+        if not calibration:
+            return pixel_ratio
+        points = sorted(calibration)
+        if quality <= points[0]:
+            return calibration[points[0]]
+        if quality >= points[-1]:
+            return calibration[points[-1]]
+        # 在相邻校准点之间线性插值
+        for low, high in zip(points, points[1:]):
+            if low <= quality <= high:
+                t = (quality - low) / (high - low)
+                return calibration[low] + t * (calibration[high] - calibration[low])
+    
+    def predicted_size(quality):
+        return proxy_size(quality) * size_ratio(quality)
+    
+    def predict_quality():
+        # 预测大小随质量单调递增，二分查找最接近目标的质量
+        low_quality = MIN_JPEG_QUALITY
+        high_quality = MAX_JPEG_QUALITY
+        while low_quality < high_quality:
+            mid_quality = (low_quality + high_quality) // 2
+            if predicted_size(mid_quality) < target_size:
+                low_quality = mid_quality + 1
+            else:
+                high_quality = mid_quality
+        # 比较相邻质量，取预测大小更接近目标的一个
+        if low_quality > MIN_JPEG_QUALITY:
+            below = abs(predicted_size(low_quality - 1) - target_size)
+            above = abs(predicted_size(low_quality) - target_size)
+            if below < above:
+                return low_quality - 1
+        return low_quality
+    
+    for _ in range(MAX_FULL_ENCODES):
+        quality = predict_quality()
+        if quality in calibration:
+            break  # 预测收敛，不再重复编码
+        
+        size = full_encode(quality)
+        if abs(size - target_size) <= target_size * FILESIZE_TOLERANCE:  # 误差范围内
+            # 之前的完整编码都在误差范围外，这一份一定是最接近目标的
+            return best['buffer'], quality, len(full_sizes)
+        
+        # 用实际大小校准代理图到原图的大小比例
+        calibration[quality] = size / proxy_size(quality)
+    
+    # 无法达到目标大小时，复用最接近目标的编码结果
+    return best['buffer'], best['quality'], len(full_sizes)
+
+
+@contextmanager
+def open_input(input_path, settings, archive=None):
+    """打开输入图片，with 块结束时关闭图片和映射或打开的文件
+    
+    启用 mmap_input 时，较大的文件映射到内存后交给Pillow读取，解码器直接从
+    页缓存读取数据，不经过文件对象的读缓冲区；文件系统不支持映射时改为普通打开。
+    archive 不为 None 时图片是压缩包中的文件，直接从压缩包读取（见 converter_archive）。
+    """
+    source = None
+    if archive is not None:
+        source = converter_archive.open_member(archive)
+    elif settings['mmap_input'] and os.path.getsize(input_path) >= MMAP_MIN_BYTES:
+        with open(input_path, 'rb') as f:
+            try:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                source = None
+    try:
+        with converter_metrics.stage('decode'):
+            img = Image.open(source if source is not None else input_path)
+        with img:
+            yield img
+    finally:
+        if source is not None:
+            source.close()
+
+
+def new_result(task):
+    """生成单个文件的结果记录"""
+    return {
+        'index': task['index'],
+        'filename': os.path.basename(task['input_path']),
+        'output_filename': os.path.basename(task['output_path']),
+        'output_path': task['output_path'],
+        'success': False,
+        'skipped': False,
+        'error': None,
+        'full_encodes': 0,
+        'png_trials': 0,
+        'elapsed': 0.0,
+        'input_hash': None,
+        'duplicate_of': None,  # 内容重复时为转换过的那个文件名
+        'pixels': task['prescan']['pixels'] if 'prescan' in task else 0,  # 预扫描得到的像素数
+        'messages': [],
+        'outputs': [],  # 交给后台写入线程的 (输出路径, 编码缓冲区)
+        **converter_metrics.new_file_stats(),
+    }
+
+
+def palette_alphas(img):
+    """调色板图片每个颜色的透明度列表，没有透明色时返回 None"""
+    transparency = img.info.get('transparency')
+    if transparency is None:
+        return None
+    alphas = [255] * 256
+    if isinstance(transparency, int):
+        alphas[transparency] = 0
+    else:
+        alphas[:len(transparency)] = transparency
+    return alphas
+
+
+def flatten_palette(img, background):
+    """把调色板中的透明色直接与背景色混合，只需一次展开为RGB"""
+    alphas = palette_alphas(img)
+    if alphas is None:
+        return img.convert('RGB')
+    palette = img.getpalette('RGB')
+    blended = []
+    for i, value in enumerate(palette):
+        alpha = alphas[i // 3]
+        blended.append((value * alpha + background[i % 3] * (255 - alpha) + 127) // 255)
+    flat = img.copy()  # 调色板图像每像素一个字节，复制开销很小
+    flat.info.pop('transparency', None)
+    flat.putpalette(blended)
+    return flat.convert('RGB')
+
+
+def flatten_alpha(img, output_format, background=DEFAULT_BACKGROUND):
+    """转换为jpg时，将带透明通道的图片合成到背景色上
+    
+    支持 RGBA、RGBa（预乘）、LA、La、PA，以及带透明色的调色板和RGB/L图片。
+    以原图自身作为蒙版粘贴到背景上，Pillow直接使用其透明通道，不需要拆分通道；
+    调色板图片只混合调色板中的颜色。除背景外不再分配完整尺寸的图像。
+    """
+    if output_format.lower() != 'jpg':
+        return img
+    
+    mode = img.mode
+    if mode == 'P':
+        with converter_metrics.stage('flatten'):
+            return flatten_palette(img, background)
+    if mode in ('RGB', 'L') and 'transparency' in img.info:
+        # 透明色（PNG的tRNS）先展开为透明通道
+        with converter_metrics.stage('flatten'):
+            img = img.convert(mode + 'A')
+        mode = img.mode
+    if mode in ('PA', 'La'):
+        # Pillow不能直接用这两种模式作蒙版
+        with converter_metrics.stage('flatten'):
+            img = img.convert('RGBA' if mode == 'PA' else 'LA')
+        mode = img.mode
+    if mode not in ('RGBA', 'RGBa', 'LA'):
+        return img
+    
+    with converter_metrics.stage('flatten'):
+        if mode == 'LA' and background[0] == background[1] == background[2]:
+            # 灰度图片合成到灰色背景上，保持单通道输出
+            flat = Image.new('L', img.size, background[0])
+            flat.paste(img.convert('L'), (0, 0), img)
+        else:
+            flat = Image.new('RGB', img.size, background)
+            flat.paste(img if mode != 'LA' else img.convert('RGB'), (0, 0), img)
+    return flat
+
+
+def save_kwargs_for(settings, messages):
+    """质量调整和默认设置下的保存参数（在编码预设的基础上）"""
+    output_format = settings['output_format'].lower()
+    save_kwargs = encoder_options(output_format, settings['encoder_preset'])
+    
+    if settings['adjustment_type'] == "quality":
+        # 图片质量调整
+        quality_level = settings['quality_level']
+        if output_format in ('jpg', 'webp'):
+            # 将1-10级别映射到JPEG/WebP质量10-95
+            quality = int(10 + (quality_level - 1) * 85 / 9)
+            save_kwargs['quality'] = quality
+            messages.append(f"  质量调整: 等级{quality_level}/10 "
+                            f"({'JPEG' if output_format == 'jpg' else 'WebP'}质量:{quality})")
+        else:
+            # PNG格式使用压缩级别
+            png_compress = 9 - int((quality_level - 1) * 8 / 9)  # 1->8, 10->0
+            save_kwargs['compress_level'] = png_compress
+            save_kwargs.pop('optimize', None)  # optimize 会强制使用最高压缩级别
+            messages.append(f"  质量调整: 等级{quality_level}/10 (PNG压缩:{png_compress})")
+    
+    else:
+        # 默认保存设置
+        if output_format == 'jpg':
+            save_kwargs['quality'] = DEFAULT_JPEG_QUALITY
+        elif output_format == 'webp':
+            save_kwargs['quality'] = DEFAULT_WEBP_QUALITY
+    
+    return save_kwargs
+
+
+def save_image(img, output_path, settings, result, deferred=True):
+    """按调整设置编码并保存图片
+    
+    启用后台写入且 deferred 为 True 时，编码缓冲区放入结果记录的 outputs，
+    由主进程的写入线程写入文件；否则在当前进程中直接写入。编码数据始终留在
+    缓冲区中，不复制为 bytes。返回编码数据的字节数。
+    """
+    output_format = settings['output_format']
+    messages = result['messages']
+    
+    def write(buffer):
+        if deferred and settings['writer_threads']:
+            result['outputs'].append((output_path, buffer))
+        else:
+            write_output(output_path, buffer, bool(settings['fsync_batch']))
+        return buffer.tell()
+    
+    if settings['adjustment_type'] == "filesize":
+        # 文件大小调整
+        target_kb = settings['target_filesize']
+        buffer, used_quality, full_encodes = adjust_image_by_filesize(
+            img, target_kb, output_format, settings['png_allow_downscale'],
+            encoder_options(output_format, settings['encoder_preset']))
+        size = write(buffer)
+        actual_size = size // 1024
+        if output_format.lower() == 'png':
+            # PNG的每次试编码都是完整编码，单独计数，不与JPEG/WebP的校准编码混在一起
+            result['png_trials'] += full_encodes
+            encodes_label = f"PNG试编码{full_encodes}次"
+        else:
+            result['full_encodes'] += full_encodes
+            encodes_label = f"完整编码{full_encodes}次"
+        messages.append(f"  文件大小: 目标{target_kb}KB -> 实际{actual_size}KB "
+                        f"(质量:{used_quality}, {encodes_label})")
+    else:
+        buffer = encode_image(img, output_format, **save_kwargs_for(settings, messages))
+        size = write(buffer)
+    return size
+
+
+def scaled_size(size, settings):
+    """缩放比例调整后的尺寸，不缩放时返回原尺寸"""
+    if settings['adjustment_type'] != "scale":
+        return size
+    scale = settings['scale_percentage'] / 100
+    return (int(size[0] * scale), int(size[1] * scale))
+
+
+def band_output_mode(mode, output_format, background=DEFAULT_BACKGROUND):
+    """分块处理时每个条带转换后的模式"""
+    band = flatten_alpha(Image.new(mode, (1, 1)), output_format, background)
+    has_alpha = 'A' in band.getbands() or 'transparency' in band.info
+    if output_format.lower() == 'jpg':
+        return band.mode if band.mode in ('L', 'RGB', 'CMYK') else 'RGB'
+    if output_format.lower() == 'webp':
+        # WebP只支持RGB和RGBA
+        return 'RGBA' if has_alpha else 'RGB'
+    if band.mode in converter_tiles.PngStreamWriter.COLOR_TYPES:
+        return band.mode
+    return 'RGBA' if has_alpha else 'RGB'
+
+
+def finish_stream(output_file, temp_path, output_path, settings):
+    """关闭逐块写入的临时文件并改名为输出文件"""
+    with converter_metrics.stage('write'):
+        if settings['fsync_batch']:
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        output_file.close()
+        os.replace(temp_path, output_path)
+
+
+def band_limitation(img, settings, budget_bytes):
+    """超出内存预算的图片不能分块处理的原因，可以分块处理时返回 None
+    
+    只有未压缩的TIFF能按条带解码；只有png输出（文件大小模式除外）能逐条带写入，
+    jpg、webp输出仍要在内存中保存完整的输出图像，输出图像超出预算的一半时也不能分块处理。
+    """
+    if not converter_tiles.can_decode_in_bands(img):
+        return "不是可分块读取的未压缩TIFF"
+    output_format = settings['output_format']
+    if output_format == 'png' and settings['adjustment_type'] != "filesize":
+        return None
+    output_mode = band_output_mode(img.mode, output_format, settings['background_color'])
+    output_bytes = converter_tiles.decoded_bytes(output_mode, scaled_size(img.size, settings))
+    if output_bytes * 2 > budget_bytes:
+        return (f"{output_format}输出需要在内存中保存完整的输出图像"
+                f"（约 {output_bytes // 2 ** 20}MB），只有png输出可以逐条带写入")
+    return None
+
+
+def convert_image_in_bands(img, task, budget_bytes, result):
+    """按条带转换超出内存预算的大尺寸TIFF（调用前由 band_limitation 确认可以分块处理）
+    
+    只在内存中保留当前条带：PNG输出（文件大小模式除外）逐条带写入文件，
+    其他情况把条带拼接到输出尺寸的图像上再编码，此时输出图像也必须在预算之内。
+    """
+    settings = task['settings']
+    output_format = settings['output_format']
+    messages = result['messages']
+    original_size = img.size
+    new_size = scaled_size(original_size, settings)
+    output_mode = band_output_mode(img.mode, output_format, settings['background_color'])
+    stream_png = output_format == 'png' and settings['adjustment_type'] != "filesize"
+    
+    band_budget = budget_bytes
+    if not stream_png:
+        band_budget = budget_bytes - converter_tiles.decoded_bytes(output_mode, new_size)
+    
+    bands = converter_tiles.plan_bands(img.mode, original_size, new_size, band_budget,
+                                       converter_tiles.band_tile_height(img))
+    messages.append(f"  分块处理: {len(bands)} 个条带 (内存预算 {budget_bytes // 2 ** 20}MB)")
+    if new_size != original_size:
+        messages.append(f"  缩放: {original_size} -> {new_size}")
+    
+    scale_y = original_size[1] / new_size[1]
+    if stream_png:
+        save_kwargs = save_kwargs_for(settings, messages)
+        temp_path = converter_writer.temp_path_for(task['output_path'])
+        output_file = open(temp_path, 'wb')
+        converter_metrics.count_encode()
+        writer = converter_tiles.PngStreamWriter(output_file, new_size, output_mode,
+                                                 save_kwargs.get('compress_level', 6))
+    else:
+        output = Image.new(output_mode, new_size)
+    
+    try:
+        for out_y0, out_y1, src_y0, src_y1 in bands:
+            with converter_metrics.stage('decode'):
+                band, top = converter_tiles.load_band(task['input_path'], src_y0, src_y1)
+            with converter_metrics.stage('resize'):
+                if new_size != original_size:
+                    box = (0, out_y0 * scale_y - top, original_size[0], out_y1 * scale_y - top)
+                    band = band.resize((new_size[0], out_y1 - out_y0), Image.Resampling.LANCZOS,
+                                       box=box)
+                else:
+                    band = band.crop((0, out_y0 - top, original_size[0], out_y1 - top))
+            
+            band = flatten_alpha(band, output_format, settings['background_color'])
+            if band.mode != output_mode:
+                with converter_metrics.stage('flatten'):
+                    band = band.convert(output_mode)
+            
+            if stream_png:
+                with converter_metrics.stage('encode'):
+                    writer.write_band(band)
+            else:
+                output.paste(band, (0, out_y0))
+            del band
+        
+        if stream_png:
+            with converter_metrics.stage('encode'):
+                writer.close()
+            converter_metrics.count_bytes_out(output_file.tell())
+            finish_stream(output_file, temp_path, task['output_path'], settings)
+    except Exception:
+        if stream_png:
+            # 不保留写了一半的文件
+            output_file.close()
+            converter_writer.remove_quietly(temp_path)
+        raise
+    
+    if not stream_png:
+        save_image(output, task['output_path'], settings, result)
+
+
+def prepare_frame(frame, settings):
+    """对单帧做缩放和透明通道处理，返回可以直接编码的图像"""
+    if frame.mode == 'P':
+        # 调色板帧先展开，缩放时才能插值，透明色也会变成透明通道
+        frame = frame.convert('RGBA' if 'transparency' in frame.info else 'RGB')
+    new_size = scaled_size(frame.size, settings)
+    if new_size != frame.size:
+        frame = resize_image(frame, new_size)
+    return flatten_alpha(frame, settings['output_format'], settings['background_color'])
+
+
+def convert_frames(img, task, result):
+    """逐帧转换多帧图片
+    
+    用 ImageSequence 依次定位到每一帧，处理完当前帧并写出后才读取下一帧，
+    内存中始终只有一帧。split 模式每帧按调整设置单独保存为
+    “文件名_0001.扩展名”；multi 模式把所有帧逐帧压缩写入同一个动画PNG。
+    """
+    settings = task['settings']
+    output_format = settings['output_format']
+    messages = result['messages']
+    frame_count = img.n_frames
+    messages.append(f"  多帧: {frame_count} 帧")
+    if settings['adjustment_type'] == "scale":
+        messages.append(f"  缩放: {settings['scale_percentage']:g}%")
+    
+    if settings['frame_mode'] == "split":
+        base_path = os.path.splitext(task['output_path'])[0]
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            with converter_metrics.stage('decode'):
+                frame.load()
+            frame_path = f"{base_path}_{index + 1:04d}.{output_format}"
+            # 逐帧直接写入，不在结果记录中积累所有帧的编码数据
+            save_image(prepare_frame(frame, settings), frame_path, settings, result,
+                       deferred=False)
+            if index == 0:
+                result['output_path'] = frame_path
+        name = os.path.basename(base_path)
+        result['output_filename'] = (f"{name}_0001.{output_format} ~ "
+                                     f"{name}_{frame_count:04d}.{output_format}")
+        return
+    
+    compress_level = save_kwargs_for(settings, messages).get('compress_level', 6)
+    converter_metrics.count_encode()
+    writer = None
+    temp_path = converter_writer.temp_path_for(task['output_path'])
+    output_file = open(temp_path, 'wb')
+    try:
+        for frame in ImageSequence.Iterator(img):
+            with converter_metrics.stage('decode'):
+                frame.load()  # 部分格式（如WebP）在加载帧时才设置帧时长
+            duration = frame.info.get('duration') or DEFAULT_FRAME_DURATION_MS
+            frame = prepare_frame(frame, settings)
+            if writer is None:
+                output_mode = band_output_mode(frame.mode, output_format,
+                                               settings['background_color'])
+                writer = converter_tiles.PngStreamWriter(output_file, frame.size, output_mode,
+                                                         compress_level, num_frames=frame_count,
+                                                         loop=img.info.get('loop', 0))
+            elif frame.size != writer.size:
+                raise ValueError("各帧尺寸不同，无法合并为动画PNG，请改为逐帧输出")
+            if frame.mode != writer.mode:
+                with converter_metrics.stage('flatten'):
+                    frame = frame.convert(writer.mode)
+            with converter_metrics.stage('encode'):
+                writer.begin_frame(duration)
+                writer.write_band(frame)
+                writer.end_frame()
+            del frame
+        with converter_metrics.stage('encode'):
+            writer.close()
+        converter_metrics.count_bytes_out(output_file.tell())
+        finish_stream(output_file, temp_path, task['output_path'], settings)
+    except Exception:
+        # 不保留写了一半的文件
+        output_file.close()
+        converter_writer.remove_quietly(temp_path)
+        raise
+
+
+def convert_renditions(img, task, result):
+    """一次解码生成多种输出
+    
+    按输出尺寸从大到小处理，每种输出都从上一个不小于它的中间图像缩小得到，
+    小尺寸输出不必从原图开始缩放；各输出分别合成透明背景、按自己的调整设置编码。
+    某个输出失败时其余输出照常生成，结果记录的 renditions 列出每种输出的结果。
+    """
+    settings = task['settings']
+    messages = result['messages']
+    original_size = img.size
+    renditions = [dict(settings, **rendition) for rendition in settings['renditions']]
+    sizes = [scaled_size(original_size, rendition) for rendition in renditions]
+    
+    # 解码时直接缩小到最大的输出尺寸
+    request_draft(img, max(sizes, key=lambda size: size[0] * size[1]))
+    with converter_metrics.stage('decode'):
+        img.load()
+    if img.mode == 'P' and any(size != original_size for size in sizes):
+        # 调色板图片先展开，缩放时才能插值
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    
+    base_path = os.path.splitext(task['output_path'])[0]
+    entries = [None] * len(renditions)
+    source = img  # 当前最小的中间图像，后续更小的输出从它缩小
+    for i in sorted(range(len(renditions)), key=lambda i: sizes[i][0] * sizes[i][1],
+                    reverse=True):
+        rendition = renditions[i]
+        size = sizes[i]
+        output_format = rendition['output_format']
+        output_path = f"{base_path}{rendition['suffix']}.{output_format}"
+        entry = {
+            'suffix': rendition['suffix'],
+            'output_filename': os.path.basename(output_path),
+            'size': size,
+            'success': False,
+            'error': None,
+            'bytes_out': 0,
+        }
+        try:
+            if size[0] <= source.size[0] and size[1] <= source.size[1]:
+                if size != source.size:
+                    source = resize_image(source, size)
+                frame = source
+            else:
+                frame = resize_image(img, size)  # 放大时从原图开始
+            frame = flatten_alpha(frame, output_format, rendition['background_color'])
+            entry['bytes_out'] = save_image(frame, output_path, rendition, result)
+            entry['success'] = True
+            messages.append(f"  {entry['output_filename']}: {size[0]}x{size[1]}, "
+                            f"{entry['bytes_out'] // 1024}KB")
+        except Exception as e:
+            entry['error'] = str(e)
+            messages.append(f"  {entry['output_filename']}: 失败 - {e}")
+        entries[i] = entry
+    
+    result['renditions'] = entries
+    result['output_path'] = f"{base_path}{renditions[0]['suffix']}.{renditions[0]['output_format']}"
+    result['output_filename'] = ", ".join(entry['output_filename'] for entry in entries)
+    failed = [entry['output_filename'] for entry in entries if not entry['success']]
+    if failed:
+        raise ValueError(f"{len(failed)} 种输出失败: {', '.join(failed)}")
+
+
+def convert_whole_image(img, task, result):
+    """完整解码后转换单帧图片"""
+    settings = task['settings']
+    original_size = img.size
+    
+    # 缩小时在解码阶段直接输出较小的图像
+    new_size = scaled_size(original_size, settings)
+    request_draft(img, new_size)
+    with converter_metrics.stage('decode'):
+        img.load()
+    
+    # 处理调整选项
+    if settings['adjustment_type'] == "scale":
+        # 缩放比例调整
+        img = resize_image(img, new_size)
+        result['messages'].append(f"  缩放: {original_size} -> {new_size}")
+    
+    img = flatten_alpha(img, settings['output_format'], settings['background_color'])
+    
+    # 保存转换后的图片
+    save_image(img, task['output_path'], settings, result)
+
+
+def convert_image_file(task):
+    """转换单个图片文件
+    
+    在工作进程中完成 解码 → 缩放 → 透明通道合成 → 编码 → 写入 的全部步骤，
+    只把很小的结果记录返回给界面线程。
+    """
+    settings = task['settings']
+    budget_bytes = settings['memory_budget_mb'] * 2 ** 20
+    
+    result = new_result(task)
+    messages = result['messages']
+    hooks = [hook for hook in task['hooks'] if hook.matches(task['relative_path'])]
+    for hook in hooks:
+        try:
+            hook.before_file(task)
+        except Exception as e:
+            messages.append(f"  统计钩子出错: {e}")
+    start_time = time.perf_counter()
+    converter_metrics.begin_file(result)
+    
+    # 设置内存预算时由预算控制内存占用，不再使用Pillow的解压炸弹像素上限
+    Image.MAX_IMAGE_PIXELS = None if budget_bytes else DEFAULT_MAX_IMAGE_PIXELS
+    
+    try:
+        if task['archive'] is not None:
+            result['bytes_in'] = task['archive']['size']
+        else:
+            result['bytes_in'] = os.path.getsize(task['input_path'])
+        with open_input(task['input_path'], settings, task['archive']) as img:
+            original_size = img.size
+            
+            if settings['frame_mode'] != "first" and getattr(img, 'n_frames', 1) > 1:
+                convert_frames(img, task, result)
+            
+            elif settings['renditions']:
+                if budget_bytes and converter_tiles.decoded_bytes(img.mode, original_size) > budget_bytes:
+                    raise ValueError("图片解码后超出内存预算，多种输出时不支持分块处理")
+                convert_renditions(img, task, result)
+            
+            elif budget_bytes and converter_tiles.decoded_bytes(img.mode, original_size) > budget_bytes:
+                reason = band_limitation(img, settings, budget_bytes)
+                if reason is None:
+                    convert_image_in_bands(img, task, budget_bytes, result)
+                else:
+                    # 不能分块处理时完整解码，但仍不处理超出Pillow解压炸弹上限的图片
+                    needed_mb = converter_tiles.decoded_bytes(img.mode, original_size) // 2 ** 20
+                    if (DEFAULT_MAX_IMAGE_PIXELS
+                            and original_size[0] * original_size[1] > 2 * DEFAULT_MAX_IMAGE_PIXELS):
+                        raise ValueError(f"图片解码后约需 {needed_mb}MB 内存，超出内存预算，"
+                                         f"且{reason}；图片过大，无法完整解码")
+                    messages.append(f"  警告: 图片解码后约需 {needed_mb}MB 内存，超出内存预算，"
+                                    f"但{reason}，改为完整解码转换")
+                    convert_whole_image(img, task, result)
+            
+            else:
+                convert_whole_image(img, task, result)
+        
+        if settings['incremental_hash']:
+            result['input_hash'] = hash_file(task['input_path'])
+        result['success'] = True
+    
+    except Exception as e:
+        result['error'] = str(e)
+    
+    finally:
+        converter_metrics.end_file()
+    
+    result['elapsed'] = round(time.perf_counter() - start_time, 6)
+    result['timings'] = {name: round(seconds, 6) for name, seconds in result['timings'].items()}
+    for hook in hooks:
+        try:
+            hook.after_file(task, result)
+        except Exception as e:
+            messages.append(f"  统计钩子出错: {e}")
+    return result
+
+
+def register_plugins():
+    """只注册支持的输入和输出格式的Pillow插件（代替 Image.init 导入全部插件）
+    
+    扩展名与内容不符、不属于这些格式的文件，Pillow打开时仍会导入全部插件再识别。
+    """
+    for name in PIL_PLUGINS:
+        try:
+            importlib.import_module(f"PIL.{name}")
+        except ImportError:  # Pillow编译时不带某些格式（如WebP）的支持
+            pass
+
+
+# 主进程和工作进程（包括 spawn 方式启动、反序列化任务函数时才导入本模块的进程）都在导入时注册
+register_plugins()
+
+
+def init_worker():
+    """长期运行的工作进程的初始化：忽略 Ctrl+C，由主进程等待正在转换的文件完成后再退出
+    （Pillow的格式插件在导入本模块时已经注册，第一个文件不必等待）"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def estimate_image_file(task):
+    """估算单个文件在各质量下的编码大小（按总大小预算转换时的第一遍）
+    
+    解码后只在代理图上按 converter_budget.SAMPLE_QUALITIES 编码，按像素比例换算为
+    完整分辨率的预测大小，不做完整分辨率编码。
+    """
+    settings = task['settings']
+    output_format = settings['output_format']
+    budget_bytes = settings['memory_budget_mb'] * 2 ** 20
+    estimate = {'index': task['index'], 'success': False, 'error': None, 'sizes': {}}
+    
+    Image.MAX_IMAGE_PIXELS = None if budget_bytes else DEFAULT_MAX_IMAGE_PIXELS
+    try:
+        with open_input(task['input_path'], settings, task['archive']) as img:
+            if budget_bytes and converter_tiles.decoded_bytes(img.mode, img.size) > budget_bytes:
+                raise ValueError("图片解码后超出内存预算，无法估算编码大小")
+            img.load()
+            img = flatten_alpha(img, output_format, settings['background_color'])
+            proxy, pixel_ratio = make_proxy_image(img)
+            options = encoder_options(output_format, settings['encoder_preset'])
+            buffer = io.BytesIO()
+            for quality in converter_budget.SAMPLE_QUALITIES:
+                size = encode_image(proxy, output_format, buffer, quality=quality, **options).tell()
+                estimate['sizes'][quality] = size * pixel_ratio
+        estimate['success'] = True
+    except Exception as e:
+        estimate['error'] = str(e)
+    return estimate
+
+
+def crashed_estimate(task, error):
+    """工作进程异常退出时，为其中的任务生成估算失败的记录"""
+    return {'index': task['index'], 'success': False, 'error': error, 'sizes': {}}
+
+
+def duplicate_result(task, leader, mode):
+    """用内容相同的文件的转换结果生成重复文件的输出，返回结果记录"""
+    result = new_result(task)
+    result['duplicate_of'] = leader['filename']
+    start_time = time.perf_counter()
+    if not leader['success']:
+        result['error'] = f"与 {leader['filename']} 内容相同，该文件转换失败: {leader['error']}"
+    else:
+        try:
+            method = mode
+            if os.path.abspath(leader['output_path']) != os.path.abspath(task['output_path']):
+                method = converter_writer.link_output(leader['output_path'],
+                                                      task['output_path'], mode)
+            result['bytes_out'] = os.path.getsize(task['output_path'])
+            result['input_hash'] = leader['input_hash']
+            result['messages'].append(f"  重复文件: 与 {leader['filename']} 内容相同，"
+                                      f"{DEDUPE_METHOD_LABELS[method]}转换结果")
+            result['success'] = True
+        except OSError as e:
+            result['error'] = f"复制重复文件的转换结果失败: {e}"
+    result['elapsed'] = round(time.perf_counter() - start_time, 6)
+    result['timings']['write'] = result['elapsed']
+    return result
+
+
+def resume_log_line(summary):
+    """断点续转的摘要：跳过的文件数以及上次中断时的状态"""
+    previous = summary['journal']
+    return (f"断点续转: 跳过上次已完成的 {summary['resumed']} 个文件"
+            f"（上次记录完成 {previous['completed']}、失败 {previous['failed']}、"
+            f"中断时正在转换 {previous['in_flight']} 个）")
+
+
+def result_log_lines(result):
+    """单个文件结果的日志行，跳过的文件不输出日志"""
+    if result['skipped']:
+        return []
+    lines = list(result['messages'])
+    if result['success']:
+        lines.append(f"✓ 转换成功: {result['filename']} -> {result['output_filename']}")
+    else:
+        lines.append(f"✗ 转换失败: {result['filename']} - {result['error']}")
+    return lines
+
+
+def crashed_result(task, error):
+    """工作进程异常退出时，为其中的任务生成转换失败的结果记录"""
+    result = new_result(task)
+    result['error'] = error
+    return result
+
+
+def iter_conversion_results(tasks, workers, ordered=False, should_stop=None,
+                            function=convert_image_file, memory_limit=0, hold_back=True,
+                            on_crash=crashed_result):
+    """使用进程池并行转换，逐个产出结果记录
+    
+    workers <= 1 时在当前线程内顺序转换；ordered 为 True 时按任务顺序产出结果，
+    否则按完成顺序产出。同时在途的任务数量有上限，停止时会取消尚未开始的任务。
+    function 为在工作进程中处理单个任务的函数（默认转换文件）。
+    memory_limit 大于0时，在途任务估算的内存占用（见 converter_schedule.task_memory）
+    之和不超过这个字节数，没有在途任务时总会提交一个任务；按完成顺序产出时，
+    暂时放不下的任务先放在一边，继续提交后面较小的任务（hold_back 为 False 时不这样做，
+    用于任务本身带着占用内存的数据，如从压缩包读入的文件内容）。
+    工作进程异常退出（内存不足被系统终止、解码器崩溃等）时进程池不能再使用，
+    也无法知道是哪个在途任务导致的：这些任务改为在只有一个工作进程的隔离进程池中
+    按顺序重新转换，其余任务继续使用新的进程池；隔离进程池中的工作进程再次退出时，
+    正在转换的任务用 on_crash(task, error) 记为失败，批量转换继续进行。
+    """
+    if workers <= 1:
+        for task in tasks:
+            if should_stop and should_stop():
+                break
+            yield function(task)
+        return
+    
+    max_pending = workers * 4
+    max_held = 0 if ordered or not hold_back else max_pending
+    task_iter = iter(tasks)
+    pools = {'main': None, 'isolated': None}
+    pending = deque()
+    held = []  # 内存不足、等待提交的任务
+    memory = {}  # 在途任务 -> 估算的内存占用
+    submitted = {}  # 在途任务 -> (任务, 所在的进程池)
+    crashed = {}  # 导致工作进程退出的在途任务 -> 失败的结果记录
+    
+    def submit(task, pool='main'):
+        if pools[pool] is None:
+            pools[pool] = ProcessPoolExecutor(max_workers=workers if pool == 'main' else 1)
+        future = pools[pool].submit(function, task)
+        memory[future] = converter_schedule.task_memory(task)
+        submitted[future] = (task, pool)
+        return future
+    
+    def handle_crash(pool, error):
+        # 关闭时等待进程池把其中未完成的任务都标记为失败
+        pools[pool].shutdown(wait=True)
+        pools[pool] = None
+        lost = [i for i, future in enumerate(pending)
+                if submitted[future][1] == pool and future not in crashed
+                and (future.cancelled() or future.exception() is not None)]
+        if pool == 'isolated' and lost:
+            # 隔离进程池按提交顺序逐个转换，第一个未完成的任务就是正在转换的任务
+            culprit = pending[lost.pop(0)]
+            crashed[culprit] = on_crash(submitted[culprit][0], error)
+        for i in lost:
+            future = pending[i]
+            memory.pop(future)
+            pending[i] = submit(submitted.pop(future)[0], 'isolated')
+    
+    def collect(future):
+        """取出在途任务的结果；进程池损坏、任务已重新提交时返回 None"""
+        if future not in crashed:
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                handle_crash(submitted[future][1],
+                             f"工作进程异常退出（可能内存不足或解码器崩溃）: {e}")
+                if future not in crashed:
+                    return None
+        if future in crashed:
+            result = crashed.pop(future)
+        pending.remove(future)
+        memory.pop(future)
+        submitted.pop(future)
+        return result
+    
+    def fits(task):
+        return (not memory_limit or not pending
+                or sum(memory.values()) + converter_schedule.task_memory(task) <= memory_limit)
+    
+    def next_task():
+        # 优先提交等待中的任务；放不下的新任务最多暂存 max_held 个
+        for i, task in enumerate(held):
+            if fits(task):
+                return held.pop(i)
+        while len(held) <= max_held:
+            task = next(task_iter, None)
+            if task is None or fits(task):
+                return task
+            held.append(task)
+        return None
+    
+    try:
+        while True:
+            # 补充在途任务
+            while len(pending) < max_pending:
+                if should_stop and should_stop():
+                    return
+                task = next_task()
+                if task is None:
+                    break
+                pending.append(submit(task))
+            
+            if not pending:
+                break
+            
+            if ordered:
+                result = collect(pending[0])
+                if result is not None:
+                    yield result
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future not in submitted:
+                        continue  # 进程池损坏后已重新提交
+                    result = collect(future)
+                    if result is not None:
+                        yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        for executor in pools.values():
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+
+def default_output_folder(input_folder):
+    """输入文件夹下以当前日期命名的默认输出文件夹（输入为压缩包时见 converter_archive）"""
+    if converter_archive.is_archive(input_folder):
+        return converter_archive.default_output_folder(input_folder)
+    # 生成当前日期字符串 (YYYYMMDD格式)
+    current_date = datetime.now().strftime("%Y%m%d")
+    return os.path.join(input_folder, f"imgTrans-{current_date}")
+
+
+def make_settings(output_format="jpg", adjustment_type="none", scale_percentage=100,
+                  target_filesize=1024, quality_level=10, png_allow_downscale=False,
+                  workers=None, ordered=False, recursive=False, incremental=False,
+                  incremental_hash=False, memory_budget_mb=0, frame_mode="first",
+                  background_color="#ffffff", encoder_preset="balanced", writer_threads=2,
+                  fsync_batch=0, total_budget_mb=100, dedupe="off", renditions=None,
+                  mmap_input=False, resume=False, largest_first=False, memory_limit_mb=0,
+                  cluster=False, node_id="", lease_timeout=converter_cluster.DEFAULT_LEASE_TIMEOUT):
+    """校验并生成转换设置
+    
+    数值参数可以是字符串（来自界面输入框），校验失败时抛出 ValueError，
+    错误信息可直接展示给用户。renditions 为多种输出的说明列表（或用分号分隔的字符串，
+    见 parse_rendition），指定后每个文件按这些说明输出多个文件，不再使用
+    output_format 和调整设置。
+    cluster 为 True 时与其他进程（可在其他机器上）协同转换同一个文件夹，
+    见 converter_cluster。
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    if adjustment_type not in ADJUSTMENT_TYPES:
+        raise ValueError(f"不支持的调整方式: {adjustment_type}")
+    if encoder_preset not in ENCODER_PRESETS:
+        raise ValueError(f"不支持的编码预设: {encoder_preset}")
+    if frame_mode not in FRAME_MODES:
+        raise ValueError(f"不支持的多帧处理方式: {frame_mode}")
+    if dedupe not in DEDUPE_MODES:
+        raise ValueError(f"不支持的重复文件处理方式: {dedupe}")
+    if dedupe != "off":
+        if frame_mode == "split":
+            raise ValueError("逐帧输出时不支持合并重复文件！")
+        if adjustment_type == "budget":
+            raise ValueError("按总大小预算调整时不支持合并重复文件！")
+    if frame_mode == "multi":
+        if output_format != "png":
+            raise ValueError("合并为多帧文件仅支持png输出（动画PNG）！")
+        if adjustment_type in ("filesize", "budget"):
+            raise ValueError("合并为多帧文件时不支持按文件大小调整！")
+    if adjustment_type == "budget":
+        if output_format not in ("jpg", "webp"):
+            raise ValueError("按总大小预算调整仅支持jpg和webp输出！")
+        if frame_mode != "first":
+            raise ValueError("按总大小预算调整时只能转换多帧图片的第一帧！")
+        if incremental:
+            raise ValueError("按总大小预算调整时不支持增量转换！")
+        if resume:
+            raise ValueError("按总大小预算调整时不支持断点续转！")
+        if cluster:
+            raise ValueError("按总大小预算调整时不支持多节点协同转换！")
+    if cluster and (incremental or resume):
+        # 多个节点不能同时写同一个清单和日志，协同转换的完成标记已经包含这两项功能
+        raise ValueError("多节点协同转换时不需要增量转换和断点续转，重新运行会自动跳过已完成的文件！")
+    
+    try:
+        workers = int(workers) if workers is not None else (os.cpu_count() or 1)
+    except ValueError:
+        raise ValueError("请输入有效的并行进程数！")
+    if workers < 1:
+        raise ValueError("并行进程数必须大于0！")
+    
+    if adjustment_type == "scale":
+        try:
+            scale_percentage = float(scale_percentage)
+        except ValueError:
+            raise ValueError("请输入有效的缩放比例数字！")
+        if scale_percentage <= 0 or scale_percentage > 200:
+            raise ValueError("缩放比例必须在0-200%之间！")
+    else:
+        scale_percentage = 100.0
+    
+    if adjustment_type == "filesize":
+        try:
+            target_filesize = int(target_filesize)
+        except ValueError:
+            raise ValueError("请输入有效的文件大小数字！")
+        if target_filesize <= 0:
+            raise ValueError("目标文件大小必须大于0KB！")
+    else:
+        target_filesize = 0
+    
+    if adjustment_type == "budget":
+        try:
+            total_budget_mb = float(total_budget_mb)
+        except ValueError:
+            raise ValueError("请输入有效的总大小预算数字！")
+        if total_budget_mb <= 0:
+            raise ValueError("总大小预算必须大于0MB！")
+    else:
+        total_budget_mb = 0.0
+    
+    try:
+        quality_level = int(float(quality_level))
+    except ValueError:
+        raise ValueError("请输入有效的图片质量等级！")
+    if quality_level < 1 or quality_level > 10:
+        raise ValueError("图片质量等级必须在1-10之间！")
+    
+    try:
+        memory_budget_mb = int(memory_budget_mb or 0)
+        memory_limit_mb = int(memory_limit_mb or 0)
+    except ValueError:
+        raise ValueError("请输入有效的内存预算数字！")
+    if memory_budget_mb < 0 or memory_limit_mb < 0:
+        raise ValueError("内存预算不能小于0MB！")
+    if largest_first and ordered:
+        raise ValueError("按文件顺序输出时不支持大图优先！")
+    
+    if cluster:
+        try:
+            lease_timeout = float(lease_timeout)
+        except ValueError:
+            raise ValueError("请输入有效的租约时间！")
+        if lease_timeout <= 0:
+            raise ValueError("租约时间必须大于0秒！")
+        node_id = str(node_id or "").strip()
+        if any(char in node_id for char in '/\\:'):
+            raise ValueError("节点名不能包含 / \\ 或 : ！")
+    else:
+        node_id = ""
+        lease_timeout = 0.0
+    
+    if isinstance(renditions, str):
+        renditions = [spec for spec in renditions.split(';') if spec.strip()]
+    renditions = [parse_rendition(spec) for spec in renditions or []]
+    if renditions:
+        names = [(rendition['suffix'], rendition['output_format']) for rendition in renditions]
+        if len(set(names)) != len(names):
+            raise ValueError("多种输出的文件名后缀和格式不能重复！")
+        if frame_mode != "first":
+            raise ValueError("多种输出时只能转换多帧图片的第一帧！")
+        if adjustment_type == "budget" or dedupe != "off":
+            raise ValueError("多种输出时不支持总大小预算和合并重复文件！")
+    
+    try:
+        writer_threads = int(writer_threads)
+        fsync_batch = int(fsync_batch or 0)
+    except ValueError:
+        raise ValueError("请输入有效的写入线程数和同步批量！")
+    if writer_threads < 0 or fsync_batch < 0:
+        raise ValueError("写入线程数和同步批量不能小于0！")
+    if fsync_batch and not writer_threads:
+        # 工作进程直接写入时无法批量同步，只能逐个文件同步
+        raise ValueError("批量同步需要后台写入线程，写入线程数为0时不能设置同步批量！")
+    
+    try:
+        background_color = ImageColor.getrgb(str(background_color).strip())[:3]
+    except ValueError:
+        raise ValueError("请输入有效的背景颜色，如 #ffffff 或 white！")
+    
+    return {
+        'output_format': output_format,
+        'adjustment_type': adjustment_type,
+        'scale_percentage': scale_percentage,
+        'target_filesize': target_filesize,
+        'total_budget_mb': total_budget_mb,
+        'png_allow_downscale': bool(png_allow_downscale),
+        'quality_level': quality_level,
+        'workers': workers,
+        'ordered': bool(ordered),
+        'recursive': bool(recursive),
+        'incremental': bool(incremental),
+        'incremental_hash': bool(incremental and incremental_hash),
+        'memory_budget_mb': memory_budget_mb,
+        'frame_mode': frame_mode,
+        'background_color': background_color,
+        'encoder_preset': encoder_preset,
+        'writer_threads': writer_threads,
+        'fsync_batch': fsync_batch,
+        'dedupe': dedupe,
+        'renditions': renditions,
+        'mmap_input': bool(mmap_input),
+        'resume': bool(resume),
+        'largest_first': bool(largest_first),
+        'memory_limit_mb': memory_limit_mb,
+        'cluster': bool(cluster),
+        'node_id': node_id,
+        'lease_timeout': lease_timeout,
+    }
+
+
+def parse_rendition(spec):
+    """解析一种输出的说明“后缀:格式[:调整]”，返回该输出的设置
+    
+    调整为 scale=百分比、filesize=KB 或 quality=1-10，省略时不调整，
+    如 _full:jpg、_preview:jpg:scale=50、_thumb:png:scale=10。
+    """
+    parts = [part.strip() for part in str(spec).split(':')]
+    if len(parts) not in (2, 3):
+        raise ValueError(f"无效的输出说明: {spec}（格式为 后缀:格式[:调整]，如 _thumb:png:scale=10）")
+    suffix, output_format = parts[0], parts[1].lower()
+    if '/' in suffix or os.sep in suffix:
+        raise ValueError(f"输出文件名后缀不能包含路径分隔符: {suffix}")
+    
+    adjustment_type, value = "none", None
+    if len(parts) == 3 and parts[2]:
+        adjustment_type, _, value = parts[2].partition('=')
+        adjustment_type = adjustment_type.strip().lower()
+        if adjustment_type not in RENDITION_ADJUSTMENTS or not value.strip():
+            raise ValueError(f"无效的输出调整: {parts[2]}（可用 scale=百分比、filesize=KB、quality=1-10）")
+    
+    # 复用单一输出的校验和错误信息
+    options = {RENDITION_ADJUSTMENTS[adjustment_type]: value.strip()} if value else {}
+    checked = make_settings(output_format=output_format, adjustment_type=adjustment_type,
+                            workers=1, **options)
+    return {
+        'suffix': suffix,
+        'output_format': checked['output_format'],
+        'adjustment_type': checked['adjustment_type'],
+        'scale_percentage': checked['scale_percentage'],
+        'target_filesize': checked['target_filesize'],
+        'quality_level': checked['quality_level'],
+    }
+
+
+def describe_settings(settings):
+    """调整设置的日志说明，不调整时返回 None"""
+    if settings['renditions']:
+        return "多种输出: " + "; ".join(describe_rendition(rendition)
+                                       for rendition in settings['renditions'])
+    adjustment_type = settings['adjustment_type']
+    if adjustment_type == "scale":
+        return f"调整设置: 缩放比例 {settings['scale_percentage']:g}%"
+    elif adjustment_type == "filesize":
+        return f"调整设置: 目标文件大小 {settings['target_filesize']}KB"
+    elif adjustment_type == "quality":
+        return f"调整设置: 图片质量等级 {settings['quality_level']}/10"
+    elif adjustment_type == "budget":
+        return f"调整设置: 总大小预算 {settings['total_budget_mb']:g}MB"
+    return None
+
+
+def describe_rendition(rendition):
+    """一种输出的简短说明，如 “_thumb.png 缩放10%”"""
+    name = f"{rendition['suffix']}.{rendition['output_format']}"
+    adjustment_type = rendition['adjustment_type']
+    if adjustment_type == "scale":
+        return f"{name} 缩放{rendition['scale_percentage']:g}%"
+    elif adjustment_type == "filesize":
+        return f"{name} {rendition['target_filesize']}KB"
+    elif adjustment_type == "quality":
+        return f"{name} 质量{rendition['quality_level']}"
+    return name
+
+
+def settings_signature(settings):
+    """影响输出结果的设置的签名"""
+    keys = OUTPUT_SETTING_KEYS + ADJUSTMENT_SETTING_KEYS[settings['adjustment_type']]
+    effective = {key: settings[key] for key in keys}
+    if settings['renditions']:
+        # 只在使用多种输出时加入签名，单一输出的签名与之前的清单保持一致
+        effective['renditions'] = settings['renditions']
+    encoded = json.dumps(effective, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16], effective
+
+
+def is_output_folder(path):
+    """是否为以前转换的输出文件夹：名字为默认的输出文件夹名，或包含增量转换清单、
+    转换日志或协同转换的临时文件夹"""
+    if OUTPUT_FOLDER_PATTERN.match(os.path.basename(path)):
+        return True
+    return any(os.path.lexists(os.path.join(path, marker)) for marker in OUTPUT_FOLDER_MARKERS)
+
+
+def iter_image_files(input_folder, recursive=False, exclude_folders=()):
+    """逐个产出输入文件夹中支持的图片文件
+    
+    每个文件夹只用 os.scandir 遍历一次，扩展名不区分大小写；边遍历边产出，
+    大文件夹不必等全部列出就可以开始转换。recursive 为 True 时包含子文件夹，
+    exclude_folders 中的文件夹（如位于输入文件夹内的输出文件夹）会被跳过，
+    以前转换的输出文件夹（见 is_output_folder）也会被跳过。
+    """
+    excluded = {os.path.realpath(folder) for folder in exclude_folders}
+    pending_folders = [input_folder]
+    
+    while pending_folders:
+        folder = pending_folders.pop()
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            if os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS:
+                                yield entry.path
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            if (os.path.realpath(entry.path) not in excluded
+                                    and not is_output_folder(entry.path)):
+                                subfolders.append(entry.path)
+                    except OSError:
+                        continue  # 无法访问的条目直接跳过
+        except OSError:
+            if folder == input_folder:
+                raise
+            continue  # 无法读取的子文件夹直接跳过
+        
+        # 反向压栈，使子文件夹按遍历顺序处理
+        pending_folders.extend(reversed(subfolders))
+
+
+def make_task(index, file_path, input_folder, output_folder, settings, hooks=()):
+    """生成单个文件的转换任务，只包含路径、设置和转换钩子，方便传给工作进程
+    
+    包含子文件夹时在输出文件夹中保持相同的目录结构（输出文件夹由调用者创建）。
+    压缩包中的文件由调用者在 archive 中填入读取信息（见 converter_archive.iter_members）。
+    """
+    relative_folder = os.path.relpath(os.path.dirname(file_path), input_folder)
+    target_folder = os.path.normpath(os.path.join(output_folder, relative_folder))
+    name_without_ext = os.path.splitext(os.path.basename(file_path))[0]
+    output_filename = f"{name_without_ext}.{settings['output_format']}"
+    return {
+        'index': index,
+        'input_path': file_path,
+        'relative_path': os.path.relpath(file_path, input_folder).replace(os.sep, '/'),
+        'output_path': os.path.join(target_folder, output_filename),
+        'settings': settings,
+        'hooks': hooks,
+        'archive': None,
+    }
+
+
+def iter_tasks(files, input_folder, output_folder, settings, hooks=(), create_folders=True):
+    """逐个生成转换任务，并创建对应的输出文件夹（create_folders 为 False 时不创建，
+    如输出到压缩包时）"""
+    created_folders = set()
+    for i, file_path in enumerate(files):
+        task = make_task(i, file_path, input_folder, output_folder, settings, hooks)
+        target_folder = os.path.dirname(task['output_path'])
+        if create_folders and target_folder not in created_folders:
+            # 创建输出文件夹
+            os.makedirs(target_folder, exist_ok=True)
+            created_folders.add(target_folder)
+        yield task
+
+
+def run_batch(input_folder, output_folder, settings, on_discovered=None, on_result=None,
+              should_stop=None, hooks=(), metrics=None, on_prescan=None):
+    """批量转换输入文件夹中的图片
+    
+    文件查找与转换同时进行。on_discovered(total_files) 在查找完所有文件后调用；
+    on_result(result, completed, total_files) 在每个文件完成后调用，查找尚未结束时
+    total_files 为 None；should_stop() 返回 True 时停止提交新任务。
+    hooks 为在工作进程中围绕每个文件调用的 converter_metrics.ConversionHook 列表；
+    各阶段耗时汇总到 metrics（converter_metrics.BatchMetrics，未提供时自动创建）。
+    按总大小预算调整时先找出全部文件并估算编码大小，再开始转换，汇总中的 budget
+    为预算分配结果（见 converter_budget.BudgetAllocator.report）。
+    合并重复文件时汇总中的 deduplicated 为复制结果而节省的转换次数。
+    转换过程记录在输出文件夹的日志中（见 converter_journal），设置 resume 时跳过
+    上次已完成的文件，汇总中的 resumed 为跳过的文件数，journal 为上次日志中
+    已完成、失败和中断时正在转换的文件数。
+    大图优先（largest_first）或限制总内存（memory_limit_mb）时先预扫描所有文件的
+    文件头，完成后调用 on_prescan(prescan)，prescan 同时保存在汇总中
+    （见 converter_schedule.prescan_summary），每个结果记录的 pixels 为该文件的像素数。
+    多节点协同转换（cluster）时每个文件提交前先认领，已由其他节点完成或正在转换的文件
+    不提交（正在转换的文件最后等待其完成，节点退出时接手），不记录转换日志，
+    汇总中的 cluster 为本节点的认领统计（见 converter_cluster.ClusterCoordinator）。
+    input_folder 可以是 zip/tar 压缩包，output_folder 可以是 .zip 文件，压缩包中的
+    文件直接读取和写入，不解压到磁盘（见 converter_archive），此时不记录转换日志。
+    返回本次批量转换的汇总信息。
+    """
+    if metrics is None:
+        metrics = converter_metrics.BatchMetrics()
+    input_archive = converter_archive.is_archive(input_folder)
+    output_archive = converter_archive.is_output_archive(output_folder)
+    converter_archive.check_settings(settings, input_folder, output_folder)
+    # 顺序读取的压缩 tar：文件内容随任务传给工作进程，计入在途任务的内存
+    streamed = input_archive and converter_archive.is_streamed(input_folder)
+    if output_archive:
+        # 编码结果都交给写入线程写入压缩包
+        settings = dict(settings, writer_threads=max(1, settings['writer_threads']))
+        os.makedirs(os.path.dirname(os.path.abspath(output_folder)), exist_ok=True)
+    start_time = time.time()
+    summary = {
+        'input_folder': input_folder,
+        'output_folder': output_folder,
+        'total': 0,
+        'converted': 0,
+        'skipped': 0,
+        'failed': 0,
+        'full_encodes': 0,
+        'png_trials': 0,
+        'encodes': 0,
+        'deduplicated': 0,
+        'resumed': 0,
+        'stopped': False,
+        'elapsed': 0.0,
+    }
+    discovery = {'count': 0, 'finished': False}
+    completed = 0
+    archive_members = deque()  # 压缩包中已找到、尚未生成任务的文件的读取信息
+    
+    def handle_result(result):
+        nonlocal completed
+        completed += 1
+        if result['skipped']:
+            summary['skipped'] += 1
+        elif result['success']:
+            summary['converted'] += 1
+        else:
+            summary['failed'] += 1
+        if result['duplicate_of'] is not None:
+            summary['deduplicated'] += 1
+        summary['full_encodes'] += result['full_encodes']
+        summary['png_trials'] += result['png_trials']
+        summary['encodes'] += result['encodes']
+        metrics.add(result)
+        if on_result:
+            on_result(result, completed, discovery['count'] if discovery['finished'] else None)
+    
+    def input_files():
+        if not input_archive:
+            yield from iter_image_files(input_folder, settings['recursive'],
+                                        exclude_folders=[output_folder])
+            return
+        for name, archive in converter_archive.iter_members(input_folder, SUPPORTED_EXTENSIONS,
+                                                            settings['recursive']):
+            archive_members.append(archive)
+            yield os.path.join(input_folder, *name.split('/'))
+    
+    def discovered_files():
+        for file_path in input_files():
+            discovery['count'] += 1
+            yield file_path
+        discovery['finished'] = True
+        summary['total'] = discovery['count']
+        if on_discovered:
+            on_discovered(discovery['count'])
+    
+    tasks = iter_tasks(discovered_files(), input_folder, output_folder, settings, list(hooks),
+                       create_folders=not output_archive)
+    
+    if input_archive:
+        def archive_tasks(tasks):
+            for task in tasks:
+                task['archive'] = archive_members.popleft()
+                yield task
+        
+        tasks = archive_tasks(tasks)
+    
+    manifest = None
+    input_stats = {}
+    if settings['incremental']:
+        manifest = ConversionManifest(output_folder, settings['incremental_hash']).load()
+        signature, effective_settings = settings_signature(settings)
+        
+        def changed_tasks(tasks):
+            # 输入和设置都未变化的文件直接跳过，不提交给进程池
+            for task in tasks:
+                try:
+                    input_stat = os.stat(task['input_path'])
+                except OSError:
+                    # 查找后被删除等无法访问的文件当作已变化，由转换过程报告错误
+                    input_stats[task['index']] = (task, None)
+                    yield task
+                    continue
+                if manifest.is_unchanged(task['relative_path'], task['input_path'],
+                                         input_stat, signature):
+                    if journal is not None:
+                        # 跳过的文件也记为已完成，之后的断点续转不会重新转换
+                        journal.unchanged(task['relative_path'], input_stat, os.path.join(
+                            output_folder, manifest.files[task['relative_path']]['output']))
+                    result = new_result(task)
+                    result['success'] = True
+                    result['skipped'] = True
+                    handle_result(result)
+                else:
+                    input_stats[task['index']] = (task, input_stat)
+                    yield task
+        
+        tasks = changed_tasks(tasks)
+    
+    # 转换日志：记录开始和完成的文件，断点续转时跳过上次已完成的文件
+    # （多节点协同转换时由各节点共享的完成标记代替，压缩包输入或输出时不记录）
+    journal = None
+    if not (settings['cluster'] or input_archive or output_archive):
+        journal = converter_journal.BatchJournal(output_folder, settings_signature(settings)[0],
+                                                 fsync=bool(settings['fsync_batch']))
+        if settings['resume']:
+            journal.load()
+            summary['journal'] = dict(journal.previous)
+        journal.open(keep_completed=settings['resume'])
+    
+    journal_stats = {}  # 任务序号 -> 输入文件的 os.stat 结果，提交转换时记入日志
+    
+    def resumed_tasks(tasks):
+        for task in tasks:
+            if task['index'] in input_stats:
+                input_stat = input_stats[task['index']][1]
+            else:
+                try:
+                    input_stat = os.stat(task['input_path'])
+                except OSError:
+                    input_stat = None
+            if input_stat is None:
+                yield task  # 文件无法访问，由转换过程报告错误
+                continue
+            if settings['resume'] and journal.is_completed(task['relative_path'], input_stat):
+                if input_stats.pop(task['index'], None) is not None:
+                    # 崩溃时清单可能还没保存，补记上次已完成的文件
+                    output_path = os.path.join(
+                        output_folder, journal.completed[task['relative_path']]['out'])
+                    manifest.record(task['relative_path'], input_stat.st_size,
+                                    input_stat.st_mtime_ns, None, signature,
+                                    effective_settings, output_path)
+                result = new_result(task)
+                result['success'] = True
+                result['skipped'] = True
+                summary['resumed'] += 1
+                handle_result(result)
+            else:
+                journal_stats[task['index']] = input_stat
+                yield task
+    
+    if journal is not None:
+        tasks = resumed_tasks(tasks)
+    
+    # 预扫描：大图优先或限制总内存时，先读取所有文件的文件头（压缩包输入时按包内顺序转换）
+    if (settings['largest_first'] and not input_archive) or settings['memory_limit_mb']:
+        prescan_start = time.perf_counter()
+        tasks = converter_schedule.prescan_tasks(tasks, should_stop)
+        summary['prescan'] = converter_schedule.prescan_summary(
+            tasks, time.perf_counter() - prescan_start)
+        if settings['largest_first']:
+            tasks = converter_schedule.largest_first(tasks)
+        if on_prescan:
+            on_prescan(summary['prescan'])
+    memory_limit = settings['memory_limit_mb'] * 2 ** 20
+    if streamed:
+        memory_limit = converter_archive.STREAM_MEMORY_LIMIT
+    
+    allocator = None
+    if settings['adjustment_type'] == "budget":
+        # 第一遍：估算所有文件的 质量→大小 曲线，求出用满预算的统一质量
+        all_tasks = list(tasks)
+        estimates = {}
+        estimate_errors = {}
+        for estimate in iter_conversion_results(all_tasks, settings['workers'],
+                                                should_stop=should_stop,
+                                                function=estimate_image_file,
+                                                memory_limit=memory_limit,
+                                                on_crash=crashed_estimate):
+            if estimate['success']:
+                estimates[estimate['index']] = estimate['sizes']
+            else:
+                estimate_errors[estimate['index']] = estimate['error']
+        allocator = converter_budget.BudgetAllocator(
+            settings['total_budget_mb'] * 2 ** 20,
+            {task['index']: (task['relative_path'], estimates[task['index']])
+             for task in all_tasks if task['index'] in estimates},
+            MIN_JPEG_QUALITY, MAX_JPEG_QUALITY)
+        
+        def allocated_tasks():
+            # 第二遍：按文件大小模式转换，目标在提交时才分配，可以参考已完成文件的实际大小
+            for task in all_tasks:
+                if task['index'] in estimates:
+                    target_kb = allocator.target_for(task['index'])
+                    yield dict(task, settings=dict(settings, adjustment_type="filesize",
+                                                   target_filesize=target_kb))
+                elif task['index'] in estimate_errors:
+                    result = new_result(task)
+                    result['error'] = f"无法估算编码大小: {estimate_errors[task['index']]}"
+                    handle_result(result)
+        
+        tasks = allocated_tasks()
+    
+    # 多节点协同转换：提交前认领，每个文件只由一个节点转换
+    coordinator = None
+    busy = []  # 其他节点正在转换的任务
+    if settings['cluster']:
+        coordinator = converter_cluster.ClusterCoordinator(
+            output_folder, settings_signature(settings)[0], settings['node_id'],
+            settings['lease_timeout']).start()
+        
+        def claim(task):
+            # 已由其他节点完成的文件直接报告，返回是否需要稍后再认领
+            try:
+                state = coordinator.claim(task)
+            except OSError:
+                return converter_cluster.CLAIMED  # 文件无法访问，由转换过程报告错误
+            if state in (converter_cluster.DONE, converter_cluster.FAILED):
+                result = new_result(task)
+                result['success'] = state == converter_cluster.DONE
+                result['skipped'] = True
+                if not result['success']:
+                    result['error'] = "其他节点转换失败"
+                coordinator.stats['other_nodes'] += 1
+                handle_result(result)
+            return state
+        
+        def claimed_tasks(tasks):
+            for task in tasks:
+                state = claim(task)
+                if state == converter_cluster.CLAIMED:
+                    yield task
+                elif state == converter_cluster.BUSY:
+                    busy.append(task)
+        
+        tasks = claimed_tasks(tasks)
+    
+    def finish_result(result):
+        # 输出文件写入完成后才记入日志、清单和完成标记
+        if journal is not None:
+            journal.finished(result)
+        if coordinator is not None:
+            coordinator.complete(result)
+        if manifest is not None:
+            task, input_stat = input_stats.pop(result['index'])
+            if result['success'] and input_stat is not None:
+                manifest.record(task['relative_path'], input_stat.st_size,
+                                input_stat.st_mtime_ns, result['input_hash'], signature,
+                                effective_settings, result['output_path'])
+        if allocator is not None:
+            allocator.record(result['index'], result['success'], result['bytes_out'])
+        handle_result(result)
+        if finder is not None and result['duplicate_of'] is None:
+            # 代表文件完成后再生成等待中的重复文件
+            leader = {key: result[key] for key in ('filename', 'output_path', 'success',
+                                                   'error', 'input_hash')}
+            leader_results[result['index']] = leader
+            for duplicate in duplicates.pop(result['index'], []):
+                finish_result(duplicate_result(duplicate, leader, settings['dedupe']))
+    
+    def started_tasks(tasks):
+        for task in tasks:
+            input_stat = journal_stats.pop(task['index'], None)
+            if input_stat is not None:
+                journal.started(task, input_stat)
+            yield task
+    
+    if journal is not None:
+        tasks = started_tasks(tasks)
+    
+    # 重复文件合并：每份内容只提交一次，其余文件等代表文件完成后复制结果
+    finder = None
+    duplicates = {}  # 代表文件序号 -> 内容相同、等待复制结果的任务
+    leader_results = {}  # 已完成的代表文件序号 -> 复制结果所需的字段
+    if settings['dedupe'] != "off":
+        finder = converter_dedupe.DuplicateFinder()
+        
+        def unique_tasks(tasks):
+            for task in tasks:
+                leader = finder.leader_of(task)
+                if leader is None:
+                    yield task
+                elif leader in leader_results:
+                    finish_result(duplicate_result(task, leader_results[leader],
+                                                   settings['dedupe']))
+                else:
+                    duplicates.setdefault(leader, []).append(task)
+        
+        tasks = unique_tasks(tasks)
+    
+    def convert(tasks):
+        # 后台写入：工作进程返回编码数据，写入线程写文件的同时进程池继续转换后续文件
+        writer = None
+        if output_archive:
+            writer = converter_archive.ArchiveWriter(output_folder,
+                                                     max_pending=settings['writer_threads'] * 4,
+                                                     fsync=bool(settings['fsync_batch']))
+        elif settings['writer_threads']:
+            writer = converter_writer.OutputWriter(settings['writer_threads'],
+                                                   max_pending=settings['writer_threads'] * 4,
+                                                   ordered=settings['ordered'],
+                                                   fsync_batch=settings['fsync_batch'])
+        try:
+            for result in iter_conversion_results(tasks, settings['workers'],
+                                                  ordered=settings['ordered'],
+                                                  should_stop=should_stop,
+                                                  memory_limit=memory_limit,
+                                                  hold_back=not streamed):
+                if writer is None:
+                    finish_result(result)
+                else:
+                    for written in writer.submit(result):
+                        finish_result(written)
+        finally:
+            if writer is not None:
+                for written in writer.close():
+                    finish_result(written)
+    
+    try:
+        convert(tasks)
+        # 其他节点正在转换的文件：本节点的文件全部写入并释放租约后再等待，
+        # 避免多个节点互相等待；节点退出后租约过期时由本节点接手
+        while busy and not (should_stop and should_stop()):
+            time.sleep(converter_cluster.BUSY_POLL_SECONDS)
+            waiting, busy[:] = list(busy), []
+            reclaimed = list(claimed_tasks(waiting))
+            if reclaimed:
+                convert(reclaimed)
+    finally:
+        if journal is not None:
+            journal.close()
+        if coordinator is not None:
+            coordinator.close()
+        if manifest is not None:
+            manifest.save()
+        if input_archive:
+            converter_archive.close_archives()
+    
+    summary['total'] = discovery['count']
+    summary['stopped'] = not discovery['finished'] or completed < discovery['count']
+    summary['elapsed'] = round(time.time() - start_time, 3)
+    summary['metrics'] = metrics.summary()
+    if coordinator is not None:
+        summary['cluster'] = dict(coordinator.stats, node=coordinator.node_id)
+    if allocator is not None:
+        summary['budget'] = allocator.report()
+    return summary
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量转换日志
+在输出文件夹中以追加方式逐行记录每个文件的开始、完成和失败，程序被关闭或崩溃后
+可以断点续转：跳过上次已完成的文件，只重试失败和中断时正在转换的文件
+"""
+
+import json
+import os
+import time
+
+
+# 日志文件名，保存在输出文件夹中，每行一条 JSON 记录
+JOURNAL_FILENAME = ".imgtrans-journal.jsonl"
+JOURNAL_VERSION = 1
+# 记录先缓存在内存中，每积累这么多条或间隔这么多秒统一写入一次（同步磁盘时也只同步一次）
+JOURNAL_FLUSH_RECORDS = 256
+JOURNAL_FLUSH_SECONDS = 1.0
+
+
+def encode_record(record):
+    """一条记录编码为一行紧凑的 JSON"""
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+
+
+def parse_records(text):
+    """解析多行记录
+    
+    所有行拼接为一个 JSON 数组一次解析，比逐行解析快数倍。崩溃时通常只有最后一行
+    不完整，去掉最后一行后再整体解析；仍然失败时逐行解析，忽略无法解析的行。
+    """
+    def parse_all(lines):
+        return json.loads('[' + lines.replace('\n', ',') + ']')
+    
+    try:
+        return parse_all(text)
+    except ValueError:
+        pass
+    try:
+        return parse_all(text.rpartition('\n')[0])
+    except ValueError:
+        records = []
+        for line in text.split('\n'):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+
+class BatchJournal:
+    """输出文件夹中的批量转换日志
+    
+    每条记录的 s 字段为 start（提交转换）、done（输出文件已写入）或 fail（转换失败），
+    f 字段为输入文件的相对路径，同一文件以最后一条记录为准。只有输出文件写入完成后
+    才记录 done，因此崩溃时丢失尚未写入的记录只会让这些文件在续转时重新转换。
+    第一行记录转换设置的签名，设置不同的日志不用于续转。
+    """
+    
+    def __init__(self, output_folder, signature, fsync=False):
+        self.path = os.path.join(output_folder, JOURNAL_FILENAME)
+        self.output_folder = output_folder
+        self.signature = signature
+        self.fsync = fsync
+        self.completed = {}  # 相对路径 -> done 记录（上次已完成的文件）
+        self.previous = {'completed': 0, 'failed': 0, 'in_flight': 0}
+        self.pending = {}  # 任务序号 -> (相对路径, 大小, 修改时间)
+        self.lines = []
+        self.last_flush = time.monotonic()
+        self.file = None
+    
+    def load(self):
+        """读取上次的日志，文件不存在、已损坏或设置不同时视为没有已完成的文件
+        
+        崩溃时最后一行可能只写了一半，无法解析的记录直接忽略。
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header_line = f.readline()
+                body = f.read().rstrip('\n')
+        except (OSError, UnicodeDecodeError):
+            return self
+        
+        try:
+            header = json.loads(header_line)
+        except ValueError:
+            return self
+        if header.get('version') != JOURNAL_VERSION or header.get('settings') != self.signature:
+            return self
+        
+        states = {}
+        for record in parse_records(body):
+            if 'f' in record:
+                states[record['f']] = record
+        
+        for relative_path, record in states.items():
+            status = record.get('s')
+            if status == 'done':
+                self.completed[relative_path] = record
+                self.previous['completed'] += 1
+            elif status == 'fail':
+                self.previous['failed'] += 1
+            else:
+                self.previous['in_flight'] += 1
+        return self
+    
+    def is_completed(self, relative_path, input_stat):
+        """上次已完成、输入文件未变化且输出文件仍然存在时返回 True"""
+        record = self.completed.get(relative_path)
+        if (record is None or record['size'] != input_stat.st_size
+                or record['mtime_ns'] != input_stat.st_mtime_ns):
+            return False
+        return os.path.exists(os.path.join(self.output_folder, record['out']))
+    
+    def open(self, keep_completed=False):
+        """开始本次转换的日志
+        
+        keep_completed 为 True 时（断点续转）新日志先写入上次已完成的文件，
+        中断前的开始和失败记录不再保留，日志不会随着多次续转不断变长。
+        新日志写入临时文件后替换旧日志，之后的记录以追加方式写入。
+        """
+        os.makedirs(self.output_folder, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(encode_record({'version': JOURNAL_VERSION, 'settings': self.signature}))
+            if keep_completed:
+                for record in self.completed.values():
+                    f.write(encode_record(record))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        return self
+    
+    def _append(self, record):
+        self.lines.append(encode_record(record))
+        if (len(self.lines) >= JOURNAL_FLUSH_RECORDS
+                or time.monotonic() - self.last_flush >= JOURNAL_FLUSH_SECONDS):
+            self.flush()
+    
+    def started(self, task, input_stat):
+        """记录提交转换的文件"""
+        self.pending[task['index']] = (task['relative_path'], input_stat.st_size,
+                                       input_stat.st_mtime_ns)
+        self._append({'s': 'start', 'f': task['relative_path']})
+    
+    def _done(self, relative_path, size, mtime_ns, output_path):
+        self._append({'s': 'done', 'f': relative_path, 'size': size, 'mtime_ns': mtime_ns,
+                      'out': os.path.relpath(output_path, self.output_folder).replace(os.sep, '/')})
+    
+    def unchanged(self, relative_path, input_stat, output_path):
+        """记录增量转换跳过的文件（输出文件已经存在），之后断点续转时同样跳过
+        
+        不续转时新日志只有首行，不记录这些文件的话，增量转换之后的续转会重新转换它们。
+        """
+        self._done(relative_path, input_stat.st_size, input_stat.st_mtime_ns, output_path)
+    
+    def finished(self, result):
+        """记录输出文件已写入（或转换失败）的文件"""
+        entry = self.pending.pop(result['index'], None)
+        if entry is None:
+            return
+        relative_path, size, mtime_ns = entry
+        if result['success']:
+            self._done(relative_path, size, mtime_ns, result['output_path'])
+        else:
+            self._append({'s': 'fail', 'f': relative_path, 'error': result['error']})
+    
+    def flush(self):
+        """把缓存的记录写入日志文件"""
+        self.last_flush = time.monotonic()
+        if not self.lines or self.file is None:
+            return
+        self.file.write(''.join(self.lines))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.lines = []
+    
+    def close(self):
+        """写入剩余记录并关闭日志文件"""
+        if self.file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.file.close()
+            self.file = None
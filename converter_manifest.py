@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量转换清单
+记录每个输入文件的大小、修改时间、可选的内容哈希以及转换设置，
+再次转换同一输出文件夹时跳过未变化的文件
+"""
+
+import hashlib
+import json
+import os
+
+
+# 清单文件名，保存在输出文件夹中
+MANIFEST_FILENAME = ".imgtrans-manifest.json"
+MANIFEST_VERSION = 1
+# 每记录多少个文件保存一次清单，减少中途退出时丢失的记录
+MANIFEST_SAVE_INTERVAL = 1000
+# 计算文件哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """流式计算文件内容哈希"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    """输出文件夹中的增量转换清单
+    
+    以输入文件的相对路径为键保存记录，查询和更新都是 O(1)。
+    """
+    
+    def __init__(self, output_folder, use_hash=False):
+        self.path = os.path.join(output_folder, MANIFEST_FILENAME)
+        self.output_folder = output_folder
+        self.use_hash = use_hash
+        self.files = {}
+        self.settings = {}
+        self.unsaved = 0
+    
+    def load(self):
+        """读取已有清单，文件不存在或已损坏时从空清单开始"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+        
+        if data.get('version') == MANIFEST_VERSION:
+            self.files = data.get('files', {})
+            self.settings = data.get('settings', {})
+        return self
+    
+    def save(self):
+        """写入临时文件后替换，避免留下不完整的清单"""
+        if not self.unsaved:
+            return
+        os.makedirs(self.output_folder, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        data = {'version': MANIFEST_VERSION, 'settings': self.settings, 'files': self.files}
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        self.unsaved = 0
+    
+    def is_unchanged(self, relative_path, input_path, input_stat, signature):
+        """输入文件和转换设置都没有变化，且输出文件仍然存在时返回 True"""
+        entry = self.files.get(relative_path)
+        if entry is None or entry['settings'] != signature or entry['size'] != input_stat.st_size:
+            return False
+        
+        output_path = os.path.join(self.output_folder, entry['output'])
+        if not os.path.exists(output_path):
+            return False
+        
+        if entry['mtime_ns'] == input_stat.st_mtime_ns:
+            return True
+        
+        # 修改时间变化但大小相同时，用内容哈希判断是否真的改变
+        if self.use_hash and entry.get('hash'):
+            if hash_file(input_path) == entry['hash']:
+                entry['mtime_ns'] = input_stat.st_mtime_ns
+                self.unsaved += 1
+                return True
+        return False
+    
+    def record(self, relative_path, size, mtime_ns, content_hash, signature, settings,
+               output_path):
+        """记录一个转换成功的文件"""
+        self.settings[signature] = settings
+        self.files[relative_path] = {
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'hash': content_hash,
+            'settings': signature,
+            'output': os.path.relpath(output_path, self.output_folder).replace(os.sep, '/'),
+        }
+        self.unsaved += 1
+        if self.unsaved >= MANIFEST_SAVE_INTERVAL:
+            self.save()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转换过程统计
+记录每个文件在各阶段（解码、缩放、透明背景合成、编码、写入）的耗时、
+编码次数和输入输出字节数，汇总为批量统计并导出为JSON/CSV；
+转换钩子可以对选定的文件挂接cProfile或自定义的统计收集
+"""
+
+import cProfile
+import csv
+import fnmatch
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+# 转换阶段（按流程顺序），未计入任何阶段的时间记为 other
+STAGES = ['decode', 'resize', 'flatten', 'encode', 'write']
+STAGE_LABELS = {
+    'decode': "解码",
+    'resize': "缩放",
+    'flatten': "透明背景",
+    'encode': "编码",
+    'write': "写入",
+    'other': "其他",
+}
+# 逐文件CSV的列
+CSV_FIELDS = (['index', 'filename', 'success', 'skipped', 'elapsed']
+              + STAGES + ['other', 'encodes', 'full_encodes', 'png_trials', 'bytes_in', 'bytes_out'])
+
+# 当前进程正在转换的文件的结果记录（每个进程同一时间只转换一个文件）
+_active_result = None
+
+
+def new_file_stats():
+    """结果记录中的统计字段"""
+    return {
+        'timings': {},
+        'encodes': 0,
+        'bytes_in': 0,
+        'bytes_out': 0,
+    }
+
+
+def begin_file(result):
+    """开始统计一个文件，之后的阶段耗时和编码次数都记入该结果记录"""
+    global _active_result
+    _active_result = result
+
+
+def end_file():
+    """结束当前文件的统计"""
+    global _active_result
+    _active_result = None
+
+
+@contextmanager
+def stage(name):
+    """统计 with 块的耗时并计入当前文件的指定阶段"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _active_result is not None:
+            timings = _active_result['timings']
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def count_encode():
+    """记录一次编码（含代理图和试探编码）"""
+    if _active_result is not None:
+        _active_result['encodes'] += 1
+
+
+def count_bytes_out(size):
+    """记录写出的字节数"""
+    if _active_result is not None:
+        _active_result['bytes_out'] += size
+
+
+class ConversionHook:
+    """转换钩子基类
+    
+    在工作进程中围绕单个文件的转换调用：before_file(task) 在解码之前，
+    after_file(task, result) 在转换结束之后（result 已包含各阶段耗时）。
+    钩子随任务发送到工作进程，必须可以被 pickle（定义在模块顶层）。
+    patterns 为相对路径的通配符列表（如 ["*.tif", "scans/*"]），为空时对所有文件生效。
+    """
+    
+    def __init__(self, patterns=None):
+        self.patterns = list(patterns or [])
+    
+    def matches(self, relative_path):
+        """钩子是否作用于该文件"""
+        return not self.patterns or any(fnmatch.fnmatch(relative_path, pattern)
+                                        for pattern in self.patterns)
+    
+    def before_file(self, task):
+        """开始转换文件之前调用"""
+    
+    def after_file(self, task, result):
+        """文件转换结束之后调用（无论成功与否）"""
+
+
+class ProfileHook(ConversionHook):
+    """用cProfile分析选定文件的转换，每个文件保存一个 .prof 文件
+    
+    可以用 python -m pstats 或 snakeviz 等工具查看。
+    """
+    
+    def __init__(self, output_folder, patterns=None):
+        super().__init__(patterns)
+        self.output_folder = output_folder
+        self.profiler = None
+    
+    def before_file(self, task):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+    
+    def after_file(self, task, result):
+        self.profiler.disable()
+        name = task['relative_path'].replace('/', '__')
+        os.makedirs(self.output_folder, exist_ok=True)
+        self.profiler.dump_stats(os.path.join(self.output_folder, f"{name}.prof"))
+        self.profiler = None
+
+
+class BatchMetrics:
+    """汇总一次批量转换的统计
+    
+    只累加各阶段的总量，keep_files 为 True 时才保留逐文件记录用于导出CSV。
+    """
+    
+    def __init__(self, keep_files=False):
+        self.keep_files = keep_files
+        self.files = []
+        self.converted = 0
+        self.totals = {name: 0.0 for name in STAGES + ['other']}
+        self.elapsed = 0.0
+        self.encodes = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+    
+    def add(self, result):
+        """加入一个文件的结果记录（跳过的文件不计入）"""
+        if result['skipped']:
+            return
+        timings = result['timings']
+        other = max(0.0, result['elapsed'] - sum(timings.values()))
+        if result['success']:
+            self.converted += 1
+        for name in STAGES:
+            self.totals[name] += timings.get(name, 0.0)
+        self.totals['other'] += other
+        self.elapsed += result['elapsed']
+        self.encodes += result['encodes']
+        self.bytes_in += result['bytes_in']
+        self.bytes_out += result['bytes_out']
+        
+        if self.keep_files:
+            row = {field: result.get(field) for field in CSV_FIELDS}
+            row.update({name: round(timings.get(name, 0.0), 6) for name in STAGES})
+            row['other'] = round(other, 6)
+            self.files.append(row)
+    
+    def summary(self):
+        """各阶段的总耗时（秒）和占比，以及编码次数和字节数"""
+        return {
+            'files': self.converted,
+            'elapsed': round(self.elapsed, 3),
+            'stages': {name: {'seconds': round(seconds, 3),
+                              'share': round(seconds / self.elapsed * 100, 1) if self.elapsed else 0.0}
+                       for name, seconds in self.totals.items()},
+            'encodes': self.encodes,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+    
+    def summary_lines(self):
+        """日志中显示的统计摘要"""
+        if not self.elapsed:
+            return []
+        stages = ", ".join(f"{STAGE_LABELS[name]} {seconds:.2f}秒 ({seconds / self.elapsed:.0%})"
+                           for name, seconds in self.totals.items() if seconds >= 0.005)
+        return [
+            f"阶段耗时（各进程合计 {self.elapsed:.2f}秒）: {stages}",
+            f"编码 {self.encodes} 次, 读取 {self.bytes_in / 2 ** 20:.1f}MB, "
+            f"写出 {self.bytes_out / 2 ** 20:.1f}MB",
+        ]
+    
+    def write_json(self, path):
+        """导出汇总和逐文件记录为JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'summary': self.summary(), 'files': self.files}, f,
+                      ensure_ascii=False, indent=2)
+    
+    def write_csv(self, path):
+        """导出逐文件记录为CSV"""
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.files)
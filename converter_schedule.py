@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预扫描与调度
+转换前只读取每个文件的文件头（不解码像素），得到尺寸、模式和帧数，
+据此把大图排在前面（避免最后剩下一张大图单独转换），按解码后的内存估算
+控制同时转换的图片，并按像素数而不是文件数估算进度和剩余时间
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import converter_tiles
+
+
+# 预扫描的线程数（读取文件头主要是等待磁盘，线程足够）
+PRESCAN_THREADS = 8
+# 转换一张图片时除解码结果外，透明通道合成、缩放结果和编码缓冲区等额外占用的内存，
+# 按解码后大小的倍数估算
+DECODED_MEMORY_FACTOR = 2.0
+# 估算剩余时间前至少已经处理的像素比例，太早估算时误差很大
+ETA_MIN_FRACTION = 0.01
+
+
+def prescan_image(input_path, settings):
+    """只读取文件头，返回图片的尺寸、模式、帧数、需要处理的像素数和估算的内存占用
+    
+    只有需要转换所有帧时才读取帧数（GIF的帧数需要扫描整个文件）。
+    无法读取时像素数为0，内存保守地按总内存上限估算（不会与其他图片同时转换），
+    错误由转换过程报告。调用前需关闭Pillow的像素数检查（见 prescan_tasks）。
+    """
+    info = {'size': None, 'mode': None, 'frames': 1, 'pixels': 0,
+            'memory': settings['memory_limit_mb'] * 2 ** 20}
+    try:
+        with Image.open(input_path) as img:
+            info['size'] = img.size
+            info['mode'] = img.mode
+            if settings['frame_mode'] != "first":
+                info['frames'] = getattr(img, 'n_frames', 1)
+            banded = converter_tiles.can_decode_in_bands(img)
+    except Exception:
+        return info
+    
+    width, height = info['size']
+    info['pixels'] = width * height * info['frames']
+    # 逐帧处理时同一时间只解码一帧
+    memory = converter_tiles.decoded_bytes(info['mode'], info['size']) * DECODED_MEMORY_FACTOR
+    budget_bytes = settings['memory_budget_mb'] * 2 ** 20
+    if budget_bytes and banded:
+        # 超出单个进程内存预算的未压缩TIFF会分块处理，占用不超过预算（其他图片仍完整解码）
+        memory = min(memory, budget_bytes)
+    info['memory'] = int(memory)
+    return info
+
+
+def prescan_tasks(tasks, should_stop=None):
+    """预扫描所有任务，把结果放在任务的 prescan 中，返回任务列表
+    
+    多个线程同时读取文件头，同时在途的读取数量有上限；should_stop() 返回 True 时
+    停止并返回已扫描的任务。只读取文件头，不需要Pillow的像素数检查：超过上限的
+    超大图片正是最需要准确估算的，像素数检查由转换过程按内存预算决定。
+    """
+    scanned = []
+    pending = deque()
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        with ThreadPoolExecutor(max_workers=PRESCAN_THREADS,
+                                thread_name_prefix="imgtrans-prescan") as executor:
+            for task in tasks:
+                if should_stop and should_stop():
+                    break
+                pending.append((task, executor.submit(prescan_image, task['input_path'],
+                                                      task['settings'])))
+                if len(pending) >= PRESCAN_THREADS * 4:
+                    task, future = pending.popleft()
+                    task['prescan'] = future.result()
+                    scanned.append(task)
+            else:
+                for task, future in pending:
+                    task['prescan'] = future.result()
+                    scanned.append(task)
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_image_pixels
+    return scanned
+
+
+def largest_first(tasks):
+    """按需要处理的像素数从多到少排序（像素数相同时保持原顺序）"""
+    return sorted(tasks, key=lambda task: task['prescan']['pixels'], reverse=True)
+
+
+def task_memory(task):
+    """任务估算的内存占用（字节），没有预扫描时为0；任务带着从压缩包读入的文件内容时
+    加上其大小"""
+    prescan = task.get('prescan')
+    memory = prescan['memory'] if prescan else 0
+    archive = task.get('archive')
+    if archive is not None and archive.get('data') is not None:
+        memory += len(archive['data'])
+    return memory
+
+
+def prescan_summary(tasks, elapsed):
+    """预扫描的汇总：文件数、总像素数、单个文件最大的内存估算和耗时"""
+    return {
+        'files': len(tasks),
+        'pixels': sum(task['prescan']['pixels'] for task in tasks),
+        'max_memory': max((task['prescan']['memory'] for task in tasks), default=0),
+        'elapsed': round(elapsed, 3),
+    }
+
+
+def prescan_log_line(prescan):
+    """日志中显示的预扫描摘要"""
+    return (f"预扫描: {prescan['files']} 个文件，共 {prescan['pixels'] / 1e6:.1f} 百万像素，"
+            f"单个文件最多约需 {prescan['max_memory'] / 2 ** 20:.0f}MB 内存，"
+            f"用时 {prescan['elapsed']:.2f}秒")
+
+
+class PixelProgress:
+    """按像素数计算的转换进度和剩余时间
+    
+    大图和小图的转换时间相差很大，按文件数计算的进度在先转换大图时严重偏低，
+    按已处理像素占总像素的比例和处理速度估算更准确。
+    """
+    
+    def __init__(self, total_pixels):
+        self.total_pixels = total_pixels
+        self.done_pixels = 0
+        self.start_time = time.monotonic()
+    
+    def add(self, pixels):
+        """记录一个已完成文件的像素数"""
+        self.done_pixels += pixels
+    
+    def fraction(self):
+        """已完成的比例（0-1）"""
+        if not self.total_pixels:
+            return 0.0
+        return min(1.0, self.done_pixels / self.total_pixels)
+    
+    def eta_seconds(self):
+        """按目前的处理速度估算的剩余秒数，已处理像素太少时返回 None"""
+        fraction = self.fraction()
+        if fraction < ETA_MIN_FRACTION:
+            return None
+        elapsed = time.monotonic() - self.start_time
+        return elapsed * (1 - fraction) / fraction
+
+
+def format_eta(seconds):
+    """剩余时间的显示文本"""
+    if seconds is None:
+        return "正在估算剩余时间"
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"剩余约 {seconds // 3600}小时{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"剩余约 {seconds // 60}分{seconds % 60}秒"
+    return f"剩余约 {seconds}秒"
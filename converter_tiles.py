@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大尺寸TIFF分块处理
+按横向条带只解码需要的行，缩放和合成透明背景也在条带上完成，
+PNG输出逐条带压缩写入，峰值内存由内存预算而不是图片大小决定
+"""
+
+import math
+import struct
+import zlib
+
+from PIL import Image, ImageChops, TiffImagePlugin
+
+
+# LANCZOS滤波器的半径（像素），条带缩放时需要在上下额外读取的行数
+LANCZOS_SUPPORT = 3
+# PNG逐条带写入时，每积累多少字节的压缩数据输出一个IDAT块
+PNG_IDAT_CHUNK_SIZE = 256 * 1024
+
+
+def bytes_per_pixel(mode):
+    """Pillow在内存中存储每个像素占用的字节数"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def decoded_bytes(mode, size):
+    """解码后的图像在内存中占用的字节数"""
+    return size[0] * size[1] * bytes_per_pixel(mode)
+
+
+def _raw_row_stride(img):
+    """未压缩TIFF中一行像素占用的字节数，无法确定时返回 None"""
+    tags = img.tag_v2
+    if tags.get(TiffImagePlugin.PLANAR_CONFIGURATION, 1) != 1:
+        return None
+    bits = tags.get(TiffImagePlugin.BITSPERSAMPLE, (1,))
+    if not isinstance(bits, tuple):
+        bits = (bits,)
+    samples = tags.get(TiffImagePlugin.SAMPLESPERPIXEL, len(bits))
+    if len(bits) == 1 and samples > 1:
+        bits = bits * samples
+    return (img.size[0] * sum(bits) + 7) // 8
+
+
+def can_decode_in_bands(img):
+    """图片能否按条带解码：未压缩的TIFF，每个条带或分块可以单独读取"""
+    return (img.format == 'TIFF'
+            and not getattr(img, 'use_load_libtiff', True)
+            and bool(img.tile)
+            and all(tile[0] == 'raw' for tile in img.tile))
+
+
+def band_tile_height(img):
+    """按条带解码时行范围需要对齐的高度（整条带可以按行切分时为1）"""
+    width = img.size[0]
+    heights = [tile[1][3] - tile[1][1] for tile in img.tile
+               if tile[1][2] - tile[1][0] < width]
+    return max(heights) if heights else 1
+
+
+def load_band(path, y0, y1, frame=0):
+    """只解码图片第 y0 到 y1 行（不含）所在的数据
+    
+    整行宽的未压缩条带按行精确切分，分块TIFF读取与该范围相交的完整分块。
+    返回 (条带图像, 条带第一行在原图中的行号)。
+    """
+    img = Image.open(path)
+    if frame:
+        img.seek(frame)
+    width = img.size[0]
+    stride = _raw_row_stride(img)
+    
+    tiles = []
+    for name, (x0, ty0, x1, ty1), offset, args in img.tile:
+        if ty1 <= y0 or ty0 >= y1:
+            continue
+        if x0 == 0 and x1 == width and stride and args[2] == 1:
+            # 整行宽的条带：跳过不需要的行
+            start = max(ty0, y0)
+            tiles.append((name, (0, start, width, min(ty1, y1)),
+                          offset + (start - ty0) * stride, args))
+        else:
+            tiles.append((name, (x0, ty0, x1, ty1), offset, args))
+    
+    # 新版Pillow的分块描述是命名元组，保持与原来相同的类型
+    tile_type = type(img.tile[0])
+    make_tile = tile_type if tile_type is not tuple else (lambda *fields: fields)
+    
+    top = min(tile[1][1] for tile in tiles)
+    bottom = max(tile[1][3] for tile in tiles)
+    img._size = (width, bottom - top)
+    if hasattr(img, '_tile_size'):
+        # 新版Pillow按 _tile_size 分配TIFF的图像内存
+        img._tile_size = img._size
+    img.tile = [make_tile(name, (x0, ty0 - top, x1, ty1 - top), offset, args)
+                for name, (x0, ty0, x1, ty1), offset, args in tiles]
+    img.load()
+    return img, top
+
+
+def plan_bands(source_mode, source_size, output_size, budget_bytes, tile_height=1):
+    """规划条带：返回 [(输出起始行, 输出结束行, 原图起始行, 原图结束行), ...]
+    
+    每个条带解码后的原图数据和输出数据合计不超过内存预算的一半，
+    另一半留给模式转换、缩放等过程中的临时副本。
+    """
+    width, height = source_size
+    new_width, new_height = output_size
+    scale_y = height / new_height
+    resizing = output_size != source_size
+    margin = int(math.ceil(LANCZOS_SUPPORT * max(scale_y, 1.0))) + 1 if resizing else 0
+    
+    source_row = decoded_bytes(source_mode, (width, 1))
+    output_row = decoded_bytes('RGBA', (new_width, 1))
+    rows = budget_bytes // 2 // (source_row + int(output_row / scale_y) + 1)
+    # 对齐到分块高度时，条带上下最多各多读一个分块
+    source_rows = rows - 2 * margin - 2 * (tile_height - 1)
+    output_rows = int(source_rows / scale_y)
+    if output_rows < 1:
+        raise ValueError(f"内存预算过小，无法容纳宽度为 {width} 像素的条带")
+    
+    bands = []
+    for out_y0 in range(0, new_height, output_rows):
+        out_y1 = min(new_height, out_y0 + output_rows)
+        src_y0 = max(0, int(math.floor(out_y0 * scale_y)) - margin)
+        src_y1 = min(height, int(math.ceil(out_y1 * scale_y)) + margin)
+        bands.append((out_y0, out_y1, src_y0, src_y1))
+    return bands
+
+
+class PngStreamWriter:
+    """逐条带写入PNG文件，也可以逐帧写入多帧PNG（APNG）
+    
+    每行使用Up滤波（与上一行相减），由 ImageChops 在整个条带上一次完成，
+    压缩数据按块写出，内存中只保留当前条带。多帧时每帧调用 begin_frame、
+    write_band、end_frame，帧数需要在创建时给出。
+    """
+    
+    # 模式 -> (PNG颜色类型, 位深)
+    COLOR_TYPES = {
+        'L': (0, 8),
+        'I;16': (0, 16),
+        'RGB': (2, 8),
+        'LA': (4, 8),
+        'RGBA': (6, 8),
+    }
+    
+    def __init__(self, file, size, mode, compress_level=6, num_frames=None, loop=0):
+        if mode not in self.COLOR_TYPES:
+            raise ValueError(f"PNG分块写入不支持 {mode} 模式")
+        self.file = file
+        self.size = size
+        self.mode = mode
+        self.compress_level = compress_level
+        self.animated = num_frames is not None
+        self.frame_index = -1
+        self.frame_open = False
+        self.sequence = 0
+        self.previous_row = None
+        self.pending = []
+        self.pending_size = 0
+        self.compressor = None
+        
+        color_type, bit_depth = self.COLOR_TYPES[mode]
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], bit_depth,
+                                                color_type, 0, 0, 0))
+        if self.animated:
+            self._write_chunk(b'acTL', struct.pack('>II', num_frames, loop))
+    
+    def _write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+    
+    def _next_sequence(self):
+        sequence = self.sequence
+        self.sequence += 1
+        return struct.pack('>I', sequence)
+    
+    def _compress(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.pending.append(compressed)
+            self.pending_size += len(compressed)
+            if self.pending_size >= PNG_IDAT_CHUNK_SIZE:
+                self._flush_pending()
+    
+    def _flush_pending(self):
+        if self.pending:
+            data = b''.join(self.pending)
+            if self.frame_index > 0:
+                # 第一帧之后的帧数据写入fdAT块
+                self._write_chunk(b'fdAT', self._next_sequence() + data)
+            else:
+                self._write_chunk(b'IDAT', data)
+            self.pending = []
+            self.pending_size = 0
+    
+    def begin_frame(self, duration_ms=0):
+        """开始写入新的一帧（单帧PNG可以不调用）"""
+        if self.frame_open:
+            self.end_frame()
+        self.frame_index += 1
+        self.frame_open = True
+        self.previous_row = None
+        self.compressor = zlib.compressobj(self.compress_level)
+        if self.animated:
+            # 每帧覆盖整个画布，直接替换上一帧
+            self._write_chunk(b'fcTL', self._next_sequence() + struct.pack(
+                '>IIIIHHBB', self.size[0], self.size[1], 0, 0,
+                int(duration_ms), 1000, 0, 0))
+    
+    def end_frame(self):
+        """写出当前帧剩余的压缩数据"""
+        remaining = self.compressor.flush()
+        if remaining:
+            self.pending.append(remaining)
+        self._flush_pending()
+        self.frame_open = False
+    
+    def write_band(self, band):
+        """写入一个条带（宽度与图片相同，模式与创建时一致）"""
+        if not self.frame_open:
+            self.begin_frame()
+        width, rows = band.size
+        if self.mode == 'I;16':
+            # 16位灰度不做滤波，按大端字节序写入
+            raw = band.tobytes('raw', 'I;16B')
+            filter_type = b'\x00'
+        else:
+            # Up滤波：每行减去上一行，条带第一行减去上一个条带的最后一行
+            above = Image.new(self.mode, band.size)
+            if self.previous_row is not None:
+                above.paste(self.previous_row, (0, 0))
+            if rows > 1:
+                above.paste(band.crop((0, 0, width, rows - 1)), (0, 1))
+            self.previous_row = band.crop((0, rows - 1, width, rows))
+            raw = ImageChops.subtract_modulo(band, above).tobytes()
+            filter_type = b'\x02'
+        
+        stride = len(raw) // rows
+        view = memoryview(raw)
+        for y in range(rows):
+            self._compress(filter_type)
+            self._compress(view[y * stride:(y + 1) * stride])
+    
+    def close(self):
+        """写出剩余的压缩数据和文件结尾"""
+        if self.frame_open:
+            self.end_frame()
+        self._write_chunk(b'IEND', b'')
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监视文件夹
+持续监视输入文件夹，新文件写入完成后立即用当前设置转换。Linux上使用inotify，
+只处理发生变化的文件；其他系统以及收不到inotify事件的网络共享定时轮询。
+工作进程池在整个监视期间保持运行，转换过的文件记录在增量转换清单中，
+重新启动监视时不会重复转换
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import converter_archive
+import converter_engine
+from converter_manifest import ConversionManifest
+
+
+# 文件大小和修改时间保持不变多久后认为已经写完（秒）
+STABLE_SECONDS = 2.0
+# 收到“写入后关闭”或“移入”事件的文件，确认不再变化所需的时间（秒）
+CLOSED_SETTLE_SECONDS = 0.2
+# 轮询文件夹的间隔（秒）
+POLL_INTERVAL = 1.0
+# 有等待中的文件或在途任务时，主循环检查的间隔（秒）
+BUSY_TICK = 0.05
+# 空闲时等待事件的最长时间（秒），同时决定响应停止请求的速度
+IDLE_TICK = 0.5
+# 一次从inotify读取的最大字节数
+INOTIFY_BUFFER_SIZE = 64 * 1024
+
+# inotify 事件（见 inotify(7)）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# inotify_event 结构的固定部分：wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_image_file(path):
+    """扩展名是否属于支持的输入格式"""
+    return os.path.splitext(path)[1].lower() in converter_engine.SUPPORTED_EXTENSIONS
+
+
+class PollingSource:
+    """定时遍历文件夹，比较文件大小和修改时间找出变化的文件"""
+    
+    mode = "polling"
+    
+    def __init__(self, input_folder, recursive, exclude_folders, interval=POLL_INTERVAL):
+        self.input_folder = input_folder
+        self.recursive = recursive
+        self.exclude_folders = exclude_folders
+        self.interval = interval
+        self.snapshot = {}  # 路径 -> (大小, 修改时间)
+        self.next_poll = 0.0
+    
+    def _scan(self):
+        current = {}
+        changed = []
+        for path in converter_engine.iter_image_files(self.input_folder, self.recursive,
+                                                      self.exclude_folders):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime_ns)
+            if self.snapshot.get(path) != current[path]:
+                changed.append(path)
+        self.snapshot = current
+        return changed
+    
+    def start(self):
+        """开始监视，返回文件夹中已有的图片文件"""
+        self.next_poll = time.monotonic() + self.interval
+        return self._scan()
+    
+    def wait(self, timeout):
+        """最多等待 timeout 秒，返回 [(发生变化的文件, 是否已写完关闭), ...]"""
+        delay = self.next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, delay))
+        self.next_poll = time.monotonic() + self.interval
+        return [(path, False) for path in self._scan()]
+    
+    def close(self):
+        pass
+
+
+class InotifySource:
+    """通过Linux的inotify接收文件夹中的变化，只处理事件涉及的文件
+    
+    包含子文件夹时对每个子文件夹分别监视，新建的子文件夹会自动加入。
+    """
+    
+    mode = "inotify"
+    
+    def __init__(self, input_folder, recursive, exclude_folders):
+        self.input_folder = input_folder
+        self.recursive = recursive
+        self.excluded = {os.path.realpath(folder) for folder in exclude_folders}
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches = {}  # 监视描述符 -> 文件夹
+    
+    def _add_folder(self, folder):
+        """开始监视文件夹（包含子文件夹时连同子文件夹），返回其中已有的图片文件
+        
+        先添加监视再列出文件，两者之间新建的文件也不会遗漏。
+        """
+        files = []
+        folders = [folder]
+        while folders:
+            current = folders.pop()
+            if os.path.realpath(current) in self.excluded:
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                continue  # 无法监视的文件夹（如权限不足）直接跳过
+            self.watches[wd] = current
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_file():
+                                if is_image_file(entry.name):
+                                    files.append(entry.path)
+                            elif self.recursive and entry.is_dir(follow_symlinks=False):
+                                folders.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return files
+    
+    def start(self):
+        """开始监视，返回文件夹中已有的图片文件"""
+        return self._add_folder(self.input_folder)
+    
+    def wait(self, timeout):
+        """最多等待 timeout 秒，返回 [(发生变化的文件, 是否已写完关闭), ...]"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, INOTIFY_BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+        
+        changes = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            
+            if mask & IN_Q_OVERFLOW:
+                # 事件太多导致队列溢出，重新列出一次文件以免遗漏
+                changes.extend((path, False) for path in self._add_folder(self.input_folder))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)  # 文件夹已删除
+                continue
+            folder = self.watches.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    changes.extend((file, False) for file in self._add_folder(path))
+            elif is_image_file(path):
+                changes.append((path, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return changes
+    
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """监视输入文件夹，新文件写完后立即转换
+    
+    文件出现或变化后先放入等待列表，大小和修改时间保持不变一段时间后才提交转换
+    （收到写入后关闭的事件时只需很短的确认时间）；每次只检查等待列表中的文件，
+    不会重新遍历整个文件夹。on_result(result) 在调用 run 的线程中逐个文件调用。
+    use_polling 为 True 时即使在Linux上也使用轮询（如监视网络共享）。
+    """
+    
+    def __init__(self, input_folder, output_folder, settings, on_result=None, hooks=(),
+                 stable_seconds=STABLE_SECONDS, use_polling=False):
+        if settings['adjustment_type'] == "budget":
+            raise ValueError("监视文件夹时不支持按总大小预算调整！")
+        if settings['dedupe'] != "off":
+            raise ValueError("监视文件夹时不支持合并重复文件！")
+        if (converter_archive.is_archive(input_folder)
+                or converter_archive.is_output_archive(output_folder)):
+            raise ValueError("监视文件夹时不支持压缩包输入或输出！")
+        if os.path.realpath(input_folder) == os.path.realpath(output_folder):
+            raise ValueError("监视文件夹时输出文件夹不能与输入文件夹相同！")
+        
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        # 工作进程直接写入输出文件，逐个文件的延迟比写入与转换重叠更重要
+        self.settings = dict(settings, writer_threads=0, incremental=True)
+        self.hooks = list(hooks)
+        self.on_result = on_result
+        self.stable_seconds = stable_seconds
+        self.signature, self.effective_settings = converter_engine.settings_signature(self.settings)
+        self.manifest = ConversionManifest(output_folder, self.settings['incremental_hash']).load()
+        
+        self.pending = {}  # 路径 -> [(大小, 修改时间), 首次观察到该状态的时间, 确认时间]
+        self.ready = deque()  # (路径, 文件状态)，等待提交
+        self.in_flight = {}  # 写入任务 -> (转换任务, 文件状态)
+        self.in_flight_paths = set()
+        self.changed_in_flight = set()  # 转换期间又发生变化、完成后需要重新检查的文件
+        self.max_in_flight = max(1, self.settings['workers']) * 2
+        self.next_index = 0
+        self.converted = 0
+        self.failed = 0
+        self.executor = None
+        
+        exclude_folders = [output_folder]
+        self.source = None
+        if not use_polling and sys.platform.startswith('linux'):
+            try:
+                self.source = InotifySource(input_folder, self.settings['recursive'],
+                                            exclude_folders)
+            except (OSError, AttributeError):
+                pass  # inotify不可用（如监视数量达到上限），改为轮询
+        if self.source is None:
+            self.source = PollingSource(input_folder, self.settings['recursive'], exclude_folders)
+    
+    @property
+    def mode(self):
+        """监视方式：inotify 或 polling"""
+        return self.source.mode
+    
+    def _observe(self, path, closed=False, initial=False):
+        """记录文件的最新状态，状态变化时重新开始计时"""
+        if path in self.in_flight_paths:
+            self.changed_in_flight.add(path)
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)  # 文件已删除或被移走
+            return
+        key = (stat.st_size, stat.st_mtime_ns)
+        if closed:
+            settle = CLOSED_SETTLE_SECONDS
+        elif initial and time.time() - stat.st_mtime >= self.stable_seconds:
+            settle = 0.0  # 开始监视前就已存在且很久未修改的文件
+        else:
+            settle = self.stable_seconds
+        entry = self.pending.get(path)
+        if entry is None or entry[0] != key:
+            self.pending[path] = [key, time.monotonic(), settle]
+        else:
+            entry[2] = min(entry[2], settle)
+    
+    def _check_pending(self):
+        """把已经写完的文件移入待提交队列"""
+        now = time.monotonic()
+        for path, (key, since, settle) in list(self.pending.items()):
+            if now - since < settle:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != key:
+                self.pending[path] = [(stat.st_size, stat.st_mtime_ns), now, self.stable_seconds]
+                continue
+            del self.pending[path]
+            self.ready.append((path, stat))
+    
+    def _submit_ready(self):
+        while self.ready and len(self.in_flight) < self.max_in_flight:
+            path, input_stat = self.ready.popleft()
+            task = converter_engine.make_task(self.next_index, path, self.input_folder,
+                                              self.output_folder, self.settings, self.hooks)
+            self.next_index += 1
+            if self.manifest.is_unchanged(task['relative_path'], path, input_stat,
+                                          self.signature):
+                continue  # 已经用相同设置转换过
+            os.makedirs(os.path.dirname(task['output_path']), exist_ok=True)
+            if self.executor is None:
+                self._finish(task, input_stat, converter_engine.convert_image_file(task))
+            else:
+                future = self.executor.submit(converter_engine.convert_image_file, task)
+                self.in_flight[future] = (task, input_stat)
+                self.in_flight_paths.add(path)
+    
+    def _collect(self):
+        for future in [future for future in self.in_flight if future.done()]:
+            task, input_stat = self.in_flight.pop(future)
+            self.in_flight_paths.discard(task['input_path'])
+            if future.cancelled():
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                result = converter_engine.new_result(task)
+                result['error'] = str(e)
+            self._finish(task, input_stat, result)
+    
+    def _finish(self, task, input_stat, result):
+        if result['success']:
+            self.converted += 1
+            self.manifest.record(task['relative_path'], input_stat.st_size,
+                                 input_stat.st_mtime_ns, result['input_hash'], self.signature,
+                                 self.effective_settings, result['output_path'])
+        else:
+            self.failed += 1
+        if self.on_result:
+            self.on_result(result)
+        if task['input_path'] in self.changed_in_flight:
+            self.changed_in_flight.discard(task['input_path'])
+            self._observe(task['input_path'])
+    
+    def run(self, should_stop=None):
+        """监视并转换，直到 should_stop() 返回 True 或被 KeyboardInterrupt 中断
+        
+        停止时等待正在转换的文件完成，尚未开始的文件留到下次监视时转换。
+        """
+        workers = self.settings['workers']
+        if workers > 1:
+            # 预先启动全部工作进程并加载格式插件，第一个文件不必等待进程启动
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                initializer=converter_engine.init_worker)
+            for future in [self.executor.submit(os.getpid) for _ in range(workers)]:
+                future.result()
+        
+        try:
+            for path in self.source.start():
+                self._observe(path, initial=True)
+            while not (should_stop and should_stop()):
+                busy = self.pending or self.ready or self.in_flight
+                for path, closed in self.source.wait(BUSY_TICK if busy else IDLE_TICK):
+                    self._observe(path, closed)
+                self._collect()
+                self._check_pending()
+                self._submit_ready()
+                if not busy:
+                    self.manifest.save()  # 空闲时保存清单
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self._collect()
+                self.executor = None
+            self.manifest.save()
+            self.source.close()
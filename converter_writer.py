@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+输出文件写入
+先写入同一文件夹中的临时文件，完成后原子改名为目标文件，中途崩溃不会留下
+名字正确但内容不完整的图片；OutputWriter 在后台线程中写入编码好的数据，
+与下一个文件的解码和编码重叠进行
+"""
+
+import itertools
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import fcntl
+except ImportError:  # Windows没有 fcntl 模块，不支持写时复制，改为普通复制
+    fcntl = None
+
+
+# 临时文件的后缀，不属于支持的输入格式，转换中途的临时文件不会被当作输入
+TEMP_SUFFIX = ".imgtrans-tmp"
+
+# Linux 的 FICLONE ioctl：在支持写时复制的文件系统（btrfs、xfs等）上共享数据块
+FICLONE = 0x40049409
+
+_temp_counter = itertools.count()
+
+
+def temp_path_for(path):
+    """目标文件同一文件夹中的临时文件路径（隐藏文件，进程内唯一）"""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.{os.getpid()}-{next(_temp_counter)}{TEMP_SUFFIX}")
+
+
+def remove_quietly(path):
+    """删除文件，文件不存在或无法删除时忽略"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def fsync_folders(folders):
+    """同步文件夹，使改名操作本身也写入磁盘（Windows不支持，跳过）"""
+    if os.name != 'posix':
+        return
+    for folder in folders:
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def data_view(data):
+    """编码数据的只读视图：BytesIO 缓冲区直接取其内存（不复制），其他为 bytes 类对象"""
+    if hasattr(data, 'getbuffer'):
+        return data.getbuffer()
+    return memoryview(data)
+
+
+def write_temp(path, data, fsync=False):
+    """把数据（bytes 类对象或 BytesIO 缓冲区）写入临时文件，返回 (临时文件路径, 字节数)，
+    失败时不留下临时文件"""
+    temp_path = temp_path_for(path)
+    try:
+        with data_view(data) as view, open(temp_path, 'wb', buffering=0) as f:
+            size = view.nbytes
+            # 无缓冲写入直接从视图写入文件，个别系统一次写不完时继续写剩余部分
+            written = 0
+            while written < size:
+                written += f.write(view[written:])
+            if fsync:
+                os.fsync(f.fileno())
+    except BaseException:
+        remove_quietly(temp_path)
+        raise
+    return temp_path, size
+
+
+def atomic_write(path, data, fsync=False):
+    """原子写入：写入临时文件后改名为目标文件，返回写入的字节数"""
+    temp_path, size = write_temp(path, data, fsync)
+    try:
+        os.replace(temp_path, path)
+    except OSError:
+        remove_quietly(temp_path)
+        raise
+    return size
+
+
+def clone_file(source, target):
+    """用写时复制（reflink）复制文件，文件系统不支持时返回 False"""
+    if fcntl is None:
+        return False
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            return False
+    return True
+
+
+def link_output(source, target, mode):
+    """把已有的输出文件原子地复制为另一个输出文件，返回实际使用的方式
+    
+    mode 为 copy（复制）、hardlink（硬链接，两个文件共用同一份数据）或
+    reflink（写时复制，修改其中一个不影响另一个）；硬链接和写时复制不可用时
+    （如跨磁盘、文件系统不支持）改为复制。
+    """
+    temp_path = temp_path_for(target)
+    try:
+        method = mode
+        if mode == "hardlink":
+            try:
+                os.link(source, temp_path)
+            except OSError:
+                method = "copy"
+        elif mode == "reflink" and not clone_file(source, temp_path):
+            method = "copy"
+        if method == "copy":
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        remove_quietly(temp_path)
+        raise
+    return method
+
+
+class OutputWriter:
+    """后台写入线程池
+    
+    工作进程把编码好的数据放在结果记录的 outputs 中返回，submit 把写入交给线程池，
+    返回已经写完的结果记录。在途的结果数超过 max_pending 时 submit 会等待，
+    因此同时保存在内存中的编码数据有上限，并通过进程池的在途任务上限反压转换。
+    
+    fsync_batch 为 0 时只做原子改名，不强制写入磁盘；大于0时写入线程写完临时文件后
+    各自同步该文件（只同步本批文件，不像 os.sync 那样同步整个系统的缓存），
+    每积累这么多个文件统一改名并同步所在的文件夹，这批文件的结果在同步完成后才返回。
+    """
+    
+    def __init__(self, threads=2, max_pending=8, ordered=False, fsync_batch=0):
+        self.executor = ThreadPoolExecutor(max_workers=threads,
+                                           thread_name_prefix="imgtrans-writer")
+        self.max_pending = max_pending
+        self.ordered = ordered
+        self.fsync_batch = fsync_batch
+        self.pending = deque()  # (结果记录, 写入任务)，没有待写数据时写入任务为 None
+        self.uncommitted = []  # (结果记录, [(临时文件, 目标文件), ...])，等待同步和改名
+    
+    def _write(self, result):
+        """在写入线程中写入一个结果的所有输出，返回等待改名的 (临时文件, 目标文件) 列表"""
+        outputs, result['outputs'] = result['outputs'], []
+        renames = []
+        start = time.perf_counter()
+        try:
+            for path, data in outputs:
+                temp_path, size = write_temp(path, data, fsync=bool(self.fsync_batch))
+                renames.append((temp_path, path))
+                if not self.fsync_batch:
+                    os.replace(*renames[-1])
+                    renames.pop()
+                result['bytes_out'] += size
+        except OSError as e:
+            for temp_path, _ in renames:
+                remove_quietly(temp_path)
+            renames = []
+            result['success'] = False
+            result['error'] = f"写入失败: {e}"
+        finally:
+            elapsed = time.perf_counter() - start
+            timings = result['timings']
+            timings['write'] = round(timings.get('write', 0.0) + elapsed, 6)
+            result['elapsed'] = round(result['elapsed'] + elapsed, 6)
+        return renames
+    
+    def _commit(self):
+        """同步并改名等待中的文件，返回这批结果记录"""
+        batch, self.uncommitted = self.uncommitted, []
+        if not batch:
+            return []
+        
+        # 临时文件已在写入线程中同步，这里改名后同步文件夹，使改名本身也写入磁盘
+        start = time.perf_counter()
+        folders = set()
+        for result, renames in batch:
+            try:
+                for temp_path, path in renames:
+                    os.replace(temp_path, path)
+                    folders.add(os.path.dirname(path) or '.')
+            except OSError as e:
+                for temp_path, _ in renames:
+                    remove_quietly(temp_path)
+                result['success'] = False
+                result['error'] = f"写入失败: {e}"
+        try:
+            fsync_folders(folders)
+        except OSError:
+            pass  # 部分文件系统不支持同步文件夹，文件内容已经同步
+        
+        # 同步耗时平均计入这批文件的写入阶段
+        share = (time.perf_counter() - start) / len(batch)
+        for result, _ in batch:
+            result['timings']['write'] = round(result['timings'].get('write', 0.0) + share, 6)
+        return [result for result, _ in batch]
+    
+    def _finish(self, result, future, finished):
+        renames = future.result() if future is not None else []
+        if renames:
+            self.uncommitted.append((result, renames))
+            if len(self.uncommitted) >= self.fsync_batch:
+                finished.extend(self._commit())
+        elif not self.uncommitted or not self.ordered:
+            finished.append(result)
+        else:
+            # 按顺序输出时，排在等待同步的结果之后
+            self.uncommitted.append((result, []))
+    
+    def _collect(self, drain=False):
+        """取出已经写完的结果；在途数超过上限（或 drain 为 True）时等待"""
+        finished = []
+        while self.pending:
+            block = drain or len(self.pending) > self.max_pending
+            if self.ordered:
+                result, future = self.pending[0]
+                if future is not None and not future.done():
+                    if not block:
+                        break
+                    wait([future])
+                ready = [self.pending.popleft()]
+            else:
+                ready = [item for item in self.pending if item[1] is None or item[1].done()]
+                if not ready:
+                    if not block:
+                        break
+                    wait([future for _, future in self.pending], return_when=FIRST_COMPLETED)
+                    continue
+                for item in ready:
+                    self.pending.remove(item)
+            for result, future in ready:
+                self._finish(result, future, finished)
+        return finished
+    
+    def submit(self, result):
+        """提交一个结果记录的输出，返回已经写完的结果记录列表"""
+        future = self.executor.submit(self._write, result) if result['outputs'] else None
+        self.pending.append((result, future))
+        return self._collect()
+    
+    def close(self):
+        """等待所有写入完成并关闭线程池，返回剩余的结果记录"""
+        try:
+            finished = self._collect(drain=True)
+            finished.extend(self._commit())
+        finally:
+            self.executor.shutdown(wait=True)
+        return finished
@@ -2,19 +2,75 @@
 # -*- coding: utf-8 -*-
 """
 图片格式转换工具
-支持将tif/PNG/WebP格式转换为常用格式(png, jpg)
+支持将tif/PNG/WebP格式转换为常用格式(png, jpg, webp)
 支持批量调整缩放比例、文件大小、图片质量
 """
 
 import os
+import sys
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from tkinter.ttk import Progressbar
-from PIL import Image
 import threading
-import glob
+import multiprocessing
+import queue
 from datetime import datetime
-import io
+
+# 转换引擎各模块（连同Pillow）在窗口显示后才导入，见 import_engine
+converter_archive = None
+converter_budget = None
+converter_engine = None
+converter_metrics = None
+converter_schedule = None
+converter_watch = None
+
+
+# 界面刷新间隔（毫秒），工作线程的事件按此频率合并后更新到界面
+UI_REFRESH_MS = 100
+# 每次刷新最多处理的事件数，避免事件过多时界面卡顿
+UI_MAX_EVENTS_PER_REFRESH = 5000
+# 日志框最多保留的行数，完整日志写入输出文件夹中的日志文件
+LOG_MAX_LINES = 1000
+# 转换中关闭窗口后，最多等待这么多秒让正在转换的文件完成并写入转换日志
+CLOSE_WAIT_SECONDS = 30
+# 启动时间测试（converter_benchmark.py --startup-command）使用的参数：窗口显示后立即退出
+STARTUP_CHECK_ARG = "--startup-check"
+# 输出格式选项（与 converter_engine.OUTPUT_FORMATS 相同，创建界面时还没有导入转换引擎）
+OUTPUT_FORMAT_CHOICES = ["jpg", "png", "webp"]
+# 多帧图片处理方式的界面选项 -> 引擎设置值
+FRAME_MODE_LABELS = [
+    ("仅第一帧", "first"),
+    ("逐帧输出", "split"),
+    ("合并为动画PNG", "multi"),
+]
+# 选择输入压缩包时的文件类型
+ARCHIVE_FILETYPES = [
+    ("压缩包", "*.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tbz2 *.tar.xz *.txz"),
+    ("所有文件", "*.*"),
+]
+# 编码预设的界面选项 -> 引擎设置值
+ENCODER_PRESET_LABELS = [
+    ("最快", "fastest"),
+    ("均衡", "balanced"),
+    ("最小文件", "smallest"),
+]
+
+
+def import_engine():
+    """导入转换引擎各模块
+    
+    启动时只导入界面需要的模块，窗口显示后再由后台线程调用本函数导入转换引擎，
+    缩短打开窗口的时间。需要使用转换引擎的操作先调用本函数：已导入时立即返回，
+    后台线程正在导入时 import 语句会等待导入完成。
+    """
+    global converter_archive, converter_budget, converter_engine, converter_metrics
+    global converter_schedule, converter_watch
+    import converter_archive
+    import converter_budget
+    import converter_engine
+    import converter_metrics
+    import converter_schedule
+    import converter_watch
 
 
 class ImageConverter:
@@ -33,25 +89,53 @@ class ImageConverter:
         self.current_file = tk.StringVar()
         self.progress_var = tk.DoubleVar()
         self.is_converting = False
+        self.conversion_thread = None
+        self.pixel_progress = None  # 预扫描后按像素数计算进度
+        
+        # 工作线程通过队列发送界面事件，由主线程定时处理
+        self.ui_events = queue.Queue()
+        self.log_file = None
+        self.log_timestamp = None
         
         # 调整选项变量
-        self.adjustment_type = tk.StringVar(value="none")  # none, scale, filesize, quality
+        self.adjustment_type = tk.StringVar(value="none")  # none, scale, filesize, quality, budget
         self.scale_percentage = tk.StringVar(value="100")
         self.target_filesize = tk.StringVar(value="1024")
+        self.png_allow_downscale = tk.BooleanVar(value=False)
         self.quality_level = tk.StringVar(value="10")
+        self.total_budget = tk.StringVar(value="100")
+        
+        # 并行转换选项
+        self.worker_count = tk.StringVar(value=str(os.cpu_count() or 1))
+        self.ordered_output = tk.BooleanVar(value=False)
+        self.include_subfolders = tk.BooleanVar(value=False)
+        self.memory_budget = tk.StringVar(value="0")
+        self.largest_first = tk.BooleanVar(value=False)
+        self.memory_limit = tk.StringVar(value="0")
+        self.frame_mode = tk.StringVar(value=FRAME_MODE_LABELS[0][0])
+        self.background_color = tk.StringVar(value="#ffffff")
+        self.encoder_preset = tk.StringVar(value=ENCODER_PRESET_LABELS[1][0])
+        self.dedupe = tk.BooleanVar(value=False)
+        self.renditions = tk.StringVar(value="")
+        
+        # 增量转换选项
+        self.incremental = tk.BooleanVar(value=False)
+        self.incremental_hash = tk.BooleanVar(value=False)
+        self.resume = tk.BooleanVar(value=False)
+        self.watch_folder = tk.BooleanVar(value=False)
         
         # 绑定输入路径变化事件
         self.folder_path.trace('w', self.on_input_path_changed)
         
         self.setup_ui()
+        self.root.after(UI_REFRESH_MS, self.process_ui_events)
     
     def on_input_path_changed(self, *args):
         """输入路径变化时自动更新输出路径"""
         input_path = self.folder_path.get()
         if input_path and os.path.exists(input_path):
-            # 生成当前日期字符串 (YYYYMMDD格式)
-            current_date = datetime.now().strftime("%Y%m%d")
-            output_folder = os.path.join(input_path, f"imgTrans-{current_date}")
+            import_engine()
+            output_folder = converter_engine.default_output_folder(input_path)
             self.output_path.set(output_folder)
             self.log_message(f"输出路径已自动设置为: {output_folder}")
     
@@ -86,6 +170,10 @@ class ImageConverter:
         
         ttk.Button(input_frame, text="浏览", 
                   command=self.browse_input_folder).grid(row=0, column=1, padx=(5, 0))
+        ttk.Button(input_frame, text="压缩包",
+                  command=self.browse_input_archive).grid(row=0, column=2, padx=(5, 0))
+        ttk.Checkbutton(input_frame, text="包含子文件夹",
+                        variable=self.include_subfolders).grid(row=0, column=3, padx=(5, 0))
         
         # 输出文件夹选择
         ttk.Label(main_frame, text="输出文件夹:").grid(row=2, column=0, 
@@ -102,6 +190,16 @@ class ImageConverter:
         
         ttk.Button(output_frame, text="浏览", 
                   command=self.browse_output_folder).grid(row=0, column=1, padx=(5, 0))
+        ttk.Button(output_frame, text="压缩包",
+                  command=self.browse_output_archive).grid(row=0, column=2, padx=(5, 0))
+        ttk.Checkbutton(output_frame, text="增量转换",
+                        variable=self.incremental).grid(row=0, column=3, padx=(5, 0))
+        ttk.Checkbutton(output_frame, text="校验内容",
+                        variable=self.incremental_hash).grid(row=0, column=4, padx=(5, 0))
+        ttk.Checkbutton(output_frame, text="断点续转",
+                        variable=self.resume).grid(row=0, column=5, padx=(5, 0))
+        ttk.Checkbutton(output_frame, text="持续监视",
+                        variable=self.watch_folder).grid(row=0, column=6, padx=(5, 0))
         
         # 输出格式选择
         ttk.Label(main_frame, text="输出格式:").grid(row=3, column=0, 
@@ -111,9 +209,60 @@ class ImageConverter:
         format_frame.grid(row=3, column=1, sticky=tk.W, pady=5, padx=(10, 0))
         
         self.format_combo = ttk.Combobox(format_frame, textvariable=self.output_format,
-                                        values=["jpg", "png"], state="readonly", width=15)
+                                        values=OUTPUT_FORMAT_CHOICES, state="readonly", width=15)
         self.format_combo.grid(row=0, column=0)
         
+        # 并行进程数
+        ttk.Label(format_frame, text="并行进程数:").grid(row=0, column=1, padx=(20, 5))
+        ttk.Spinbox(format_frame, from_=1, to=256, textvariable=self.worker_count,
+                    width=5).grid(row=0, column=2)
+        ttk.Checkbutton(format_frame, text="按文件顺序输出",
+                        variable=self.ordered_output).grid(row=0, column=3, padx=(10, 0))
+        
+        # 每个进程的内存预算，超出时大尺寸TIFF分块处理
+        ttk.Label(format_frame, text="内存预算:").grid(row=0, column=4, padx=(20, 5))
+        ttk.Entry(format_frame, textvariable=self.memory_budget, width=7).grid(row=0, column=5)
+        ttk.Label(format_frame, text="MB (0=不限制)", foreground="gray").grid(row=0, column=6, padx=(2, 0))
+        
+        # 多帧图片（多页TIFF、动画GIF/WebP）的处理方式
+        ttk.Label(format_frame, text="多帧图片:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Combobox(format_frame, textvariable=self.frame_mode,
+                     values=[label for label, _ in FRAME_MODE_LABELS], state="readonly",
+                     width=15).grid(row=1, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
+        
+        # 编码预设：在编码速度和文件大小之间取舍
+        ttk.Label(format_frame, text="编码预设:").grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Combobox(format_frame, textvariable=self.encoder_preset,
+                     values=[label for label, _ in ENCODER_PRESET_LABELS], state="readonly",
+                     width=15).grid(row=2, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
+        
+        # 多种输出：一次解码生成多个文件，留空时只按输出格式和调整选项输出一个文件
+        ttk.Label(format_frame, text="多种输出:").grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Entry(format_frame, textvariable=self.renditions, width=40).grid(
+            row=3, column=1, columnspan=4, sticky=(tk.W, tk.E), pady=(5, 0))
+        ttk.Label(format_frame, text="如 _full:jpg; _thumb:png:scale=10", foreground="gray").grid(
+            row=3, column=5, columnspan=2, sticky=tk.W, padx=(5, 0), pady=(5, 0))
+        
+        # 内容相同的输入文件只转换一次，其余复制转换结果
+        ttk.Checkbutton(format_frame, text="合并重复文件",
+                        variable=self.dedupe).grid(row=2, column=3, sticky=tk.W, padx=(10, 0),
+                                                   pady=(5, 0))
+        
+        # 预扫描后先转换大图，并限制同时转换的图片解码后占用的总内存
+        ttk.Checkbutton(format_frame, text="大图优先",
+                        variable=self.largest_first).grid(row=1, column=3, sticky=tk.W, padx=(10, 0),
+                                                          pady=(5, 0))
+        ttk.Label(format_frame, text="总内存上限:").grid(row=2, column=4, padx=(20, 5), pady=(5, 0))
+        ttk.Entry(format_frame, textvariable=self.memory_limit, width=7).grid(row=2, column=5,
+                                                                              pady=(5, 0))
+        ttk.Label(format_frame, text="MB (0=不限制)", foreground="gray").grid(row=2, column=6, padx=(2, 0),
+                                                                             pady=(5, 0))
+        
+        # 转换为jpg时透明区域的背景色
+        ttk.Label(format_frame, text="透明背景色:").grid(row=1, column=4, padx=(20, 5), pady=(5, 0))
+        ttk.Entry(format_frame, textvariable=self.background_color, width=7).grid(row=1, column=5,
+                                                                                  pady=(5, 0))
+        
         # 批量调整选项框架
         adjustment_frame = ttk.LabelFrame(main_frame, text="批量调整选项", padding="10")
         adjustment_frame.grid(row=4, column=0, columnspan=3, sticky=(tk.W, tk.E), 
@@ -145,10 +294,24 @@ class ImageConverter:
         ttk.Label(filesize_frame, text="KB").grid(row=0, column=2, sticky=tk.W)
         ttk.Label(filesize_frame, text="(如：1024表示输出约1MB大小的图片)", 
                  foreground="gray").grid(row=0, column=3, padx=(10, 0), sticky=tk.W)
+        ttk.Checkbutton(filesize_frame, text="PNG无法达到时允许缩小尺寸",
+                        variable=self.png_allow_downscale).grid(row=1, column=1, columnspan=3,
+                                                                sticky=tk.W, pady=(2, 0))
+        
+        # 总大小预算选项
+        budget_frame = ttk.Frame(adjustment_frame)
+        budget_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=2)
+        
+        ttk.Radiobutton(budget_frame, text="总大小预算:", 
+                       variable=self.adjustment_type, value="budget").grid(row=0, column=0, sticky=tk.W)
+        ttk.Entry(budget_frame, textvariable=self.total_budget, width=10).grid(row=0, column=1, padx=(5, 2))
+        ttk.Label(budget_frame, text="MB").grid(row=0, column=2, sticky=tk.W)
+        ttk.Label(budget_frame, text="(所有输出文件合计，按图片复杂度分配，仅jpg/webp)", 
+                 foreground="gray").grid(row=0, column=3, padx=(10, 0), sticky=tk.W)
         
         # 图片质量选项
         quality_frame = ttk.Frame(adjustment_frame)
-        quality_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=2)
+        quality_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=2)
         
         ttk.Radiobutton(quality_frame, text="图片质量:", 
                        variable=self.adjustment_type, value="quality").grid(row=0, column=0, sticky=tk.W)
@@ -219,6 +382,14 @@ class ImageConverter:
             self.folder_path.set(folder)
             self.log_message(f"选择输入文件夹: {folder}")
     
+    def browse_input_archive(self):
+        """浏览输入压缩包，直接转换其中的图片，不解压"""
+        path = filedialog.askopenfilename(title="选择包含图片的压缩包",
+                                          filetypes=ARCHIVE_FILETYPES)
+        if path:
+            self.folder_path.set(path)
+            self.log_message(f"选择输入压缩包: {path}")
+    
     def browse_output_folder(self):
         """浏览输出文件夹"""
         folder = filedialog.askdirectory(title="选择输出文件夹")
@@ -226,40 +397,145 @@ class ImageConverter:
             self.output_path.set(folder)
             self.log_message(f"选择输出文件夹: {folder}")
     
+    def browse_output_archive(self):
+        """选择输出的 zip 压缩包，转换结果直接写入压缩包"""
+        path = filedialog.asksaveasfilename(title="保存为压缩包", defaultextension=".zip",
+                                            filetypes=[("zip 压缩包", "*.zip")])
+        if path:
+            self.output_path.set(path)
+            self.log_message(f"选择输出压缩包: {path}")
+    
     def log_message(self, message):
-        """添加日志消息"""
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
-    
-    def validate_inputs(self):
-        """验证输入参数"""
-        if self.adjustment_type.get() == "scale":
-            try:
-                scale = float(self.scale_percentage.get())
-                if scale <= 0 or scale > 200:
-                    messagebox.showerror("错误", "缩放比例必须在0-200%之间！")
-                    return False
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的缩放比例数字！")
-                return False
-        
-        elif self.adjustment_type.get() == "filesize":
+        """添加日志消息，可在任意线程中调用"""
+        self.ui_events.put(('log', message))
+    
+    def run_on_ui(self, callback):
+        """在主线程中执行回调，可在任意线程中调用"""
+        self.ui_events.put(('call', callback))
+    
+    def process_ui_events(self):
+        """定时处理工作线程发来的事件
+        
+        日志合并后一次写入，进度只保留最新一次，日志框只保留最近的 LOG_MAX_LINES 行。
+        """
+        log_lines = []
+        progress = None
+        current_file = None
+        callbacks = []
+        
+        for _ in range(UI_MAX_EVENTS_PER_REFRESH):
             try:
-                filesize = int(self.target_filesize.get())
-                if filesize <= 0:
-                    messagebox.showerror("错误", "目标文件大小必须大于0KB！")
-                    return False
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的文件大小数字！")
-                return False
+                event = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            kind = event[0]
+            if kind == 'log':
+                log_lines.append(event[1])
+            elif kind == 'progress':
+                progress = event[1:]
+            elif kind == 'current':
+                current_file = event[1]
+            elif kind == 'call':
+                callbacks.append(event[1])
+        
+        if log_lines:
+            text = "\n".join(log_lines) + "\n"
+            if self.log_file:
+                self.log_file.write(text)
+            if len(log_lines) > LOG_MAX_LINES:
+                text = "\n".join(log_lines[-LOG_MAX_LINES:]) + "\n"
+            self.log_text.insert(tk.END, text)
+            line_count = int(self.log_text.index('end-1c').split('.')[0])
+            if line_count > LOG_MAX_LINES:
+                self.log_text.delete('1.0', f"{line_count - LOG_MAX_LINES}.0")
+            self.log_text.see(tk.END)
+        
+        if current_file is not None:
+            self.current_file.set(current_file)
+        
+        if progress is not None:
+            completed, total_files, fraction, eta = progress
+            if fraction is not None:
+                # 预扫描后按像素数显示进度和剩余时间
+                self.progress_var.set(fraction * 100)
+                self.progress_label.config(text=f"{fraction * 100:.1f}%（{completed}/{total_files} 个文件，{eta}）")
+            elif total_files:
+                percent = completed / total_files * 100
+                self.progress_var.set(percent)
+                self.progress_label.config(text=f"{percent:.1f}%")
+            else:
+                self.progress_label.config(text=f"已处理 {completed} 个文件（正在查找更多文件）")
+        
+        for callback in callbacks:
+            callback()
         
-        return True
+        self.root.after(UI_REFRESH_MS, self.process_ui_events)
+    
+    def open_log_file(self, output_folder):
+        """在输出文件夹中创建本次转换的完整日志文件（输出到压缩包时放在压缩包旁边）"""
+        output_folder = converter_archive.side_folder(output_folder)
+        os.makedirs(output_folder, exist_ok=True)
+        self.log_timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        log_path = os.path.join(output_folder, f"imgTrans-{self.log_timestamp}.log")
+        self.log_file = open(log_path, 'w', encoding='utf-8')
+        return log_path
+    
+    def close_log_file(self):
+        """关闭日志文件"""
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+    
+    def flush_log_events(self):
+        """窗口关闭后把事件队列中剩余的日志写入日志文件并关闭（主循环已结束，
+        不再更新界面）"""
+        log_lines = []
+        while True:
+            try:
+                event = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'log':
+                log_lines.append(event[1])
+        if log_lines and self.log_file:
+            self.log_file.write("\n".join(log_lines) + "\n")
+        self.close_log_file()
+    
+    def collect_settings(self):
+        """在主线程中读取并校验界面设置，失败时提示错误并返回 None"""
+        try:
+            return converter_engine.make_settings(
+                output_format=self.output_format.get(),
+                adjustment_type=self.adjustment_type.get(),
+                scale_percentage=self.scale_percentage.get(),
+                target_filesize=self.target_filesize.get(),
+                quality_level=self.quality_level.get(),
+                total_budget_mb=self.total_budget.get(),
+                dedupe="copy" if self.dedupe.get() else "off",
+                renditions=self.renditions.get(),
+                png_allow_downscale=self.png_allow_downscale.get(),
+                workers=self.worker_count.get(),
+                ordered=self.ordered_output.get(),
+                recursive=self.include_subfolders.get(),
+                incremental=self.incremental.get(),
+                incremental_hash=self.incremental_hash.get(),
+                resume=self.resume.get(),
+                memory_budget_mb=self.memory_budget.get(),
+                memory_limit_mb=self.memory_limit.get(),
+                # 按文件顺序输出时按文件顺序转换
+                largest_first=self.largest_first.get() and not self.ordered_output.get(),
+                frame_mode=dict(FRAME_MODE_LABELS)[self.frame_mode.get()],
+                background_color=self.background_color.get(),
+                encoder_preset=dict(ENCODER_PRESET_LABELS)[self.encoder_preset.get()],
+            )
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return None
     
     def start_conversion(self):
         """开始转换"""
         if not self.folder_path.get():
-            messagebox.showerror("错误", "请选择输入文件夹！")
+            messagebox.showerror("错误", "请选择输入文件夹或压缩包！")
             return
         
         if not self.output_path.get():
@@ -267,227 +543,187 @@ class ImageConverter:
             return
         
         if not os.path.exists(self.folder_path.get()):
-            messagebox.showerror("错误", "选择的输入文件夹不存在！")
+            messagebox.showerror("错误", "选择的输入文件夹或压缩包不存在！")
             return
         
-        if not self.validate_inputs():
+        # 工作线程和进程只使用这里生成的设置，不再访问界面变量
+        import_engine()
+        settings = self.collect_settings()
+        if settings is None:
+            return
+        try:
+            converter_archive.check_settings(settings, self.folder_path.get(), self.output_path.get())
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
             return
         
-        # 禁用转换按钮
-        self.convert_button.config(state='disabled')
-        self.is_converting = True
+        watcher = None
+        if self.watch_folder.get():
+            # 监视模式：输入文件夹中出现新文件时自动转换，直到点击“停止监视”
+            try:
+                watcher = converter_watch.FolderWatcher(
+                    self.folder_path.get(), self.output_path.get(), settings,
+                    on_result=lambda result: self.on_file_result(
+                        result, watcher.converted + watcher.failed, None))
+            except ValueError as e:
+                messagebox.showerror("错误", str(e))
+                return
         
-        # 清空日志
+        # 清空日志，完整日志写入文件
         self.log_text.delete(1.0, tk.END)
+        try:
+            log_path = self.open_log_file(self.output_path.get())
+        except OSError as e:
+            messagebox.showerror("错误", f"无法创建输出文件夹或日志文件: {e}")
+            return
+        self.log_message(f"完整日志: {log_path}")
+        
+        # 禁用转换按钮，监视时改为停止按钮
+        if watcher is None:
+            self.convert_button.config(state='disabled')
+        else:
+            self.convert_button.config(text="停止监视", command=self.stop_watching)
+        self.is_converting = True
         
         # 记录调整设置
-        adjustment_type = self.adjustment_type.get()
-        if adjustment_type != "none":
-            if adjustment_type == "scale":
-                self.log_message(f"调整设置: 缩放比例 {self.scale_percentage.get()}%")
-            elif adjustment_type == "filesize":
-                self.log_message(f"调整设置: 目标文件大小 {self.target_filesize.get()}KB")
-            elif adjustment_type == "quality":
-                self.log_message(f"调整设置: 图片质量等级 {int(float(self.quality_level.get()))}/10")
+        description = converter_engine.describe_settings(settings)
+        if description:
+            self.log_message(description)
         
         # 在新线程中执行转换
-        conversion_thread = threading.Thread(target=self.convert_images)
-        conversion_thread.daemon = True
-        conversion_thread.start()
+        if watcher is None:
+            target = self.convert_images
+            args = (self.folder_path.get(), self.output_path.get(), settings)
+        else:
+            target = self.watch_images
+            args = (watcher,)
+        self.conversion_thread = threading.Thread(target=target, args=args)
+        self.conversion_thread.daemon = True
+        self.conversion_thread.start()
     
-    def adjust_image_by_filesize(self, img, target_size_kb, output_format):
-        """根据目标文件大小调整图片"""
-        target_size = target_size_kb * 1024  # 转换为字节
-        
-        # 二分查找合适的质量参数
-        low_quality = 10
-        high_quality = 95
-        
-        for _ in range(10):  # 最多尝试10次
-            mid_quality = (low_quality + high_quality) // 2
-            
-            # 测试当前质量下的文件大小
-            buffer = io.BytesIO()
-            save_kwargs = {}
-            if output_format.lower() == 'jpg':
-                save_kwargs['quality'] = mid_quality
-                save_kwargs['optimize'] = True
-            
-            img.save(buffer, format=output_format.upper(), **save_kwargs)
-            current_size = buffer.tell()
-            
-            if abs(current_size - target_size) <= target_size * 0.1:  # 10%误差范围内
-                buffer.seek(0)
-                return buffer.getvalue(), mid_quality
-            elif current_size > target_size:
-                high_quality = mid_quality - 1
-            else:
-                low_quality = mid_quality + 1
-            
-            if low_quality > high_quality:
-                break
-        
-        # 如果无法达到目标大小，使用最接近的质量
-        buffer = io.BytesIO()
-        save_kwargs = {}
-        if output_format.lower() == 'jpg':
-            save_kwargs['quality'] = max(10, min(95, mid_quality))
-            save_kwargs['optimize'] = True
-        
-        img.save(buffer, format=output_format.upper(), **save_kwargs)
-        buffer.seek(0)
-        return buffer.getvalue(), max(10, min(95, mid_quality))
+    def on_files_discovered(self, total_files):
+        """查找完所有待转换文件后记录日志"""
+        if total_files:
+            self.log_message(f"找到 {total_files} 个图片文件")
+    
+    def on_prescan(self, prescan):
+        """预扫描完成后记录日志，之后按像素数计算进度"""
+        self.log_message(converter_schedule.prescan_log_line(prescan))
+        self.pixel_progress = converter_schedule.PixelProgress(prescan['pixels'])
+    
+    def on_file_result(self, result, completed, total_files):
+        """单个文件转换完成后发送日志和进度事件，由主线程合并更新"""
+        self.ui_events.put(('current', f"已处理: {result['filename']}"))
+        for message in converter_engine.result_log_lines(result):
+            self.log_message(message)
+        
+        # 文件查找尚未结束时 total_files 为 None，只显示已处理数量
+        fraction = eta = None
+        if self.pixel_progress is not None:
+            self.pixel_progress.add(result['pixels'])
+            fraction = self.pixel_progress.fraction()
+            eta = converter_schedule.format_eta(self.pixel_progress.eta_seconds())
+        self.ui_events.put(('progress', completed, total_files, fraction, eta))
     
-    def convert_images(self):
+    def convert_images(self, input_folder, output_folder, settings):
         """转换图片"""
         try:
-            input_folder = self.folder_path.get()
-            output_folder = self.output_path.get()
-            output_format = self.output_format.get()
-            adjustment_type = self.adjustment_type.get()
-            
-            # 查找支持的图片文件（扩展更多格式支持）
-            supported_formats = [
-                # 原有格式
-                '*.tif', '*.tiff', '*.png', '*.webp', 
-                '*.TIF', '*.TIFF', '*.PNG', '*.WEBP',
-                # 扩展格式
-                '*.jpg', '*.jpeg', '*.gif', '*.bmp', 
-                '*.JPG', '*.JPEG', '*.GIF', '*.BMP'
-            ]
-            all_files = []
+            self.log_message(f"输出文件夹: {output_folder}")
+            self.log_message(f"并行进程数: {settings['workers']}")
             
-            for format_pattern in supported_formats:
-                files = glob.glob(os.path.join(input_folder, format_pattern))
-                all_files.extend(files)
+            metrics = converter_metrics.BatchMetrics(keep_files=True)
+            self.pixel_progress = None
+            summary = converter_engine.run_batch(
+                input_folder, output_folder, settings,
+                on_discovered=self.on_files_discovered,
+                on_result=self.on_file_result,
+                should_stop=lambda: not self.is_converting,
+                metrics=metrics,
+                on_prescan=self.on_prescan)
             
-            if not all_files:
+            if summary['total'] == 0:
                 self.log_message("在选择的输入文件夹中未找到支持的图片文件 (tif, png, webp, jpg, gif, bmp)")
-                messagebox.showinfo("提示", "未找到支持的图片文件")
-                self.finish_conversion()
+                self.run_on_ui(lambda: messagebox.showinfo("提示", "未找到支持的图片文件"))
                 return
             
-            total_files = len(all_files)
-            self.log_message(f"找到 {total_files} 个图片文件")
-            
-            # 创建输出文件夹
-            os.makedirs(output_folder, exist_ok=True)
-            self.log_message(f"输出文件夹: {output_folder}")
-            
-            converted_count = 0
-            failed_count = 0
-            
-            for i, file_path in enumerate(all_files):
-                if not self.is_converting:
-                    break
-                
-                try:
-                    # 更新当前处理文件
-                    filename = os.path.basename(file_path)
-                    self.current_file.set(f"正在处理: {filename}")
-                    
-                    # 转换图片
-                    with Image.open(file_path) as img:
-                        original_size = img.size
-                        
-                        # 处理调整选项
-                        if adjustment_type == "scale":
-                            # 缩放比例调整
-                            scale = float(self.scale_percentage.get()) / 100
-                            new_size = (int(original_size[0] * scale), int(original_size[1] * scale))
-                            img = img.resize(new_size, Image.Resampling.LANCZOS)
-                            self.log_message(f"  缩放: {original_size} -> {new_size}")
-                        
-                        # 如果是RGBA模式且要转换为jpg，需要转换为RGB
-                        if output_format.lower() == 'jpg' and img.mode in ('RGBA', 'LA'):
-                            # 创建白色背景
-                            background = Image.new('RGB', img.size, (255, 255, 255))
-                            if img.mode == 'RGBA':
-                                background.paste(img, mask=img.split()[-1])  # 使用alpha通道作为mask
-                            else:
-                                background.paste(img)
-                            img = background
-                        
-                        # 生成输出文件名
-                        name_without_ext = os.path.splitext(filename)[0]
-                        output_filename = f"{name_without_ext}.{output_format}"
-                        output_path = os.path.join(output_folder, output_filename)
-                        
-                        # 保存转换后的图片
-                        save_kwargs = {}
-                        
-                        if adjustment_type == "filesize":
-                            # 文件大小调整
-                            target_kb = int(self.target_filesize.get())
-                            img_data, used_quality = self.adjust_image_by_filesize(img, target_kb, output_format)
-                            with open(output_path, 'wb') as f:
-                                f.write(img_data)
-                            actual_size = len(img_data) // 1024
-                            self.log_message(f"  文件大小: 目标{target_kb}KB -> 实际{actual_size}KB (质量:{used_quality})")
-                            
-                        elif adjustment_type == "quality":
-                            # 图片质量调整
-                            quality_level = int(float(self.quality_level.get()))
-                            if output_format.lower() == 'jpg':
-                                # 将1-10级别映射到JPEG质量10-95
-                                jpeg_quality = int(10 + (quality_level - 1) * 85 / 9)
-                                save_kwargs['quality'] = jpeg_quality
-                                save_kwargs['optimize'] = True
-                                self.log_message(f"  质量调整: 等级{quality_level}/10 (JPEG质量:{jpeg_quality})")
-                            else:
-                                # PNG格式使用压缩级别
-                                png_compress = 9 - int((quality_level - 1) * 8 / 9)  # 1->8, 10->0
-                                save_kwargs['compress_level'] = png_compress
-                                self.log_message(f"  质量调整: 等级{quality_level}/10 (PNG压缩:{png_compress})")
-                            
-                            img.save(output_path, **save_kwargs)
-                            
-                        else:
-                            # 默认保存设置
-                            if output_format.lower() == 'jpg':
-                                save_kwargs['quality'] = 95
-                                save_kwargs['optimize'] = True
-                            
-                            img.save(output_path, **save_kwargs)
-                        
-                        converted_count += 1
-                        self.log_message(f"✓ 转换成功: {filename} -> {output_filename}")
-                
-                except Exception as e:
-                    failed_count += 1
-                    self.log_message(f"✗ 转换失败: {filename} - {str(e)}")
-                
-                # 更新进度条
-                progress = (i + 1) / total_files * 100
-                self.progress_var.set(progress)
-                self.progress_label.config(text=f"{progress:.1f}%")
-                self.root.update_idletasks()
-            
             # 转换完成
-            self.current_file.set("转换完成")
-            self.log_message(f"\n转换完成！成功: {converted_count}, 失败: {failed_count}")
+            converted_count = summary['converted']
+            failed_count = summary['failed']
+            self.ui_events.put(('current', "转换完成"))
+            if summary['skipped']:
+                self.log_message(f"\n转换完成！成功: {converted_count}, 跳过未变化: {summary['skipped']}, 失败: {failed_count}")
+            else:
+                self.log_message(f"\n转换完成！成功: {converted_count}, 失败: {failed_count}")
+            if summary['deduplicated']:
+                self.log_message(f"重复文件: {summary['deduplicated']} 个，复制已有结果，"
+                                 f"节省 {summary['deduplicated']} 次转换")
+            if 'journal' in summary:
+                self.log_message(converter_engine.resume_log_line(summary))
+            if 'budget' in summary:
+                for line in converter_budget.report_lines(summary['budget']):
+                    self.log_message(line)
+            for line in metrics.summary_lines():
+                self.log_message(line)
+            if metrics.files:
+                # 逐文件的各阶段耗时保存在日志文件旁边
+                metrics_path = os.path.join(converter_archive.side_folder(output_folder),
+                                            f"imgTrans-{self.log_timestamp}-metrics.csv")
+                metrics.write_csv(metrics_path)
+                self.log_message(f"各阶段耗时明细: {metrics_path}")
             
             if converted_count > 0:
-                messagebox.showinfo("完成", 
-                                  f"转换完成！\n成功转换: {converted_count} 个文件\n失败: {failed_count} 个文件\n输出文件夹: {output_folder}")
-            
+                # 对话框交给主线程显示
+                self.run_on_ui(lambda: messagebox.showinfo(
+                    "完成", 
+                    f"转换完成！\n成功转换: {converted_count} 个文件\n失败: {failed_count} 个文件\n输出文件夹: {output_folder}"))
+        
+        except Exception as e:
+            error = str(e)
+            self.log_message(f"转换过程中发生错误: {error}")
+            self.run_on_ui(lambda: messagebox.showerror("错误", f"转换过程中发生错误: {error}"))
+        
+        finally:
+            self.is_converting = False
+            self.run_on_ui(self.finish_conversion)
+    
+    def watch_images(self, watcher):
+        """监视输入文件夹并持续转换，直到点击“停止监视”"""
+        try:
+            self.log_message(f"输出文件夹: {watcher.output_folder}")
+            self.log_message(f"正在监视: {watcher.input_folder}（{watcher.mode}），"
+                             f"新文件写完后自动转换")
+            self.ui_events.put(('current', "正在监视..."))
+            watcher.run(should_stop=lambda: not self.is_converting)
+            self.log_message(f"\n监视已停止。成功: {watcher.converted}, 失败: {watcher.failed}")
+        
         except Exception as e:
-            self.log_message(f"转换过程中发生错误: {str(e)}")
-            messagebox.showerror("错误", f"转换过程中发生错误: {str(e)}")
+            error = str(e)
+            self.log_message(f"监视过程中发生错误: {error}")
+            self.run_on_ui(lambda: messagebox.showerror("错误", f"监视过程中发生错误: {error}"))
         
         finally:
-            self.finish_conversion()
+            self.is_converting = False
+            self.run_on_ui(self.finish_conversion)
+    
+    def stop_watching(self):
+        """停止监视，等待正在转换的文件完成"""
+        self.is_converting = False
+        self.convert_button.config(state='disabled')
     
     def finish_conversion(self):
-        """完成转换，重置UI状态"""
+        """完成转换，重置UI状态（在主线程中调用）"""
         self.is_converting = False
-        self.convert_button.config(state='normal')
+        self.close_log_file()
+        self.convert_button.config(state='normal', text="开始转换", command=self.start_conversion)
         self.progress_var.set(0)
         self.progress_label.config(text="0%")
 
 
 def main():
     """主函数"""
+    # 打包后的可执行文件需要支持多进程
+    multiprocessing.freeze_support()
+    
     root = tk.Tk()
     
     # 设置主题样式
@@ -507,6 +743,15 @@ def main():
     
     app = ImageConverter(root)
     
+    if STARTUP_CHECK_ARG in sys.argv[1:]:
+        root.update()
+        root.destroy()
+        return
+    
+    # 窗口显示后在后台导入转换引擎，点击开始转换时不必再等待
+    root.after_idle(lambda: threading.Thread(target=import_engine, daemon=True,
+                                             name="imgtrans-import-engine").start())
+    
     # 设置窗口关闭事件
     def on_closing():
         if app.is_converting:
@@ -520,6 +765,12 @@ def main():
     
     # 启动主循环
     root.mainloop()
+    
+    # 转换中关闭窗口时，等待停止提交后正在转换的文件完成，转换日志完整写入后再退出，
+    # 下次勾选“断点续转”即可从中断处继续
+    if app.conversion_thread is not None:
+        app.conversion_thread.join(CLOSE_WAIT_SECONDS)
+    app.flush_log_events()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""多节点协同转换的租约协议：多个进程共用一个临时文件夹，每个文件只转换一次"""
+
+import multiprocessing
+import os
+import time
+
+import converter_cluster
+from converter_cluster import BUSY, CLAIMED, ClusterCoordinator
+
+SIGNATURE = "test"
+FILE_COUNT = 40
+LEASE_TIMEOUT = 0.5
+
+
+def make_task(input_folder, index):
+    name = f"{index:03d}.png"
+    return {'index': index, 'relative_path': name,
+            'input_path': os.path.join(input_folder, name)}
+
+
+def make_inputs(folder, count=FILE_COUNT):
+    os.makedirs(folder)
+    for index in range(count):
+        with open(os.path.join(folder, f"{index:03d}.png"), 'wb') as f:
+            f.write(b"input")
+
+
+def run_node(input_folder, output_folder, node_id, crash_after=None):
+    """一个节点：认领并“转换”所有文件，其他节点正在转换的文件稍后重试；
+    crash_after 不为 None 时认领这么多个文件后不释放租约直接退出"""
+    coordinator = ClusterCoordinator(output_folder, SIGNATURE, node_id,
+                                     lease_timeout=LEASE_TIMEOUT).start()
+    pending = list(range(FILE_COUNT))
+    claimed = 0
+    while pending:
+        busy = []
+        for index in pending:
+            task = make_task(input_folder, index)
+            state = coordinator.claim(task)
+            if state == BUSY:
+                busy.append(index)
+            if state != CLAIMED:
+                continue
+            claimed += 1
+            if crash_after is not None and claimed > crash_after:
+                os._exit(1)
+            output_path = os.path.join(output_folder, f"{index:03d}.jpg")
+            with open(output_path, 'wb') as f:
+                f.write(b"output")
+            # 每次转换追加一行，检查是否有文件被转换了两次
+            with open(os.path.join(output_folder, "converted.log"), 'a') as f:
+                f.write(f"{index} {node_id}\n")
+            coordinator.complete({'index': index, 'success': True, 'error': None,
+                                  'output_path': output_path})
+        pending = busy
+        if pending:
+            time.sleep(0.05)
+    coordinator.close()
+
+
+def converted_indexes(output_folder):
+    with open(os.path.join(output_folder, "converted.log")) as f:
+        return sorted(int(line.split()[0]) for line in f)
+
+
+def run_nodes(input_folder, output_folder, crash_after):
+    processes = [multiprocessing.Process(target=run_node,
+                                         args=(input_folder, output_folder, f"n{i}",
+                                               crash_after[i]))
+                 for i in range(len(crash_after))]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode is not None
+    return processes
+
+
+def test_each_file_converted_once(tmp_path):
+    input_folder = str(tmp_path / "in")
+    output_folder = str(tmp_path / "out")
+    make_inputs(input_folder)
+    os.makedirs(output_folder)
+    run_nodes(input_folder, output_folder, [None] * 4)
+    assert converted_indexes(output_folder) == list(range(FILE_COUNT))
+    
+    # 输入未变化时重新运行不再转换
+    run_nodes(input_folder, output_folder, [None] * 2)
+    assert converted_indexes(output_folder) == list(range(FILE_COUNT))
+
+
+def test_crashed_node_leases_are_reclaimed(tmp_path):
+    input_folder = str(tmp_path / "in")
+    output_folder = str(tmp_path / "out")
+    make_inputs(input_folder)
+    os.makedirs(output_folder)
+    processes = run_nodes(input_folder, output_folder, [3, None, None])
+    assert processes[0].exitcode == 1
+    assert converted_indexes(output_folder) == list(range(FILE_COUNT))
+    leases = [name for _, _, names in os.walk(output_folder) for name in names
+              if name.endswith((".lease", ".stale"))]
+    assert leases == []
+
+
+def test_reclaim_does_not_steal_fresh_lease(tmp_path, monkeypatch):
+    """B 判断租约过期后、改名之前，A 已经接手并创建了新租约：B 不能拿走 A 的租约"""
+    input_folder = str(tmp_path / "in")
+    output_folder = str(tmp_path / "out")
+    make_inputs(input_folder, 1)
+    a = ClusterCoordinator(output_folder, SIGNATURE, "a", lease_timeout=LEASE_TIMEOUT).start()
+    b = ClusterCoordinator(output_folder, SIGNATURE, "b", lease_timeout=LEASE_TIMEOUT).start()
+    task = make_task(input_folder, 0)
+    lease_path = a._paths(task['relative_path'])[0]
+    os.makedirs(os.path.dirname(lease_path), exist_ok=True)
+    with open(lease_path, 'w') as f:
+        f.write("crashed:0")
+    old = time.time() - 100
+    os.utime(lease_path, (old, old))
+    
+    real_rename = os.rename
+    
+    def racing_rename(source, target):
+        monkeypatch.setattr(converter_cluster.os, 'rename', real_rename)
+        assert a.claim(task) == CLAIMED
+        real_rename(source, target)
+    
+    monkeypatch.setattr(converter_cluster.os, 'rename', racing_rename)
+    try:
+        assert b.claim(task) == BUSY
+        token = a.leases[0][1]
+        assert a._owns(lease_path, token)
+        assert b.leases == {}
+        assert not [name for name in os.listdir(os.path.dirname(lease_path))
+                    if name.endswith(".stale")]
+    finally:
+        a.close()
+        b.close()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""按文件大小调整PNG：取不超过上限的最大结果并向目标逼近，试编码单独计数"""
+
+import random
+
+import pytest
+from PIL import Image, ImageFilter
+
+import converter_engine
+from converter_engine import FILESIZE_TOLERANCE
+
+
+@pytest.fixture(scope='module')
+def photo():
+    """颜色渐变加噪点的照片类图片，无损PNG很大，调色板各档位之间大小差距明显"""
+    rng = random.Random(1)
+    small = Image.frombytes('RGB', (80, 60), bytes(rng.randrange(256) for _ in range(80 * 60 * 3)))
+    img = small.resize((600, 450), Image.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+    noise = Image.frombytes('RGB', img.size, rng.randbytes(600 * 450 * 3)).point(lambda v: v // 6)
+    return Image.blend(img, noise, 0.3)
+
+
+@pytest.mark.parametrize('fraction', [0.15, 0.25, 0.4])
+def test_png_filesize_within_tolerance(photo, fraction):
+    # 目标落在256色和2色之间，应能在颜色数之间二分到误差范围内
+    palette_256 = converter_engine.encode_image(
+        converter_engine.quantize_image(photo, 256), 'png', compress_level=9).tell()
+    target = int(palette_256 * fraction)
+    buffer, used, trials = converter_engine.adjust_png_by_filesize(photo, target)
+    size = buffer.tell()
+    assert target * (1 - FILESIZE_TOLERANCE) <= size <= target * (1 + FILESIZE_TOLERANCE), used
+    assert trials >= 2
+
+
+def test_png_filesize_picks_largest_fit(photo):
+    target = 30 * 1024
+    upper = target * (1 + FILESIZE_TOLERANCE)
+    buffer, used, _ = converter_engine.adjust_png_by_filesize(photo, target)
+    size = buffer.tell()
+    assert size <= upper
+    # 未进入误差范围时，多一种颜色就会超过上限
+    colors = int(used.rstrip('色'))
+    if size < target * (1 - FILESIZE_TOLERANCE) and colors < 256:
+        more = converter_engine.encode_image(
+            converter_engine.quantize_image(photo, colors + 1), 'png', compress_level=9)
+        assert more.tell() > upper
+
+
+def test_png_downscale_reaches_target(photo):
+    target = 4 * 1024  # 2色也达不到，只能缩小尺寸
+    buffer, used, _ = converter_engine.adjust_png_by_filesize(photo, target, allow_downscale=True)
+    assert buffer.tell() <= target * (1 + FILESIZE_TOLERANCE)
+    assert "缩放" in used
+
+
+def test_png_trials_counted_separately(tmp_path, photo):
+    input_path = str(tmp_path / "photo.png")
+    photo.save(input_path)
+    (tmp_path / "out").mkdir()
+    for output_format, counter in (('png', 'png_trials'), ('jpg', 'full_encodes')):
+        settings = converter_engine.make_settings(output_format=output_format,
+                                                  adjustment_type="filesize",
+                                                  target_filesize=40, writer_threads=0)
+        task = converter_engine.make_task(0, input_path, str(tmp_path), str(tmp_path / "out"),
+                                          settings)
+        result = converter_engine.convert_image_file(task)
+        assert result['success'], result['error']
+        other = 'full_encodes' if counter == 'png_trials' else 'png_trials'
+        assert result[counter] > 0 and result[other] == 0
+        label = "PNG试编码" if output_format == 'png' else "完整编码"
+        assert any(label in message for message in result['messages'])
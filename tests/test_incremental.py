@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""增量转换和协同转换：查找后被删除的文件由转换过程报告错误，不中断批量转换；
+递归查找时跳过以前的输出文件夹"""
+
+import os
+
+import pytest
+from PIL import Image
+
+import converter_cluster
+import converter_engine
+
+
+def make_inputs(folder, count=3):
+    folder.mkdir(parents=True)
+    for index in range(count):
+        Image.new('RGB', (32, 24), (index * 60, 0, 0)).save(folder / f"{index}.png")
+
+
+def run(input_folder, output_folder, **options):
+    settings = converter_engine.make_settings(workers=1, writer_threads=0, **options)
+    results = []
+    summary = converter_engine.run_batch(str(input_folder), str(output_folder), settings,
+                                         on_result=lambda result, *_: results.append(result))
+    return summary, results
+
+
+@pytest.mark.parametrize('options', [{'incremental': True},
+                                     {'incremental': True, 'resume': True},
+                                     {'cluster': True}])
+def test_file_deleted_after_discovery(tmp_path, monkeypatch, options):
+    input_folder, output_folder = tmp_path / "in", tmp_path / "out"
+    make_inputs(input_folder)
+    iter_image_files = converter_engine.iter_image_files
+    
+    def vanishing_files(*args, **kwargs):
+        yield from iter_image_files(*args, **kwargs)
+        yield str(input_folder / "gone.png")  # 查找到之后被删除
+    
+    monkeypatch.setattr(converter_engine, 'iter_image_files', vanishing_files)
+    summary, results = run(input_folder, output_folder, **options)
+    assert summary['converted'] == 3 and summary['failed'] == 1
+    assert [result['filename'] for result in results if not result['success']] == ["gone.png"]
+
+
+def test_cluster_claim_of_missing_file(tmp_path):
+    coordinator = converter_cluster.ClusterCoordinator(str(tmp_path), "test", "node").start()
+    try:
+        task = {'index': 0, 'relative_path': "gone.png",
+                'input_path': os.path.join(str(tmp_path), "gone.png")}
+        assert coordinator.claim(task) == converter_cluster.CLAIMED
+        coordinator.complete({'index': 0, 'success': False, 'error': "missing",
+                              'output_path': os.path.join(str(tmp_path), "gone.jpg")})
+    finally:
+        coordinator.close()
+
+
+def test_recursive_skips_earlier_output_folders(tmp_path):
+    input_folder = tmp_path / "in"
+    make_inputs(input_folder)
+    make_inputs(input_folder / "sub", count=1)
+    # 前一天的默认输出文件夹和自定义名字的增量输出文件夹都在输入文件夹内
+    assert run(input_folder, input_folder / "imgTrans-20240101", recursive=True)[0]['converted'] == 4
+    assert run(input_folder, input_folder / "custom", recursive=True,
+               incremental=True)[0]['converted'] == 4
+    summary, results = run(input_folder, tmp_path / "out", recursive=True)
+    assert summary['converted'] == 4
+    assert not any("imgTrans" in result['output_path'] or "custom" in result['output_path']
+                   for result in results)
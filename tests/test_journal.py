@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""批量转换日志：崩溃后不完整的记录、设置签名，以及与增量转换配合的断点续转"""
+
+import os
+from types import SimpleNamespace
+
+from PIL import Image
+
+import converter_engine
+import converter_journal
+from converter_journal import BatchJournal, encode_record
+
+
+def test_parse_records_ignores_truncated_last_line():
+    text = encode_record({'s': 'start', 'f': 'a.png'}) + encode_record({'s': 'done', 'f': 'a.png'})
+    assert converter_journal.parse_records(text + '{"s":"do') == [
+        {'s': 'start', 'f': 'a.png'}, {'s': 'done', 'f': 'a.png'}]
+
+
+def test_parse_records_skips_corrupt_lines():
+    text = encode_record({'f': 'a.png'}) + "not json\n" + encode_record({'f': 'b.png'})
+    assert converter_journal.parse_records(text.rstrip('\n')) == [{'f': 'a.png'}, {'f': 'b.png'}]
+
+
+def write_journal(folder, signature, records, tail=""):
+    with open(os.path.join(folder, converter_journal.JOURNAL_FILENAME), 'w',
+              encoding='utf-8') as f:
+        f.write(encode_record({'version': converter_journal.JOURNAL_VERSION,
+                               'settings': signature}))
+        f.writelines(encode_record(record) for record in records)
+        f.write(tail)
+
+
+def test_load_counts_last_state_of_each_file(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"output")
+    write_journal(str(tmp_path), "sig", [
+        {'s': 'start', 'f': 'a.png'},
+        {'s': 'done', 'f': 'a.png', 'size': 1, 'mtime_ns': 2, 'out': 'a.jpg'},
+        {'s': 'start', 'f': 'b.png'},
+        {'s': 'fail', 'f': 'b.png', 'error': "x"},
+        {'s': 'start', 'f': 'c.png'},
+    ], tail='{"s":"done","f":"c.p')
+    journal = BatchJournal(str(tmp_path), "sig").load()
+    assert journal.previous == {'completed': 1, 'failed': 1, 'in_flight': 1}
+    assert journal.is_completed('a.png', SimpleNamespace(st_size=1, st_mtime_ns=2))
+    
+    # 设置不同的日志不用于续转
+    assert BatchJournal(str(tmp_path), "other").load().completed == {}
+
+
+def make_inputs(folder, count=3):
+    folder.mkdir()
+    for index in range(count):
+        Image.new('RGB', (32, 24), (index * 60, 0, 0)).save(folder / f"{index}.png")
+
+
+def run(input_folder, output_folder, **options):
+    settings = converter_engine.make_settings(workers=1, writer_threads=0, **options)
+    return converter_engine.run_batch(str(input_folder), str(output_folder), settings)
+
+
+def test_resume_after_incremental_run_skips_unchanged(tmp_path):
+    input_folder, output_folder = tmp_path / "in", tmp_path / "out"
+    make_inputs(input_folder)
+    assert run(input_folder, output_folder, incremental=True)['converted'] == 3
+    # 第二次增量转换全部跳过，日志仍要记录这些文件已完成
+    summary = run(input_folder, output_folder, incremental=True)
+    assert summary['skipped'] == 3 and summary['converted'] == 0
+    
+    Image.new('RGB', (32, 24), (0, 0, 255)).save(input_folder / "1.png")
+    os.utime(input_folder / "1.png", ns=(1, 1))
+    summary = run(input_folder, output_folder, resume=True)
+    assert summary['resumed'] == 2
+    assert summary['converted'] == 1
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""进程池中的工作进程异常退出时，该文件记为失败，其余文件换新的进程池继续转换"""
+
+import os
+import time
+
+import pytest
+
+import converter_engine
+
+CRASH_INDEX = 3
+
+
+def crash_on_one(task):
+    """模拟被系统终止的工作进程：转换到指定文件时直接退出"""
+    if task['index'] == CRASH_INDEX:
+        os._exit(1)
+    time.sleep(0.01)
+    result = converter_engine.new_result(task)
+    result['success'] = True
+    return result
+
+
+def make_tasks(count=12):
+    return [{'index': index, 'input_path': f"{index}.png", 'output_path': f"{index}.jpg"}
+            for index in range(count)]
+
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_worker_crash_fails_only_its_file(ordered):
+    results = list(converter_engine.iter_conversion_results(
+        make_tasks(), 2, ordered=ordered, function=crash_on_one))
+    assert sorted(result['index'] for result in results) == list(range(12))
+    failed = [result for result in results if not result['success']]
+    # 其他在途文件在隔离进程池中重新转换，只有导致退出的文件记为失败
+    assert [result['index'] for result in failed] == [CRASH_INDEX]
+    assert "工作进程异常退出" in failed[0]['error']
+    if ordered:
+        assert [result['index'] for result in results] == list(range(12))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""预扫描：超过Pillow像素数上限的超大图片和无法读取的文件的估算"""
+
+import struct
+import zlib
+
+from PIL import Image
+
+import converter_engine
+import converter_schedule
+
+
+def png_header(path, width, height):
+    """只有文件头的PNG（Pillow打开时读到IDAT为止，不解码像素）"""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n'
+                + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+                + chunk(b'IDAT', b'') + chunk(b'IEND', b''))
+
+
+def make_task(index, path, settings):
+    return {'index': index, 'input_path': str(path), 'settings': settings}
+
+
+def test_prescan_reads_gigapixel_header(tmp_path):
+    settings = converter_engine.make_settings(largest_first=True, memory_limit_mb=1024)
+    huge, small, broken = tmp_path / "huge.png", tmp_path / "small.png", tmp_path / "broken.png"
+    png_header(huge, 20000, 15000)  # 3亿像素，超过Pillow默认上限的两倍
+    Image.new('RGB', (64, 48)).save(small)
+    broken.write_bytes(b"not an image")
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
+    
+    tasks = converter_schedule.prescan_tasks(
+        [make_task(i, path, settings) for i, path in enumerate((small, broken, huge))])
+    assert Image.MAX_IMAGE_PIXELS == max_image_pixels
+    prescan = {task['index']: task['prescan'] for task in tasks}
+    assert prescan[2]['pixels'] == 20000 * 15000
+    assert prescan[2]['memory'] >= 20000 * 15000 * 3
+    # 无法读取的文件按总内存上限估算，不会和其他图片一起被放行
+    assert prescan[1]['pixels'] == 0
+    assert prescan[1]['memory'] == 1024 * 2 ** 20
+    assert [task['index'] for task in converter_schedule.largest_first(tasks)][0] == 2
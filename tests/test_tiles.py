@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""大尺寸TIFF分块处理：条带读取、PNG/APNG逐块写入，以及不能分块时的处理"""
+
+import io
+
+import pytest
+from PIL import Image
+
+import converter_engine
+import converter_tiles
+
+
+def sample_image(mode, size=(97, 61)):
+    img = Image.effect_noise(size, 60).convert('L')
+    if mode == 'L':
+        return img
+    if mode == 'I;16':
+        return img.point(lambda value: value * 257, 'I').convert('I;16')
+    bands = [img, img.rotate(90, expand=False), img.transpose(Image.Transpose.FLIP_LEFT_RIGHT),
+             img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)]
+    return Image.merge(mode, bands[:len(mode)])
+
+
+def same_pixels(a, b):
+    if a.mode.startswith('I'):
+        a, b = a.convert('I'), b.convert('I')
+    return a.mode == b.mode and a.size == b.size and a.tobytes() == b.tobytes()
+
+
+@pytest.mark.parametrize('mode', ['L', 'I;16', 'RGB', 'LA', 'RGBA'])
+def test_png_stream_writer_bands(mode):
+    img = sample_image(mode)
+    output = io.BytesIO()
+    writer = converter_tiles.PngStreamWriter(output, img.size, mode, compress_level=1)
+    # 大小不一的条带，检查条带之间的Up滤波衔接
+    for y0, y1 in [(0, 1), (1, 20), (20, 21), (21, 61)]:
+        writer.write_band(img.crop((0, y0, img.size[0], y1)))
+    writer.close()
+    
+    output.seek(0)
+    with Image.open(output) as decoded:
+        decoded.load()
+        assert same_pixels(decoded, img)
+
+
+def test_png_stream_writer_apng():
+    frames = [sample_image('RGB').rotate(angle) for angle in (0, 90, 180)]
+    output = io.BytesIO()
+    writer = converter_tiles.PngStreamWriter(output, frames[0].size, 'RGB', num_frames=3, loop=2)
+    for index, frame in enumerate(frames):
+        writer.begin_frame(duration_ms=100 * (index + 1))
+        writer.write_band(frame.crop((0, 0, frame.size[0], 30)))
+        writer.write_band(frame.crop((0, 30, frame.size[0], frame.size[1])))
+        writer.end_frame()
+    writer.close()
+    
+    output.seek(0)
+    with Image.open(output) as decoded:
+        assert decoded.n_frames == 3
+        assert decoded.info.get('loop') == 2
+        for index, frame in enumerate(frames):
+            decoded.seek(index)
+            decoded.load()
+            assert decoded.info['duration'] == 100 * (index + 1)
+            assert same_pixels(decoded.convert('RGB'), frame)
+
+
+def test_load_band_matches_crop(tmp_path):
+    img = sample_image('RGB', (300, 200))
+    path = str(tmp_path / "raw.tif")
+    img.save(path)
+    band, top = converter_tiles.load_band(path, 57, 133)
+    assert top <= 57 and top + band.size[1] >= 133
+    assert same_pixels(band.crop((0, 57 - top, 300, 133 - top)), img.crop((0, 57, 300, 133)))
+
+
+def convert(tmp_path, name, output_format, budget_mb=1, **save_options):
+    img = sample_image('RGB', (1000, 800))
+    input_path = str(tmp_path / name)
+    img.save(input_path, **save_options)
+    settings = converter_engine.make_settings(output_format=output_format, writer_threads=0,
+                                              memory_budget_mb=budget_mb)
+    task = converter_engine.make_task(0, input_path, str(tmp_path), str(tmp_path / "out"),
+                                      settings)
+    (tmp_path / "out").mkdir(exist_ok=True)
+    result = converter_engine.convert_image_file(task)
+    assert result['success'], result['error']
+    with Image.open(task['output_path']) as output:
+        assert output.size == img.size
+    return result['messages']
+
+
+def test_uncompressed_tiff_to_png_in_bands(tmp_path):
+    messages = convert(tmp_path, "raw.tif", "png")
+    assert any("分块处理" in message for message in messages)
+
+
+@pytest.mark.parametrize('output_format', ['jpg', 'webp'])
+def test_full_output_over_budget_falls_back_with_warning(tmp_path, output_format):
+    messages = convert(tmp_path, "raw.tif", output_format)
+    assert any("警告" in message and "只有png输出" in message for message in messages)
+
+
+def test_compressed_tiff_falls_back_with_warning(tmp_path):
+    messages = convert(tmp_path, "lzw.tif", "png", compression='tiff_lzw')
+    assert any("警告" in message and "未压缩TIFF" in message for message in messages)